@@ -394,12 +394,27 @@ function Dashboard({ token, userEmail, onLogout }) {
     const [lastRefresh, setLastRefresh] = useState(null)
     const { toasts, add: addToast } = useToasts()
     const intervalRef = useRef(null)
+    const versionRef = useRef(null)
 
+    // /vehicles/live : liste complète au premier appel, puis seulement les boîtiers modifiés
     const fetchDevices = useCallback(async () => {
         setFetching(true)
         try {
-            const data = await apiFetch('/vehicles/', token)
-            setDevices(data)
+            const since = versionRef.current !== null ? `?since_version=${encodeURIComponent(versionRef.current)}` : ''
+            const data = await apiFetch(`/vehicles/live${since}`, token)
+            versionRef.current = data.version
+            if (data.full) {
+                setDevices(data.vehicles)
+            } else if (data.vehicles.length || data.removed.length) {
+                setDevices(prev => {
+                    const changed = new Map(data.vehicles.map(v => [v.id_vehicule, v]))
+                    const kept = prev
+                        .filter(d => !data.removed.includes(d.id_vehicule))
+                        .map(d => changed.get(d.id_vehicule) || d)
+                    const known = new Set(kept.map(d => d.id_vehicule))
+                    return [...kept, ...data.vehicles.filter(v => !known.has(v.id_vehicule))]
+                })
+            }
             setLastRefresh(new Date())
         } catch (err) {
             addToast(`Erreur de chargement : ${err.message}`, 'error')
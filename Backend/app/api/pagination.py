@@ -0,0 +1,42 @@
+"""
+Keyset (cursor) pagination.
+A cursor is the sort key of the last item of a page, as URL-safe base64 JSON. The next
+page is read with a row-value comparison on that key, so its cost does not depend on
+how deep the page is. The cursor of the next page is returned in the X-Next-Cursor
+header; it is absent on the last page.
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Callable, Sequence
+
+from fastapi import HTTPException, Response
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(*values: Any) -> str:
+    raw = json.dumps([v.isoformat() if isinstance(v, datetime) else v for v in values])
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str, *types: type) -> tuple:
+    """Decode a cursor into values of the given types. Raises 400 on a malformed cursor."""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        values = json.loads(raw)
+        if not isinstance(values, list) or len(values) != len(types):
+            raise ValueError("wrong key length")
+        return tuple(
+            datetime.fromisoformat(value) if kind is datetime else kind(value)
+            for value, kind in zip(values, types)
+        )
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=400, detail="Curseur de pagination invalide")
+
+
+def set_next_cursor(response: Response, items: Sequence, limit: int, key: Callable[[Any], tuple]):
+    """Set X-Next-Cursor from the last item when the page is full."""
+    if items and len(items) == limit:
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(*key(items[-1]))
@@ -15,3 +15,5 @@ from app.api.v1.endpoints import users
 api_router.include_router(users.router, prefix="/users", tags=["users"])
 from app.api.v1.endpoints import chirpstack_webhook
 api_router.include_router(chirpstack_webhook.router, prefix="/chirpstack", tags=["chirpstack"])
+from app.api.v1.endpoints import metrics
+api_router.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
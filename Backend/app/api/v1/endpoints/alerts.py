@@ -1,9 +1,11 @@
 from typing import Any, List, Optional
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, HTTPException, Response
+from sqlalchemy import tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app import models, schemas
 from app.api import deps
+from app.api.pagination import decode_cursor, set_next_cursor
 from app.services.notification_service import manager
 from datetime import datetime
 from pydantic import BaseModel
@@ -32,13 +34,16 @@ class AlertOut(BaseModel):
 
 @router.get("/", response_model=List[AlertOut])
 async def read_alerts(
+    response: Response,
     db: AsyncSession = Depends(deps.get_db),
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
     current_user: models.User = Depends(deps.get_current_active_user),
 ):
     """
-    Retrieve alerts for the current user's vehicles.
+    Retrieve alerts for the current user's vehicles, most recent first.
+    Paginated with the X-Next-Cursor header (see read_positions).
     """
     # Get vehicles for user
     result = await db.execute(
@@ -50,14 +55,19 @@ async def read_alerts(
     if not vehicle_ids:
         return []
 
-    result = await db.execute(
+    query = (
         select(models.Alert)
         .where(models.Alert.id_vehicule.in_(vehicle_ids))
-        .order_by(models.Alert.created_at.desc())
-        .offset(skip)
+        .order_by(models.Alert.created_at.desc(), models.Alert.id_alerte.desc())
         .limit(limit)
     )
+    if cursor:
+        query = query.where(tuple_(models.Alert.created_at, models.Alert.id_alerte) < decode_cursor(cursor, datetime, int))
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query)
     alerts = result.scalars().all()
+    set_next_cursor(response, alerts, limit, lambda a: (a.created_at, a.id_alerte))
     return alerts
 
 @router.post("/", response_model=AlertOut)
@@ -1,30 +1,52 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException
+from typing import Any, List, Optional
+from decimal import Decimal
+from fastapi import APIRouter, Depends, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.api import deps
+from app.api.pagination import decode_cursor, set_next_cursor
 from app.models.user import User
 from app.models.zone import Zone
 from app.models.vehicle import Vehicle
 from app.models.vehicle import Vehicle
 from app.schemas import zone as schemas
 from app.services.chirpstack import send_downlink
+from app.services.geofencing_service import geofence_index
+from app.services.zone_reevaluation import zone_reevaluation
+from app.models.reevaluation import ZoneReevaluation
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
+# Fields whose change invalidates the positions already evaluated against the zone
+GEOMETRY_FIELDS = ("type", "coordinates", "latitude_centre", "longitude_centre", "rayon_metres", "active", "id_vehicule")
+
+def _geometry_changed(zone: Zone, update_data: dict) -> bool:
+    for field in GEOMETRY_FIELDS:
+        if field not in update_data:
+            continue
+        old = getattr(zone, field)
+        if isinstance(old, Decimal):
+            old = float(old)
+        if old != update_data[field]:
+            return True
+    return False
+
 @router.get("/", response_model=List[schemas.Zone])
 async def read_zones(
+    response: Response,
     db: AsyncSession = Depends(deps.get_db),
     current_user: User = Depends(deps.get_current_active_user),
     skip: int = 0,
     limit: int = 100,
     vehicle_id: int = None,
+    cursor: Optional[str] = None,
 ) -> Any:
     """
     Retrieve zones. Can filter by vehicle_id.
+    Ordered by id; paginated with the X-Next-Cursor header.
     """
     query = select(Zone)
     
@@ -38,9 +60,15 @@ async def read_zones(
          query = query.join(Vehicle, Zone.id_vehicule == Vehicle.id_vehicule, isouter=True) \
                       .where((Vehicle.id_utilisateur_proprietaire == current_user.id_utilisateur) | (Zone.id_vehicule == None))
     
-    query = query.offset(skip).limit(limit)
+    query = query.order_by(Zone.id_zone).limit(limit)
+    if cursor:
+        (last_id,) = decode_cursor(cursor, int)
+        query = query.where(Zone.id_zone > last_id)
+    else:
+        query = query.offset(skip)
     result = await db.execute(query)
     zones = result.scalars().all()
+    set_next_cursor(response, zones, limit, lambda z: (z.id_zone,))
     return zones
 
 @router.post("/", response_model=schemas.Zone)
@@ -85,6 +113,7 @@ async def create_zone(
     db.add(zone)
     await db.commit()
     await db.refresh(zone)
+    geofence_index.invalidate(zone.id_vehicule)
 
     # Trigger downlink if linked to vehicle AND active
     # MOVED TO BACKEND: We no longer send zone coordinates to device
@@ -129,8 +158,10 @@ async def update_zone(
 
     # Capture old state
     was_active = zone.active
+    old_vehicle_id = zone.id_vehicule
 
     update_data = zone_in.model_dump(exclude_unset=True)
+    geometry_changed = _geometry_changed(zone, update_data)
     for field, value in update_data.items():
         setattr(zone, field, value)
     
@@ -152,6 +183,12 @@ async def update_zone(
     db.add(zone)
     await db.commit()
     await db.refresh(zone)
+    geofence_index.invalidate(old_vehicle_id)
+    geofence_index.invalidate(zone.id_vehicule)
+
+    # Stored dans_zone / distance_zone_metres are stale: recompute them in the background
+    if geometry_changed and zone.active and zone.id_vehicule:
+        await zone_reevaluation.schedule(zone.id_zone, zone.id_vehicule)
 
     # Trigger downlink logic
     # MOVED TO BACKEND: We no longer sync zone coordinates to vehicle
@@ -194,4 +231,37 @@ async def delete_zone(
 
     await db.delete(zone)
     await db.commit()
+    geofence_index.invalidate(zone.id_vehicule)
     return zone
+
+@router.get("/{id}/reevaluation", response_model=schemas.ZoneReevaluation)
+async def read_zone_reevaluation(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    id: int,
+    current_user: User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    Progress of the latest history re-evaluation of a zone.
+    """
+    result = await db.execute(select(Zone).where(Zone.id_zone == id))
+    zone = result.scalars().first()
+    if not zone:
+        raise HTTPException(status_code=404, detail="Zone not found")
+
+    if zone.id_vehicule:
+        result = await db.execute(select(Vehicle).where(Vehicle.id_vehicule == zone.id_vehicule))
+        vehicle = result.scalars().first()
+        if current_user.role != "ADMIN" and vehicle.id_utilisateur_proprietaire != current_user.id_utilisateur:
+             raise HTTPException(status_code=400, detail="Not enough permissions")
+
+    result = await db.execute(
+        select(ZoneReevaluation)
+        .where(ZoneReevaluation.id_zone == id)
+        .order_by(ZoneReevaluation.id_reevaluation.desc())
+        .limit(1)
+    )
+    job = result.scalars().first()
+    if not job:
+        raise HTTPException(status_code=404, detail="No re-evaluation for this zone")
+    return job
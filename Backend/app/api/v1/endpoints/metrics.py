@@ -0,0 +1,44 @@
+from typing import Any
+from fastapi import APIRouter, Depends, HTTPException
+from app.api import deps
+from app.models.user import User
+from app.services.deveui_resolver import deveui_resolver
+from app.services.ingestion import uplink_batcher
+from app.services.geofencing_service import geofence_index
+from app.services.chirpstack import downlink_dispatcher
+from app.services.command_service import command_worker
+from app.services.scheduler import scheduler
+from app.services.mqtt_ingestion import mqtt_consumer
+from app.services.stationary import stationary
+from app.services.gps_quality import gps_filter
+from app.services.fcnt_window import fcnt_window
+from app.services.admission import admission
+from app.services.vehicle_state import vehicle_state
+from app.services.notification_service import manager
+
+router = APIRouter()
+
+@router.get("/ingestion")
+async def read_ingestion_metrics(
+    current_user: User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    [ADMIN ONLY] Counters of the uplink ingestion path.
+    """
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Réservé aux administrateurs")
+    return {
+        "deveui_resolver": deveui_resolver.stats(),
+        "batcher": uplink_batcher.stats(),
+        "geofence_index": geofence_index.stats(),
+        "downlinks": downlink_dispatcher.stats(),
+        "commands": command_worker.stats(),
+        "scheduler": scheduler.stats(),
+        "mqtt": mqtt_consumer.stats(),
+        "stationary": stationary.stats(),
+        "gps_quality": gps_filter.stats(),
+        "fcnt_window": fcnt_window.stats(),
+        "admission": admission.stats(),
+        "vehicle_state": vehicle_state.stats(),
+        "websocket": manager.stats(),
+    }
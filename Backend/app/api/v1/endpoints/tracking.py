@@ -1,44 +1,129 @@
-from typing import Any, List
-from fastapi import APIRouter, Depends, HTTPException, Body
+import asyncio
+from datetime import datetime, timedelta
+from typing import Any, List, Optional
+from fastapi import APIRouter, Depends, HTTPException, Body, Query, Response
+from sqlalchemy import Float, cast, func, or_, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.api import deps
+from app.api.pagination import decode_cursor, set_next_cursor
+from app.core.config import settings
 from app.models.user import User
 from app.models.vehicle import Vehicle
 from app.models.position import Position
 from app.schemas import position as schemas
+from app.services.track_simplifier import TrackSimplifier
+from app.services.vehicle_state import vehicle_state
 
 router = APIRouter()
 
+TRACK_CHUNK_SIZE = 5000
+
+async def _get_readable_vehicle(db: AsyncSession, vehicle_id: int, current_user: User) -> Vehicle:
+    result = await db.execute(select(Vehicle).where(Vehicle.id_vehicule == vehicle_id))
+    vehicle = result.scalars().first()
+    if not vehicle:
+        raise HTTPException(status_code=404, detail="Vehicle not found")
+        
+    if current_user.role != "ADMIN" and vehicle.id_utilisateur_proprietaire != current_user.id_utilisateur:
+        raise HTTPException(status_code=400, detail="Not enough permissions")
+    return vehicle
+
+@router.get("/{vehicle_id}/track", response_model=schemas.Track)
+async def read_track(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    vehicle_id: int,
+    current_user: User = Depends(deps.get_current_active_user),
+    start: Optional[datetime] = Query(None, alias="from"),
+    end: Optional[datetime] = Query(None, alias="to"),
+    max_points: int = Query(1000, ge=2, le=10000),
+    tolerance_m: float = Query(5.0, ge=0),
+) -> Any:
+    """
+    Simplified track of a vehicle between `from` and `to` (default: the last 24 hours).
+    `tolerance_m` is the map resolution: deviations below it are dropped (e.g. metres per
+    pixel at the displayed zoom). At most `max_points` points are returned.
+    Stops are always kept, with `timestamp_fin` set to the end of the stop; a stop that
+    began before `from` but lasted into the window is included.
+    """
+    await _get_readable_vehicle(db, vehicle_id, current_user)
+    end = end or datetime.utcnow()
+    start = start or end - timedelta(days=1)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="'from' must be before 'to'")
+
+    simplifier = TrackSimplifier(tolerance_m)
+    stream = await db.stream(
+        select(
+            Position.timestamp_gps,
+            cast(Position.latitude, Float),
+            cast(Position.longitude, Float),
+            Position.timestamp_fin,
+        )
+        .where(
+            Position.id_vehicule == vehicle_id,
+            # Not the fixes flagged by the GPS quality gate (rows from before the column have NULL)
+            or_(Position.fix_status.is_(None), Position.fix_status != 0),
+            # A stationary run lasts at most STATIONARY_MAX_RUN_SECONDS: bounded lookback
+            Position.timestamp_gps >= start - timedelta(seconds=settings.STATIONARY_MAX_RUN_SECONDS),
+            func.coalesce(Position.timestamp_fin, Position.timestamp_gps) >= start,
+            Position.timestamp_gps <= end,
+        )
+        .order_by(Position.timestamp_gps, Position.id_position)
+        .execution_options(yield_per=TRACK_CHUNK_SIZE)
+    )
+    async for rows in stream.partitions(TRACK_CHUNK_SIZE):
+        timestamps, lats, lons, ends = zip(*rows)
+        await asyncio.to_thread(simplifier.add, timestamps, lats, lons, ends)
+    points = await asyncio.to_thread(simplifier.finish, max_points)
+
+    return {
+        "vehicle_id": vehicle_id,
+        "start": start,
+        "end": end,
+        "tolerance_m": tolerance_m,
+        "total_points": simplifier.total,
+        "dropped_points": simplifier.total - len(points),
+        "points": [
+            {"latitude": lat, "longitude": lon, "timestamp_gps": ts, "timestamp_fin": ts_end}
+            for ts, lat, lon, ts_end in points
+        ],
+    }
+
 @router.get("/{vehicle_id}", response_model=List[schemas.Position])
 async def read_positions(
     *,
     db: AsyncSession = Depends(deps.get_db),
     vehicle_id: int,
+    response: Response,
     current_user: User = Depends(deps.get_current_active_user),
     skip: int = 0,
     limit: int = 100,
+    cursor: Optional[str] = None,
 ) -> Any:
     """
-    Retrieve positions for a vehicle.
+    Retrieve positions for a vehicle, most recent first.
+    Pass the X-Next-Cursor header of a page as `cursor` to get the next one;
+    `skip` is still accepted for older clients but gets slower on deep pages.
     """
     # Check permissions
-    result = await db.execute(select(Vehicle).where(Vehicle.id_vehicule == vehicle_id))
-    vehicle = result.scalars().first()
-    if not vehicle:
-        raise HTTPException(status_code=404, detail="Vehicle not found")
-        
-    if current_user.role != "ADMIN" and vehicle.id_utilisateur_proprietaire != current_user.id_utilisateur:
-        raise HTTPException(status_code=400, detail="Not enough permissions")
+    await _get_readable_vehicle(db, vehicle_id, current_user)
 
-    result = await db.execute(
+    # Served by idx_position_vehicule_keyset (id_vehicule, timestamp_gps DESC, id_position DESC)
+    query = (
         select(Position)
-        .where(Position.id_vehicule == vehicle_id)
-        .order_by(Position.timestamp_gps.desc())
-        .offset(skip)
+        .where(Position.id_vehicule == vehicle_id, or_(Position.fix_status.is_(None), Position.fix_status != 0))
+        .order_by(Position.timestamp_gps.desc(), Position.id_position.desc())
         .limit(limit)
     )
+    if cursor:
+        query = query.where(tuple_(Position.timestamp_gps, Position.id_position) < decode_cursor(cursor, datetime, int))
+    else:
+        query = query.offset(skip)
+    result = await db.execute(query)
     positions = result.scalars().all()
+    set_next_cursor(response, positions, limit, lambda p: (p.timestamp_gps, p.id_position))
     return positions
 
 @router.post("/", response_model=schemas.Position)
@@ -60,7 +145,13 @@ async def create_position(
     db.add(position)
     await db.commit()
     await db.refresh(position)
-    
-    # Note: Triggers in SQL will handle update of vehicle last position and alert generation
-    
+
+    # The vehicle's last position is written behind, as for uplinks (services/vehicle_state.py);
+    # a HORS_ZONE/ALERT position still gets its alert from trg_create_alerte_hors_zone
+    last = vehicle_state.get(vehicle.id_vehicule)
+    if last is None or last.derniere_communication is None or last.derniere_communication < position.timestamp_gps:
+        vehicle_state.update(
+            vehicle.id_vehicule, position.timestamp_gps, float(position.latitude), float(position.longitude), None
+        )
+
     return position
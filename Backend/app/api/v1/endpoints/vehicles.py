@@ -1,6 +1,6 @@
-from typing import Any, List
+from typing import Any, List, Optional
 from datetime import datetime
-from fastapi import APIRouter, Depends, HTTPException
+from fastapi import APIRouter, Depends, Header, HTTPException, Response
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.api import deps
@@ -8,73 +8,32 @@ from app.models.user import User
 from app.models.vehicle import Vehicle, VehicleStatus
 from app.schemas import vehicle as schemas
 
-from app.services.chirpstack import send_stop_command, send_command, register_device_in_chirpstack, delete_device_from_chirpstack, send_downlink
+from app.services.chirpstack import register_device_in_chirpstack, delete_device_from_chirpstack, send_downlink
 from app.models.zone import Zone
+from app.models.command import CommandType
+from app.services.command_service import command_worker, enqueue_command
+from app.services.deveui_resolver import deveui_resolver
+from app.services.notification_service import manager
+from app.services.vehicle_state import vehicle_state
 import logging
 
 logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
-async def _apply_command_timeouts(vehicles: List[Vehicle], db: AsyncSession):
-    """
-    Check if any vehicle has a pending command that timed out (> 300s).
-    If so, reset the pending flag.
-    LoRaWAN round-trip: uplink interval + RX window + 12s Arduino delay → can exceed 60s easily.
-    """
-    TIMEOUT_SECONDS = 300  # 5 minutes
-    now = datetime.utcnow()
-    changed = False
-    for v in vehicles:
-        if v.moteur_en_attente and v.moteur_commande_timestamp:
-            ts = v.moteur_commande_timestamp
-            # Handle timezone-aware timestamps from DB
-            if ts.tzinfo is not None:
-                import pytz
-                ts = ts.replace(tzinfo=None)  # strip tz for naive comparison
-            delta = (now - ts).total_seconds()
-            logger.info(f"[Timeout check] {v.deveui}: delta={delta:.1f}s, moteur_en_attente={v.moteur_en_attente}")
-            if delta > TIMEOUT_SECONDS:
-                logger.warning(f"Timeout ({TIMEOUT_SECONDS}s) for engine command on {v.deveui}. Resetting.")
-                v.moteur_en_attente = False
-                v.moteur_commande_timestamp = None
-                changed = True
-
-                # Create Timeout Alert
-                from app.models.alert import Alert
-                nom_vehicule = v.immatriculation or v.nom or v.deveui
-                timeout_alert = Alert(
-                    id_vehicule=v.id_vehicule,
-                    type_alerte="MOTEUR_COUPE",
-                    severite="CRITIQUE",
-                    message=f"Erreur de communication : Le boîtier du véhicule {nom_vehicule} n'a pas répondu à la commande dans les 5 minutes.",
-                    details_json=f'{{"action": "command_timeout", "deveui": "{v.deveui}"}}',
-                    created_at=datetime.utcnow(),
-                    acquittee=False
-                )
-                db.add(timeout_alert)
-                
-                try:
-                    from app.services.notification_service import manager
-                    import asyncio
-                    message_data = {
-                        "type": "NEW_ALERT",
-                        "data": {
-                            "id": 0,
-                            "vehicle_id": v.id_vehicule,
-                            "message": timeout_alert.message,
-                            "severity": timeout_alert.severite,
-                            "timestamp": timeout_alert.created_at.isoformat()
-                        }
-                    }
-                    if v.id_utilisateur_proprietaire:
-                        asyncio.create_task(manager.send_personal_message(message_data, v.id_utilisateur_proprietaire))
-                except Exception as e:
-                    logger.warning(f"Could not broadcast timeout alert: {e}")
-    if changed:
-        db.add_all(vehicles)
-        await db.commit()
-    return vehicles
+
+def with_last_state(vehicle: Vehicle) -> schemas.Vehicle:
+    """Vehicle response with its last position from the write-behind store or the row, whichever is newer."""
+    out = schemas.Vehicle.model_validate(vehicle)
+    state = vehicle_state.get(vehicle.id_vehicule)
+    # The row may be ahead of this worker's store (fix stored by another worker, direct SQL)
+    if state is not None and state.derniere_communication is not None and (
+        vehicle.derniere_communication is None or state.derniere_communication > vehicle.derniere_communication
+    ):
+        out.derniere_communication = state.derniere_communication
+        out.derniere_position_lat = state.derniere_position_lat
+        out.derniere_position_lon = state.derniere_position_lon
+    return out
 
 # ── LIST ──────────────────────────────────────────────────────────────────────
 
@@ -95,9 +54,38 @@ async def read_vehicles(
             .offset(skip)
             .limit(limit)
         )
-    vehicles = result.scalars().all()
-    await _apply_command_timeouts(list(vehicles), db)
-    return vehicles
+    return [with_last_state(vehicle) for vehicle in result.scalars().all()]
+
+# ── LIVE (snapshot versionné, servi depuis la mémoire) ───────────────────────
+
+@router.get("/live", response_model=schemas.LiveFleet)
+async def read_live_vehicles(
+    response: Response,
+    current_user: User = Depends(deps.get_current_active_user),
+    since_version: Optional[str] = None,
+    if_none_match: Optional[str] = Header(None),
+) -> Any:
+    """
+    Live state of the fleet (own vehicles, or all for ADMIN), from the in-memory store.
+    Without since_version: full snapshot. With the `version` token of a previous response: only
+    the vehicles changed since, and the ids to remove; a full snapshot when that token cannot be
+    served (issued by another worker, server restarted, tombstones dropped). The ETag follows
+    the caller's own vehicles: If-None-Match answers 304 while none of them changed.
+    """
+    owner = None if current_user.role == "ADMIN" else current_user.id_utilisateur
+    version = vehicle_state.version
+    etag = f'"{vehicle_state.token(vehicle_state.owner_version(owner))}"'
+    if if_none_match == etag:
+        return Response(status_code=304, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+
+    since = vehicle_state.parse_token(since_version) if since_version is not None else None
+    delta = vehicle_state.changes(since, owner) if since is not None else None
+    token = vehicle_state.token(version)
+    if delta is None:
+        return {"version": token, "full": True, "vehicles": vehicle_state.snapshot(owner), "removed": []}
+    vehicles, removed = delta
+    return {"version": token, "full": False, "vehicles": vehicles, "removed": removed}
 
 # ── PROVISION (Admin / Technicien only) ──────────────────────────────────────
 
@@ -134,6 +122,9 @@ async def provision_vehicle(
     db.add(vehicle)
     await db.commit()
     await db.refresh(vehicle)
+    deveui_resolver.refresh(vehicle)
+    vehicle_state.refresh(vehicle)
+    manager.publish_owner(vehicle.id_vehicule, None)
     logger.info(f"DevEUI provisionné : {vehicle_in.deveui}")
 
     # ── Register in ChirpStack (non-blocking) ──────────────────────────────
@@ -196,34 +187,57 @@ async def pair_vehicle(
     vehicle.statut = VehicleStatus.ACTIF.value
     vehicle.activated_at = datetime.utcnow()
 
+    # ── Initial Sync: re-send the stored motor and mode state (command worker) ──
+    # No pending confirmation: moteur_en_attente is left unset
+    if vehicle.deveui:
+        engine = CommandType.COUPER_MOTEUR if vehicle.moteur_coupe else CommandType.DEMARRER_MOTEUR
+        mode = CommandType.MODE_AUTO if vehicle.mode_auto else CommandType.MODE_MANUEL
+        enqueue_command(db, vehicle.id_vehicule, engine, current_user.id_utilisateur)
+        enqueue_command(db, vehicle.id_vehicule, mode, current_user.id_utilisateur)
+
     db.add(vehicle)
     await db.commit()
     await db.refresh(vehicle)
+    deveui_resolver.refresh(vehicle)
+    vehicle_state.refresh(vehicle)
+    manager.publish_owner(vehicle.id_vehicule, vehicle.id_utilisateur_proprietaire)
+    if vehicle.deveui:
+        command_worker.wake()
+        logger.info(f"Sync: {engine.value} and {mode.value} commands queued for {vehicle.deveui}")
     logger.info(
         f"Appairage réussi : DevEUI={vehicle.deveui} → user={current_user.id_utilisateur}"
     )
 
-    # ── Initial Sync (non-blocking) ───────────────────────────
-    if vehicle.deveui:
-        try:
-            # 1. Sync Motor Status (just re-sync current stored state, no pending confirmation needed)
-            if vehicle.moteur_coupe:
-                await send_stop_command(vehicle.deveui)
-                logger.info(f"Sync: STOP command sent to {vehicle.deveui}")
-            else:
-                await send_command(vehicle.deveui, "START")
-                logger.info(f"Sync: START command sent to {vehicle.deveui}")
-                
-            # 2. Sync Mode Status
-            if vehicle.mode_auto:
-                await send_command(vehicle.deveui, "AUTO")
-            else:
-                await send_command(vehicle.deveui, "MANUAL")
+    return vehicle
 
-        except Exception as e:
-            logger.error(f"Failed initial sync for {vehicle.deveui}: {e}")
+# ── SYNC MODE (Admin — Re-synchroniser AUTO/MANUAL sur la flotte) ─────────────
 
-    return vehicle
+@router.post("/sync-mode")
+async def sync_fleet_mode(
+    *,
+    db: AsyncSession = Depends(deps.get_db),
+    current_user: User = Depends(deps.get_current_active_user),
+) -> Any:
+    """
+    [ADMIN ONLY] Renvoie la commande AUTO/MANUAL courante à tous les boîtiers appairés.
+    Une commande par boîtier est enregistrée dans commande_downlink ; le command worker
+    les envoie en parallèle via le dispatcher (concurrence bornée, retries).
+    """
+    if current_user.role != "ADMIN":
+        raise HTTPException(status_code=403, detail="Réservé aux administrateurs")
+
+    result = await db.execute(
+        select(Vehicle.id_vehicule, Vehicle.mode_auto)
+        .where(Vehicle.id_utilisateur_proprietaire.isnot(None), Vehicle.deveui.isnot(None))
+    )
+    vehicles = result.all()
+    for vehicle_id, mode_auto in vehicles:
+        mode = CommandType.MODE_AUTO if mode_auto else CommandType.MODE_MANUEL
+        enqueue_command(db, vehicle_id, mode, current_user.id_utilisateur)
+    await db.commit()
+    command_worker.wake()
+    logger.info(f"Sync mode flotte : {len(vehicles)} commande(s) AUTO/MANUAL en file")
+    return {"total": len(vehicles), "queued": len(vehicles)}
 
 # ── LEGACY CREATE (conservé pour compatibilité ADMIN) ─────────────────────────
 
@@ -245,6 +259,9 @@ async def create_vehicle(
         db.add(vehicle)
         await db.commit()
         await db.refresh(vehicle)
+        deveui_resolver.refresh(vehicle)
+        vehicle_state.refresh(vehicle)
+        manager.publish_owner(vehicle.id_vehicule, vehicle.id_utilisateur_proprietaire)
         return vehicle
     except Exception as e:
         await db.rollback()
@@ -270,9 +287,6 @@ async def update_vehicle(
     vehicle = result.scalars().first()
     if not vehicle:
         raise HTTPException(status_code=404, detail="Véhicule introuvable")
-        
-    # Apply timeouts (auto-reset if > 30s)
-    await _apply_command_timeouts([vehicle], db)
 
     if current_user.role != "ADMIN" and vehicle.id_utilisateur_proprietaire != current_user.id_utilisateur:
         raise HTTPException(status_code=403, detail="Permissions insuffisantes")
@@ -303,36 +317,25 @@ async def update_vehicle(
             
         setattr(vehicle, field, value)
 
+    # Downlinks are recorded in commande_downlink and sent by the command worker
+    if moteur_changed:
+        command_type = CommandType.COUPER_MOTEUR if moteur_requested else CommandType.DEMARRER_MOTEUR
+        enqueue_command(db, vehicle.id_vehicule, command_type, current_user.id_utilisateur)
+        logger.info(f"Queued {command_type.value} command for {vehicle.deveui} (PENDING)")
+    if mode_auto_changed:
+        command_type = CommandType.MODE_AUTO if vehicle.mode_auto else CommandType.MODE_MANUEL
+        enqueue_command(db, vehicle.id_vehicule, command_type, current_user.id_utilisateur)
+        logger.info(f"Queued {command_type.value} command for {vehicle.deveui}")
+
     db.add(vehicle)
     await db.commit()
     await db.refresh(vehicle)
+    deveui_resolver.refresh(vehicle)
+    vehicle_state.refresh(vehicle)
+    if moteur_changed or mode_auto_changed:
+        command_worker.wake()
 
-    if moteur_changed and vehicle.deveui:
-        try:
-            if moteur_requested:
-                logger.info(f"Sending STOP command to {vehicle.deveui} (PENDING)")
-                await send_stop_command(vehicle.deveui)
-            else:
-                logger.info(f"Sending START command to {vehicle.deveui} (PENDING)")
-                await send_command(vehicle.deveui, "START")
-        except Exception as e:
-            logger.error(f"Failed to trigger vehicle control downlink: {e}")
-            # Reset pending if downlink failed? 
-            vehicle.moteur_en_attente = False
-            await db.commit()
-
-    if mode_auto_changed and vehicle.deveui:
-        try:
-            if vehicle.mode_auto:
-                logger.info(f"Sending AUTO command to {vehicle.deveui}")
-                await send_command(vehicle.deveui, "AUTO")
-            else:
-                logger.info(f"Sending MANUAL command to {vehicle.deveui}")
-                await send_command(vehicle.deveui, "MANUAL")
-        except Exception as e:
-            logger.error(f"Failed to trigger vehicle mode downlink: {e}")
-
-    return vehicle
+    return with_last_state(vehicle)
 
 # ── RELEASE (Admin — Libérer un boîtier pour transfert) ──────────────────────
 
@@ -374,23 +377,26 @@ async def release_vehicle(
     vehicle.derniere_communication = None
     vehicle.derniere_position_lat = None
     vehicle.derniere_position_lon = None
+    await vehicle_state.clear(vehicle.id_vehicule)
+
+    # ── STOP downlink so the device goes silent (command worker) ──────────────
+    if old_deveui:
+        enqueue_command(db, vehicle.id_vehicule, CommandType.COUPER_MOTEUR, current_user.id_utilisateur)
 
     db.add(vehicle)
     await db.commit()
     await db.refresh(vehicle)
+    deveui_resolver.refresh(vehicle)
+    vehicle_state.refresh(vehicle)
+    manager.publish_owner(vehicle.id_vehicule, None)
+    if old_deveui:
+        command_worker.wake()
+        logger.info(f"STOP queued for {old_deveui} after release")
 
     logger.info(
         f"Libération boîtier : DevEUI={old_deveui} retiré du compte {old_owner} → DISPONIBLE"
     )
 
-    # ── Send STOP downlink so device goes silent ──────────────────────────────
-    if old_deveui:
-        try:
-            await send_stop_command(old_deveui)
-            logger.info(f"STOP sent to {old_deveui} after release")
-        except Exception as e:
-            logger.warning(f"Could not send STOP to {old_deveui}: {e}")
-
     return vehicle
 
 # ── DELETE ────────────────────────────────────────────────────────────────────
@@ -421,6 +427,9 @@ async def delete_vehicle(
         except Exception as cs_err:
             logger.warning(f"Erreur suppression ChirpStack pour {vehicle.deveui}: {cs_err}")
 
+    await vehicle_state.remove(vehicle.id_vehicule)
     await db.delete(vehicle)
     await db.commit()
+    deveui_resolver.invalidate(vehicle.deveui)
+    manager.publish_owner(vehicle.id_vehicule, None)
     return vehicle
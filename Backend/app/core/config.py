@@ -18,6 +18,108 @@ class Settings(BaseSettings):
     CHIRPSTACK_API_URL: str = "http://192.168.1.102:8080"
     CHIRPSTACK_API_KEY: str = ""
 
+    # Shared outgoing HTTP pool (ChirpStack, OSRM) and downlink dispatcher
+    HTTP_MAX_CONNECTIONS: int = 100
+    HTTP_MAX_KEEPALIVE_CONNECTIONS: int = 20
+    DOWNLINK_CONCURRENCY: int = 16
+    DOWNLINK_MAX_ATTEMPTS: int = 3
+    DOWNLINK_RETRY_BACKOFF_SECONDS: float = 0.5
+
+    # Persistent command queue (commande_downlink)
+    COMMAND_POLL_INTERVAL_SECONDS: float = 5.0
+    COMMAND_BATCH_SIZE: int = 100
+    # LoRaWAN round-trip: uplink interval + RX window + 12s Arduino delay → can exceed 60s easily
+    COMMAND_CONFIRM_TIMEOUT_SECONDS: int = 300
+    COMMAND_TIMEOUT_SWEEP_SECONDS: float = 15.0
+    # A claimed command not recorded as sent after this long (worker stopped) is queued again
+    COMMAND_CLAIM_TIMEOUT_SECONDS: int = 120
+
+    # Uplink ingestion: "sync" processes each frame inside the webhook request,
+    # "batched" queues frames and writes them in micro-batches.
+    INGESTION_MODE: str = "sync"
+    INGESTION_BATCH_SIZE: int = 200
+    INGESTION_BATCH_MAX_WAIT_MS: int = 250
+    INGESTION_QUEUE_MAXSIZE: int = 10000
+    # Frames are sharded by DevEUI onto lanes processed concurrently, each device's in order
+    INGESTION_LANES: int = 4
+
+    # Webhook admission control (services/admission.py): frames processed inline + queued
+    ADMISSION_MAX_INFLIGHT: int = 500
+    ADMISSION_ROUTINE_SHARE: float = 0.5
+    ADMISSION_ROUTINE_SAMPLE_SECONDS: float = 60.0
+    ADMISSION_RETRY_AFTER_SECONDS: int = 5
+
+    # MQTT transport: consume ChirpStack's application topics instead of (or next to) the webhook.
+    # MQTT_CLIENT_ID identifies the broker's persistent session: one per API process.
+    MQTT_ENABLED: bool = False
+    MQTT_HOST: str = "mosquitto"
+    MQTT_PORT: int = 1883
+    MQTT_USERNAME: str | None = None
+    MQTT_PASSWORD: str | None = None
+    MQTT_CLIENT_ID: str = "safetrack-backend"
+    MQTT_MAX_INFLIGHT: int = 32
+    MQTT_MAX_QUEUED_MESSAGES: int = 1000
+    MQTT_RECONNECT_SECONDS: float = 5.0
+
+    # Per-device fCnt de-duplication window (services/fcnt_window.py)
+    FCNT_WINDOW_SIZE: int = 64
+    FCNT_RESET_THRESHOLD: int = 16
+
+    # GPS quality gate (services/gps_quality.py): "drop" or "flag" (stored with fix_status=0)
+    GPS_QUALITY_ACTION: str = "drop"
+    GPS_MAX_IMPLIED_SPEED_KMH: float = 300.0
+    GPS_JUMP_TOLERANCE_METRES: float = 100.0
+    GPS_MIN_SATELLITES: int = 4
+    GPS_MAX_HDOP: float = 10.0
+    GPS_MAX_CONSECUTIVE_REJECTS: int = 5
+
+    # Stationary compression: a parked vehicle's repeated fixes extend one position_gps row
+    STATIONARY_COMPRESSION: bool = False
+    STATIONARY_RADIUS_METRES: float = 15.0
+    STATIONARY_MAX_SPEED_KMH: float = 5.0
+    STATIONARY_MAX_RUN_SECONDS: int = 86400
+    STATIONARY_MAX_GAP_SECONDS: int = 1800
+
+    # Write-behind of vehicule.derniere_* (services/vehicle_state.py)
+    VEHICLE_STATE_FLUSH_SECONDS: float = 5.0
+    # Re-read of the vehicule table: changes made by other workers or outside the backend
+    VEHICLE_STATE_RECONCILE_SECONDS: float = 60.0
+
+    # WebSocket fan-out (services/notification_service.py): outbound messages queued per socket
+    WS_QUEUE_SIZE: int = 256
+    WS_SEND_TIMEOUT_SECONDS: float = 10.0
+    # "local" (one process) or "postgres" (LISTEN/NOTIFY: several uvicorn workers or containers)
+    WS_PUBSUB_BACKEND: str = "local"
+    WS_PUBSUB_CHANNEL: str = "safetrack_ws"
+    WS_PUBSUB_MAX_BATCH: int = 100
+    WS_PUBSUB_QUEUE_SIZE: int = 10000
+    WS_PUBSUB_RECONNECT_SECONDS: float = 5.0
+    WS_PUBSUB_KEEPALIVE_SECONDS: float = 30.0
+    # Live positions (POSITION_UPDATE) for the vehicles a socket subscribed to, per second
+    WS_POSITION_TICK_SECONDS: float = 0.25
+    WS_POSITION_DEFAULT_RATE: float = 1.0
+    WS_POSITION_MAX_RATE: float = 4.0
+    WS_MAX_SUBSCRIPTIONS: int = 1000
+    # Spatial grid of the map viewports subscribed to (bbox): cell size, and cells over which a box is tested apart
+    WS_GRID_CELL_DEGREES: float = 0.5
+    WS_GRID_MAX_CELLS: int = 4096
+    # Messages kept per user for the sockets resuming with ?last_seq= (users kept, least recent evicted)
+    WS_REPLAY_BUFFER_SIZE: int = 200
+    WS_REPLAY_MAX_USERS: int = 10000
+
+    # Max age of a known DevEUI's vehicle in the resolver cache (edits from other workers)
+    DEVEUI_CACHE_TTL_SECONDS: int = 300
+    # How long an unknown DevEUI is remembered before the DB is queried again
+    DEVEUI_NEGATIVE_CACHE_TTL_SECONDS: int = 300
+
+    # Max age of a compiled zone in the geofence cache (edits from other workers)
+    GEOFENCE_CACHE_TTL_SECONDS: int = 60
+
+    # Positions per chunk when re-evaluating history after a zone edit
+    ZONE_REEVALUATION_CHUNK_SIZE: int = 5000
+    # A job with no checkpoint for this long (worker crashed) is claimed by another worker
+    ZONE_REEVALUATION_LEASE_SECONDS: int = 300
+
 
     model_config = SettingsConfigDict(env_file=".env", case_sensitive=True)
 
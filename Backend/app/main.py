@@ -1,4 +1,5 @@
 import os
+from typing import Optional
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
@@ -17,6 +18,7 @@ if settings.BACKEND_CORS_ORIGINS:
         allow_credentials=True,
         allow_methods=["*"],
         allow_headers=["*"],
+        expose_headers=["X-Next-Cursor", "ETag"],
     )
 
 @app.get("/")
@@ -26,6 +28,47 @@ def root():
 from app.api.v1.api import api_router
 app.include_router(api_router, prefix=settings.API_V1_STR)
 
+# Background services
+from app.services.http_client import http_pool
+from app.services.ingestion import uplink_batcher
+from app.services.zone_reevaluation import zone_reevaluation
+from app.services.command_service import command_worker, expire_timed_out_commands
+from app.services.scheduler import scheduler
+from app.services.mqtt_ingestion import mqtt_consumer
+from app.services.fcnt_window import fcnt_window
+from app.services.vehicle_state import vehicle_state
+
+@app.on_event("startup")
+async def start_background_services():
+    await http_pool.start()
+    await manager.start()
+    await fcnt_window.load()
+    await vehicle_state.load()
+    await manager.owners.load()
+    if settings.INGESTION_MODE == "batched":
+        uplink_batcher.start()
+    await zone_reevaluation.resume_pending()
+    command_worker.start()
+    scheduler.add_job("command_timeouts", settings.COMMAND_TIMEOUT_SWEEP_SECONDS, expire_timed_out_commands)
+    scheduler.add_job("vehicle_state_flush", settings.VEHICLE_STATE_FLUSH_SECONDS, vehicle_state.flush)
+    scheduler.add_job("vehicle_state_reconcile", settings.VEHICLE_STATE_RECONCILE_SECONDS, vehicle_state.reconcile)
+    scheduler.add_job("vehicle_owners_reload", settings.VEHICLE_STATE_RECONCILE_SECONDS, manager.owners.load)
+    scheduler.add_job("zone_reevaluation_resume", settings.ZONE_REEVALUATION_LEASE_SECONDS, zone_reevaluation.resume_pending)
+    scheduler.start()
+    if settings.MQTT_ENABLED:
+        mqtt_consumer.start()
+
+@app.on_event("shutdown")
+async def stop_background_services():
+    await mqtt_consumer.stop()
+    await scheduler.stop()
+    await command_worker.stop()
+    await zone_reevaluation.stop()
+    await uplink_batcher.stop()
+    await vehicle_state.flush()
+    await http_pool.stop()
+    await manager.stop()
+
 # Mount Admin panel (React build output) at /admin
 _admin_dist = os.path.join(os.path.dirname(__file__), "..", "admin", "dist")
 if os.path.isdir(_admin_dist):
@@ -39,9 +82,11 @@ from app.api import deps
 from jose import jwt, JWTError
 from pydantic import ValidationError
 from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.user import User
 
 @app.websocket("/ws/{token}")
-async def websocket_endpoint(websocket: WebSocket, token: str):
+async def websocket_endpoint(websocket: WebSocket, token: str, last_seq: Optional[int] = None, epoch: Optional[str] = None):
     try:
         payload = jwt.decode(token, settings.SECRET_KEY, algorithms=[security.ALGORITHM])
         token_data = deps.TokenPayload(**payload)
@@ -50,12 +95,22 @@ async def websocket_endpoint(websocket: WebSocket, token: str):
         await websocket.close(code=1008)
         return
 
-    await manager.connect(websocket, user_id)
+    async with SessionLocal() as db:
+        user = await db.get(User, user_id)
+    if user is None or user.statut != "ACTIF":
+        await websocket.close(code=1008)
+        return
+
+    # last_seq / epoch: resume after a disconnection (messages missed replayed, or RESYNC_REQUIRED)
+    connection = await manager.connect(websocket, user_id, is_admin=user.role == "ADMIN", last_seq=last_seq, epoch=epoch)
     try:
         while True:
-            # Keep connection alive, maybe receive ack or other commands
+            # Subscriptions to live positions (SUBSCRIBE / UNSUBSCRIBE)
             data = await websocket.receive_text()
-            # print(f"Received from {user_id}: {data}") 
+            manager.handle_client_message(connection, data)
     except WebSocketDisconnect:
+        pass
+    finally:
+        # Also stops the socket's writer task
         manager.disconnect(websocket, user_id)
 
@@ -3,3 +3,5 @@ from app.models.vehicle import Vehicle
 from app.models.zone import Zone
 from app.models.position import Position
 from app.models.alert import Alert
+from app.models.reevaluation import ZoneReevaluation
+from app.models.command import DownlinkCommand
@@ -0,0 +1,37 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from datetime import datetime
+import enum
+from app.db.session import Base
+
+class CommandType(str, enum.Enum):
+    COUPER_MOTEUR = "COUPER_MOTEUR"
+    DEMARRER_MOTEUR = "DEMARRER_MOTEUR"
+    DEFINIR_ZONE = "DEFINIR_ZONE"
+    CHANGER_INTERVALLE = "CHANGER_INTERVALLE"
+    MODE_AUTO = "MODE_AUTO"
+    MODE_MANUEL = "MODE_MANUEL"
+
+class CommandStatus(str, enum.Enum):
+    EN_ATTENTE = "EN_ATTENTE"
+    EN_COURS_ENVOI = "EN_COURS_ENVOI"
+    ENVOYEE = "ENVOYEE"
+    CONFIRMEE = "CONFIRMEE"
+    ECHOUEE = "ECHOUEE"
+    EXPIREE = "EXPIREE"  # Never sent, or sent without acknowledgement, within the timeout
+
+class DownlinkCommand(Base):
+    """A command queued for a device; sent by the command worker, confirmed by relay uplinks."""
+    __tablename__ = "commande_downlink"
+
+    id_commande = Column(Integer, primary_key=True, index=True)
+    id_vehicule = Column(Integer, ForeignKey("vehicule.id_vehicule", ondelete="CASCADE"), nullable=False, index=True)
+    type_commande = Column(String(50), nullable=False)
+    parametres_json = Column(Text)
+    statut = Column(String(20), default=CommandStatus.EN_ATTENTE.value, index=True)
+    payload_envoye = Column(Text)
+    fport = Column(Integer)
+    date_envoi = Column(DateTime)
+    date_confirmation = Column(DateTime)
+    erreur = Column(Text)
+    id_utilisateur_emetteur = Column(Integer, ForeignKey("utilisateur.id_utilisateur", ondelete="SET NULL"))
+    created_at = Column(DateTime, default=datetime.utcnow)
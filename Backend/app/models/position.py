@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, Text, SmallInteger
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, Text, SmallInteger
 from sqlalchemy.orm import relationship
 from datetime import datetime
 from app.db.session import Base
@@ -14,6 +14,9 @@ class Position(Base):
     vitesse = Column(Numeric(6, 2), nullable=False)
     cap = Column(Numeric(5, 2))
     timestamp_gps = Column(DateTime, nullable=False, index=True)
+    # Stationary run (see services/stationary.py): last repeated fix and number of fixes
+    timestamp_fin = Column(DateTime)
+    nb_repetitions = Column(Integer, nullable=False, default=1)
     fix_status = Column(SmallInteger)
     satellites = Column(Integer)
     hdop = Column(Numeric(4, 2))
@@ -23,6 +26,7 @@ class Position(Base):
     id_zone = Column(Integer, ForeignKey("zone_securisee.id_zone"))
     batterie_pourcentage = Column(Integer)
     payload_brut = Column(Text)
+    f_cnt = Column(BigInteger)  # LoRaWAN uplink frame counter
     created_at = Column(DateTime, default=datetime.utcnow, index=True)
 
     # Relationships
@@ -0,0 +1,27 @@
+from sqlalchemy import Column, Integer, String, DateTime, ForeignKey, Text
+from datetime import datetime
+import enum
+from app.db.session import Base
+
+class ReevaluationStatus(str, enum.Enum):
+    EN_COURS = "EN_COURS"
+    TERMINEE = "TERMINEE"
+    ECHOUEE = "ECHOUEE"
+    ANNULEE = "ANNULEE"
+
+class ZoneReevaluation(Base):
+    """Re-evaluation of a vehicle's stored positions after its zone was edited."""
+    __tablename__ = "reevaluation_zone"
+
+    id_reevaluation = Column(Integer, primary_key=True, index=True)
+    id_zone = Column(Integer, ForeignKey("zone_securisee.id_zone", ondelete="CASCADE"), nullable=False, index=True)
+    id_vehicule = Column(Integer, ForeignKey("vehicule.id_vehicule", ondelete="CASCADE"), nullable=False)
+    statut = Column(String(20), default=ReevaluationStatus.EN_COURS.value, index=True)
+    proprietaire = Column(String(100))  # Worker running the job (NULL: free to claim)
+    dernier_id_position = Column(Integer, default=0, nullable=False)  # Checkpoint
+    id_position_max = Column(Integer, nullable=False)  # Positions inserted later are evaluated live
+    positions_total = Column(Integer, default=0)
+    positions_traitees = Column(Integer, default=0)
+    erreur = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, Enum
+from sqlalchemy import BigInteger, Column, Integer, String, Boolean, DateTime, ForeignKey, Numeric, Enum
 from sqlalchemy.orm import relationship
 from datetime import datetime
 import enum
@@ -30,6 +30,7 @@ class Vehicle(Base):
     derniere_position_lat = Column(Numeric(10, 8))
     derniere_position_lon = Column(Numeric(11, 8))
     derniere_communication = Column(DateTime)
+    dernier_fcnt = Column(BigInteger)  # Highest uplink fCnt (see services/fcnt_window.py)
     id_utilisateur_proprietaire = Column(Integer, ForeignKey("utilisateur.id_utilisateur"), nullable=True)
     created_at = Column(DateTime, default=datetime.utcnow)
     activated_at = Column(DateTime, nullable=True)
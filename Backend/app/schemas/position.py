@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel
 from datetime import datetime
 
@@ -9,6 +9,8 @@ class PositionBase(BaseModel):
     vitesse: float
     cap: Optional[float] = None
     timestamp_gps: datetime
+    timestamp_fin: Optional[datetime] = None
+    nb_repetitions: int = 1
     fix_status: Optional[int] = None
     satellites: Optional[int] = None
     hdop: Optional[float] = None
@@ -18,6 +20,7 @@ class PositionBase(BaseModel):
     id_zone: Optional[int] = None
     batterie_pourcentage: Optional[int] = None
     payload_brut: Optional[str] = None
+    f_cnt: Optional[int] = None
 
 class PositionCreate(PositionBase):
     id_vehicule: int
@@ -32,3 +35,20 @@ class PositionInDBBase(PositionBase):
 
 class Position(PositionInDBBase):
     pass
+
+class TrackPoint(BaseModel):
+    latitude: float
+    longitude: float
+    timestamp_gps: datetime
+    # Set on a stop: the vehicle stayed at this point until timestamp_fin
+    timestamp_fin: Optional[datetime] = None
+
+class Track(BaseModel):
+    """Simplified polyline of a vehicle between two dates."""
+    vehicle_id: int
+    start: datetime
+    end: datetime
+    tolerance_m: float
+    total_points: int
+    dropped_points: int
+    points: List[TrackPoint]
@@ -1,4 +1,4 @@
-from typing import Optional
+from typing import List, Optional
 from pydantic import BaseModel, field_validator
 from datetime import datetime
 from app.models.vehicle import VehicleStatus
@@ -71,9 +71,43 @@ class VehicleInDBBase(VehicleBase):
     activated_at: Optional[datetime] = None
     updated_at: datetime
     moteur_commande_timestamp: Optional[datetime] = None
-    
+    derniere_communication: Optional[datetime] = None
+    derniere_position_lat: Optional[float] = None
+    derniere_position_lon: Optional[float] = None
+
     class Config:
         from_attributes = True
 
 class Vehicle(VehicleInDBBase):
     pass
+
+# ── Live fleet (GET /vehicles/live) ────────────────────────────────────────
+class LiveVehicle(BaseModel):
+    id_vehicule: int
+    nom: Optional[str] = None
+    immatriculation: Optional[str] = None
+    marque: Optional[str] = None
+    modele: Optional[str] = None
+    annee: Optional[int] = None
+    deveui: str
+    statut: Optional[str] = None
+    moteur_coupe: Optional[bool] = None
+    moteur_en_attente: Optional[bool] = None
+    moteur_commande_timestamp: Optional[datetime] = None
+    mode_auto: Optional[bool] = None
+    id_utilisateur_proprietaire: Optional[int] = None
+    created_at: Optional[datetime] = None
+    activated_at: Optional[datetime] = None
+    derniere_communication: Optional[datetime] = None
+    derniere_position_lat: Optional[float] = None
+    derniere_position_lon: Optional[float] = None
+    version: int
+
+class LiveFleet(BaseModel):
+    """full=True : `vehicles` est la flotte complète ; sinon les véhicules modifiés depuis
+    since_version, et `removed` ceux à retirer (supprimés ou changés de propriétaire).
+    `version` est un jeton opaque "<epoch>.<version>", propre au worker qui l'a émis."""
+    version: str
+    full: bool
+    vehicles: List[LiveVehicle]
+    removed: List[int] = []
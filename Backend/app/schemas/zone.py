@@ -39,3 +39,18 @@ class ZoneInDBBase(ZoneBase):
 
 class Zone(ZoneInDBBase):
     pass
+
+class ZoneReevaluation(BaseModel):
+    id_reevaluation: int
+    id_zone: int
+    id_vehicule: int
+    statut: str
+    dernier_id_position: int
+    positions_total: Optional[int] = None  # Counted once the job starts
+    positions_traitees: int
+    erreur: Optional[str] = None
+    created_at: datetime
+    updated_at: datetime
+
+    class Config:
+        from_attributes = True
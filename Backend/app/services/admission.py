@@ -0,0 +1,140 @@
+"""
+Admission control for the uplink webhook.
+When the DB slows down, ChirpStack's HTTP integration times out and re-posts the frame,
+which adds load exactly when there is none to spare. The webhook therefore admits a frame
+according to the current load (requests being processed inline + frames queued in the
+batcher) and the frame's priority:
+  CRITICAL — relay confirmations, and positions that may breach a zone (vehicle in
+             automatic mode outside, or with its zone or the vehicle itself not cached):
+             never shed
+  NORMAL   — other positions: 503 + Retry-After beyond ADMISSION_MAX_INFLIGHT
+  ROUTINE  — stationary positions (and frames without data): beyond
+             ADMISSION_ROUTINE_SHARE of the budget, sampled to one per vehicle every
+             ADMISSION_ROUTINE_SAMPLE_SECONDS; the others are acknowledged and dropped,
+             since a retry would only repeat the same stop. Frames of a DevEUI known
+             not to be registered are routine too: they are ignored anyway
+classify() reads only in-memory state (DevEUI and zone caches) and decodes the frame once;
+the processing path reuses the decoded frame.
+"""
+
+import enum
+import logging
+import time
+from contextlib import contextmanager
+from typing import Dict
+
+from app.core.config import settings
+from app.services.deveui_resolver import deveui_resolver
+from app.services.geofencing_service import geofence_index
+from app.services.ingestion import uplink_batcher
+from app.services.uplink_schema import UplinkFrame, decode_frame
+
+logger = logging.getLogger(__name__)
+
+
+class Priority(enum.IntEnum):
+    ROUTINE = 0
+    NORMAL = 1
+    CRITICAL = 2
+
+
+class Decision(str, enum.Enum):
+    ACCEPT = "accept"
+    SAMPLE_OUT = "sampled_out"  # Acknowledged (200) but not processed
+    SHED = "shed"  # 503 + Retry-After
+
+
+def classify(frame: UplinkFrame) -> Priority:
+    """Priority of an uplink (envelope read by parse_envelope), from cached state only."""
+    decode_frame(frame)
+    if frame.relay_status in ("cut", "active"):
+        return Priority.CRITICAL
+    if frame.latitude is None or frame.longitude is None:
+        return Priority.ROUTINE
+
+    vehicle = deveui_resolver.peek(frame.dev_eui)
+    if vehicle is None:
+        if deveui_resolver.peek_unknown(frame.dev_eui):
+            return Priority.ROUTINE
+        return Priority.CRITICAL  # Not cached: its mode and zone are unknown without the DB
+    if vehicle.mode_auto and not vehicle.moteur_coupe:
+        cached, zone = geofence_index.peek(vehicle.id_vehicule)
+        if not cached:
+            return Priority.CRITICAL  # Can't rule out a breach without the DB
+        if zone is not None and not zone.contains(float(frame.latitude), float(frame.longitude)):
+            return Priority.CRITICAL
+    if frame.speed <= settings.STATIONARY_MAX_SPEED_KMH:
+        return Priority.ROUTINE
+    return Priority.NORMAL
+
+
+class AdmissionController:
+
+    def __init__(self, max_inflight: int, routine_share: float, routine_sample_seconds: float, retry_after_seconds: int):
+        self.max_inflight = max_inflight
+        self.routine_limit = max_inflight * routine_share
+        self.routine_sample_seconds = routine_sample_seconds
+        self.retry_after_seconds = retry_after_seconds
+        self.inflight = 0
+        self._last_routine: Dict[str, float] = {}  # dev_eui -> monotonic time of the last admitted routine frame
+        self._pruned_at = time.monotonic()
+        self.admitted: Dict[str, int] = {p.name: 0 for p in Priority}
+        self.sampled_out = 0
+        self.shed = 0
+
+    def load(self) -> int:
+        return self.inflight + uplink_batcher.depth()
+
+    def admit(self, frame: UplinkFrame, priority: Priority) -> Decision:
+        load = self.load()
+        if priority is Priority.NORMAL and load >= self.max_inflight:
+            self.shed += 1
+            return Decision.SHED
+        if priority is Priority.ROUTINE and load >= self.routine_limit:
+            now = time.monotonic()
+            key = deveui_resolver.normalize(frame.dev_eui)
+            last = self._last_routine.get(key)
+            if load >= self.max_inflight or (last is not None and now - last < self.routine_sample_seconds):
+                self.sampled_out += 1
+                return Decision.SAMPLE_OUT
+            self._last_routine[key] = now
+            self._prune(now)
+        self.admitted[priority.name] += 1
+        return Decision.ACCEPT
+
+    def _prune(self, now: float):
+        """Drop the routine samples older than the interval: they no longer hold any frame back."""
+        if now - self._pruned_at < self.routine_sample_seconds:
+            return
+        self._pruned_at = now
+        self._last_routine = {
+            key: last for key, last in self._last_routine.items() if now - last < self.routine_sample_seconds
+        }
+
+    @contextmanager
+    def track(self):
+        """Count a frame processed inline (sync mode) in the load."""
+        self.inflight += 1
+        try:
+            yield
+        finally:
+            self.inflight -= 1
+
+    def stats(self) -> dict:
+        return {
+            "inflight": self.inflight,
+            "load": self.load(),
+            "max_inflight": self.max_inflight,
+            "admitted": dict(self.admitted),
+            "sampled_out": self.sampled_out,
+            "shed": self.shed,
+            "routine_devices": len(self._last_routine),
+        }
+
+
+admission = AdmissionController(
+    max_inflight=settings.ADMISSION_MAX_INFLIGHT,
+    routine_share=settings.ADMISSION_ROUTINE_SHARE,
+    routine_sample_seconds=settings.ADMISSION_ROUTINE_SAMPLE_SECONDS,
+    retry_after_seconds=settings.ADMISSION_RETRY_AFTER_SECONDS,
+)
@@ -4,6 +4,8 @@ import httpx
 import logging
 from typing import List, Dict, Any
 from app.core.config import settings
+from app.services.http_client import http_pool
+from app.services.downlink_dispatcher import DownlinkDispatcher, DownlinkError
 
 logger = logging.getLogger(__name__)
 
@@ -79,21 +81,20 @@ async def register_device_in_chirpstack(
         }
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers, timeout=10.0)
-            if response.status_code in (200, 201):
-                logger.info(f"Device {dev_eui} registered in ChirpStack (name='{name}').")
-                return True
-            else:
-                logger.warning(
-                    f"ChirpStack rejected device registration for {dev_eui}: "
-                    f"{response.status_code} {response.text}"
-                )
-                return False
-        except Exception as e:
-            logger.warning(f"Failed to register device {dev_eui} in ChirpStack: {e}")
+    try:
+        response = await http_pool.client.post(url, json=payload, headers=headers, timeout=10.0)
+        if response.status_code in (200, 201):
+            logger.info(f"Device {dev_eui} registered in ChirpStack (name='{name}').")
+            return True
+        else:
+            logger.warning(
+                f"ChirpStack rejected device registration for {dev_eui}: "
+                f"{response.status_code} {response.text}"
+            )
             return False
+    except Exception as e:
+        logger.warning(f"Failed to register device {dev_eui} in ChirpStack: {e}")
+        return False
 
 
 async def delete_device_from_chirpstack(dev_eui: str) -> bool:
@@ -111,34 +112,30 @@ async def delete_device_from_chirpstack(dev_eui: str) -> bool:
         "Grpc-Metadata-Authorization": f"Bearer {settings.CHIRPSTACK_API_KEY}",
     }
 
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.delete(url, headers=headers, timeout=10.0)
-            if response.status_code in (200, 204):
-                logger.info(f"Device {dev_eui} deleted from ChirpStack.")
-                return True
-            elif response.status_code == 404:
-                logger.info(f"Device {dev_eui} not found in ChirpStack (already removed or never registered).")
-                return True  # considéré OK
-            else:
-                logger.warning(
-                    f"ChirpStack rejected device deletion for {dev_eui}: "
-                    f"{response.status_code} {response.text}"
-                )
-                return False
-        except Exception as e:
-            logger.warning(f"Failed to delete device {dev_eui} from ChirpStack: {e}")
+    try:
+        response = await http_pool.client.delete(url, headers=headers, timeout=10.0)
+        if response.status_code in (200, 204):
+            logger.info(f"Device {dev_eui} deleted from ChirpStack.")
+            return True
+        elif response.status_code == 404:
+            logger.info(f"Device {dev_eui} not found in ChirpStack (already removed or never registered).")
+            return True  # considéré OK
+        else:
+            logger.warning(
+                f"ChirpStack rejected device deletion for {dev_eui}: "
+                f"{response.status_code} {response.text}"
+            )
             return False
+    except Exception as e:
+        logger.warning(f"Failed to delete device {dev_eui} from ChirpStack: {e}")
+        return False
 
 
-async def send_downlink(dev_eui: str, data: str, f_port: int = 10):
+async def post_downlink(dev_eui: str, data: str, f_port: int = 10):
     """
-    Send a downlink message to a device via ChirpStack API.
+    Queue a downlink for a device via ChirpStack API (single attempt).
+    Raises DownlinkError; 4xx answers are not retryable.
     """
-    if not settings.CHIRPSTACK_API_KEY:
-        logger.warning("ChirpStack API Key not set. Skipping downlink.")
-        return
-
     url = f"{settings.CHIRPSTACK_API_URL}/api/devices/{dev_eui.lower()}/queue"
     
     headers = {
@@ -154,14 +151,34 @@ async def send_downlink(dev_eui: str, data: str, f_port: int = 10):
         }
     }
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.post(url, json=payload, headers=headers, timeout=5.0)
-            response.raise_for_status()
-            resp_data = response.json()
-            logger.info(f"Downlink sent to {dev_eui}. Response: {resp_data}")
-        except Exception as e:
-            logger.error(f"Failed to send downlink to {dev_eui}: {str(e)}")
+    try:
+        response = await http_pool.client.post(url, json=payload, headers=headers, timeout=5.0)
+    except httpx.HTTPError as e:
+        raise DownlinkError(f"{type(e).__name__}: {e}")
+    if response.status_code >= 400:
+        retryable = response.status_code >= 500 or response.status_code == 429
+        raise DownlinkError(f"{response.status_code} {response.text}", retryable=retryable)
+    logger.info(f"Downlink sent to {dev_eui}. Response: {response.json()}")
+
+
+downlink_dispatcher = DownlinkDispatcher(
+    post_downlink,
+    concurrency=settings.DOWNLINK_CONCURRENCY,
+    max_attempts=settings.DOWNLINK_MAX_ATTEMPTS,
+    backoff_seconds=settings.DOWNLINK_RETRY_BACKOFF_SECONDS,
+)
+
+
+async def send_downlink(dev_eui: str, data: str, f_port: int = 10) -> bool:
+    """
+    Send a downlink message to a device via ChirpStack API.
+    Goes through the dispatcher: bounded concurrency, per-device ordering, retries.
+    """
+    if not settings.CHIRPSTACK_API_KEY:
+        logger.warning("ChirpStack API Key not set. Skipping downlink.")
+        return False
+
+    return await downlink_dispatcher.send(dev_eui, data, f_port)
 
 async def send_command(dev_eui: str, command_text: str, f_port: int = 10):
     """
@@ -169,10 +186,10 @@ async def send_command(dev_eui: str, command_text: str, f_port: int = 10):
     """
     # Mimic: echo "TEXT" | base64
     encoded_data = base64.b64encode(command_text.encode("utf-8")).decode("utf-8")
-    await send_downlink(dev_eui, encoded_data, f_port)
+    return await send_downlink(dev_eui, encoded_data, f_port)
 
 async def send_stop_command(dev_eui: str):
     """
     Send STOP command (U1RPUA==) to device.
     """
-    await send_command(dev_eui, "STOP")
+    return await send_command(dev_eui, "STOP")
@@ -0,0 +1,99 @@
+"""
+Backend decoders for the SafeTrack firmware payloads, keyed by FPort.
+ChirpStack forwards the raw frame in `data` (base64); decoding it here means no
+ChirpStack JS codec is needed. A decoder returns a dict shaped like ChirpStack's
+decoded `object`, or None when the bytes don't match the format.
+
+FPort 1 — GPS fix, 10 bytes big-endian (safetrack_auto / lorawan_node):
+    float32 latitude, float32 longitude, uint16 speed × 10 (km/h)
+    A frame of N × 10 bytes is read as N fixes, oldest first (multi-fix frame).
+FPort 10 — relay acknowledgement after a STOP/START downlink:
+    1 byte = relay cut, 2 bytes = relay active
+"""
+
+import struct
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+FPORT_GPS = 1
+FPORT_RELAY = 10
+
+GPS_FIX = struct.Struct(">ffH")
+GPS_FIX_DTYPE = np.dtype([("lat", ">f4"), ("lon", ">f4"), ("speed", ">u2")])
+
+# float32 carries ~7 significant digits; the firmware itself works at 6 decimals
+COORD_DECIMALS = 6
+
+Decoder = Callable[[bytes], Optional[dict]]
+_DECODERS: Dict[int, Decoder] = {}
+
+
+def register(fport: int):
+    """Decorator: register the decoder of an FPort."""
+    def wrapper(decoder: Decoder) -> Decoder:
+        _DECODERS[fport] = decoder
+        return decoder
+    return wrapper
+
+
+def _fix(lat: float, lon: float, speed: int) -> dict:
+    return {
+        "latitude": round(float(lat), COORD_DECIMALS),
+        "longitude": round(float(lon), COORD_DECIMALS),
+        "speed": speed / 10.0,
+    }
+
+
+@register(FPORT_GPS)
+def decode_gps(data: bytes) -> Optional[dict]:
+    if len(data) == GPS_FIX.size:
+        return _fix(*GPS_FIX.unpack(data))
+    if not data or len(data) % GPS_FIX.size:
+        return None
+    # Multi-fix frame: the latest fix is the current position, all fixes are exposed
+    fixes = [_fix(*values) for values in GPS_FIX.iter_unpack(data)]
+    return dict(fixes[-1], fixes=fixes)
+
+
+@register(FPORT_RELAY)
+def decode_relay(data: bytes) -> Optional[dict]:
+    if len(data) == 1:
+        return {"relay_status": "cut"}
+    if len(data) == 2:
+        return {"relay_status": "active"}
+    return None
+
+
+def decode(fport: Optional[int], data: bytes) -> Optional[dict]:
+    """Decode one frame. None for an unknown FPort or a malformed frame."""
+    decoder = _DECODERS.get(fport)
+    if decoder is None:
+        return None
+    return decoder(data)
+
+
+def decode_many(frames: Sequence[Tuple[Optional[int], bytes]]) -> List[Optional[dict]]:
+    """
+    Decode a batch of (fport, data) frames, in order.
+    Single-fix GPS frames, the bulk of the traffic, are decoded with one np.frombuffer
+    over their concatenation; the rest go through `decode`.
+    """
+    results: List[Optional[dict]] = [None] * len(frames)
+    gps_indices = []
+    gps_chunks = []
+    for i, (fport, data) in enumerate(frames):
+        if fport == FPORT_GPS and len(data) == GPS_FIX.size:
+            gps_indices.append(i)
+            gps_chunks.append(data)
+        else:
+            results[i] = decode(fport, data)
+
+    if gps_chunks:
+        fixes = np.frombuffer(b"".join(gps_chunks), dtype=GPS_FIX_DTYPE)
+        lats = np.round(fixes["lat"].astype(np.float64), COORD_DECIMALS).tolist()
+        lons = np.round(fixes["lon"].astype(np.float64), COORD_DECIMALS).tolist()
+        speeds = (fixes["speed"] / 10.0).tolist()
+        for i, lat, lon, speed in zip(gps_indices, lats, lons, speeds):
+            results[i] = {"latitude": lat, "longitude": lon, "speed": speed}
+    return results
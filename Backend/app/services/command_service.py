@@ -0,0 +1,375 @@
+"""
+Persistent downlink command queue.
+Every STOP/START/AUTO/MANUAL command is recorded in commande_downlink as EN_ATTENTE,
+then claimed (EN_COURS_ENVOI) and sent by a background worker (ENVOYEE, or ECHOUEE when
+ChirpStack refused it).
+Engine commands are CONFIRMEE when the device reports its relay state on FPort 10;
+mode commands, which the device does not acknowledge, when ChirpStack reports the
+downlink transmitted (txack event, MQTT transport only);
+those still unconfirmed after COMMAND_CONFIRM_TIMEOUT_SECONDS are failed by
+expire_timed_out_commands, a periodic scheduler job that also clears the vehicle's pending flag.
+The same job gives the other commands a terminal state after that timeout (EXPIREE): mode
+commands never acknowledged (no txack with the HTTP transport), and commands never sent.
+"""
+
+import asyncio
+import base64
+import json
+import logging
+from datetime import datetime, timedelta
+from typing import Optional
+
+from sqlalchemy import bindparam, func, insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.alert import Alert
+from app.models.command import CommandStatus, CommandType, DownlinkCommand
+from app.models.vehicle import Vehicle
+from app.services.chirpstack import send_downlink
+from app.services.deveui_resolver import deveui_resolver
+from app.services.notification_service import manager
+from app.services.vehicle_state import vehicle_state
+
+logger = logging.getLogger(__name__)
+
+COMMAND_FPORT = 10
+
+# Text payload understood by the firmware for each command type
+COMMAND_TEXT = {
+    CommandType.COUPER_MOTEUR.value: "STOP",
+    CommandType.DEMARRER_MOTEUR.value: "START",
+    CommandType.MODE_AUTO.value: "AUTO",
+    CommandType.MODE_MANUEL.value: "MANUAL",
+}
+
+# Only engine commands are acknowledged by the device (relay_status uplink)
+ENGINE_COMMANDS = (CommandType.COUPER_MOTEUR.value, CommandType.DEMARRER_MOTEUR.value)
+MODE_COMMANDS = (CommandType.MODE_AUTO.value, CommandType.MODE_MANUEL.value)
+
+# A confirmation can arrive before the worker has recorded the send
+SENT_STATUSES = (CommandStatus.EN_COURS_ENVOI.value, CommandStatus.ENVOYEE.value)
+
+# Outcome of each claimed command, recorded in one executemany; a row confirmed meanwhile is kept
+_commande = DownlinkCommand.__table__
+_RECORD_STATEMENT = update(_commande).where(
+    _commande.c.id_commande == bindparam("command_id"),
+    _commande.c.statut == CommandStatus.EN_COURS_ENVOI.value,
+)
+
+
+def enqueue_command(
+    db: AsyncSession,
+    vehicle_id: int,
+    command_type: CommandType,
+    user_id: Optional[int] = None,
+) -> DownlinkCommand:
+    """
+    Add an EN_ATTENTE command to the session. The caller commits, then wakes the worker
+    with `command_worker.wake()` so the downlink goes out without waiting for the next poll.
+    """
+    command = DownlinkCommand(
+        id_vehicule=vehicle_id,
+        type_commande=command_type.value,
+        statut=CommandStatus.EN_ATTENTE.value,
+        id_utilisateur_emetteur=user_id,
+        created_at=datetime.utcnow(),
+    )
+    db.add(command)
+    return command
+
+
+async def confirm_engine_command(db: AsyncSession, vehicle_id: int, is_cut: bool):
+    """Mark the vehicle's sent STOP (or START) commands as confirmed. Committed by the caller."""
+    command_type = CommandType.COUPER_MOTEUR if is_cut else CommandType.DEMARRER_MOTEUR
+    await db.execute(
+        update(DownlinkCommand)
+        .where(
+            DownlinkCommand.id_vehicule == vehicle_id,
+            DownlinkCommand.statut.in_(SENT_STATUSES),
+            DownlinkCommand.type_commande == command_type.value,
+        )
+        .values(statut=CommandStatus.CONFIRMEE.value, date_confirmation=datetime.utcnow())
+    )
+
+
+async def confirm_transmitted_commands(db: AsyncSession, vehicle_id: int) -> int:
+    """
+    Mark the vehicle's sent mode commands (AUTO/MANUAL) as confirmed once the gateway has
+    transmitted them. Engine commands wait for the relay uplink. Committed by the caller.
+    """
+    result = await db.execute(
+        update(DownlinkCommand)
+        .where(
+            DownlinkCommand.id_vehicule == vehicle_id,
+            DownlinkCommand.statut.in_(SENT_STATUSES),
+            DownlinkCommand.type_commande.in_(MODE_COMMANDS),
+        )
+        .values(statut=CommandStatus.CONFIRMEE.value, date_confirmation=datetime.utcnow())
+        .execution_options(synchronize_session=False)
+    )
+    return result.rowcount
+
+
+class CommandWorker:
+    """
+    Sends queued commands.
+    A batch is claimed by one short UPDATE … (SELECT … FOR UPDATE SKIP LOCKED) … RETURNING,
+    committed before ChirpStack is called, so several API workers can run one each and no
+    lock or pooled connection is held during the downlinks. The outcomes are recorded in a
+    second short transaction. Claims left by a worker that died meanwhile are put back in
+    the queue by expire_timed_out_commands after COMMAND_CLAIM_TIMEOUT_SECONDS.
+    """
+
+    def __init__(self, poll_interval: float, batch_size: int):
+        self.poll_interval = poll_interval
+        self.batch_size = batch_size
+        self._wakeup = asyncio.Event()
+        self._task: Optional[asyncio.Task] = None
+        self.sent = 0
+        self.failed = 0
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"Command worker started (poll={self.poll_interval}s)")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("Command worker stopped")
+
+    def wake(self):
+        """Send newly queued commands now instead of at the next poll."""
+        self._wakeup.set()
+
+    def stats(self) -> dict:
+        return {
+            "running": self._task is not None,
+            "sent": self.sent,
+            "failed": self.failed,
+        }
+
+    async def _run(self):
+        while True:
+            self._wakeup.clear()
+            try:
+                while await self.dispatch_pending() == self.batch_size:
+                    pass
+            except Exception as e:
+                logger.error(f"[COMMAND] Worker iteration failed: {e}")
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+            except asyncio.TimeoutError:
+                pass
+
+    async def dispatch_pending(self) -> int:
+        """Send one batch of EN_ATTENTE commands. Returns the number of commands handled."""
+        claimable = (
+            select(DownlinkCommand.id_commande)
+            .where(DownlinkCommand.statut == CommandStatus.EN_ATTENTE.value)
+            .order_by(DownlinkCommand.id_commande)
+            .limit(self.batch_size)
+            .with_for_update(skip_locked=True)
+        )
+        deveui = select(Vehicle.deveui).where(Vehicle.id_vehicule == DownlinkCommand.id_vehicule).scalar_subquery()
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(DownlinkCommand)
+                .where(DownlinkCommand.id_commande.in_(claimable))
+                .values(statut=CommandStatus.EN_COURS_ENVOI.value, date_envoi=datetime.utcnow())
+                .returning(DownlinkCommand.id_commande, DownlinkCommand.id_vehicule, DownlinkCommand.type_commande, deveui.label("deveui"))
+                .execution_options(synchronize_session=False)
+            )
+            # RETURNING has no order: same-device commands must go out in queue order
+            rows = sorted(result.all(), key=lambda row: row.id_commande)
+            await db.commit()
+        if not rows:
+            return 0
+
+        payloads = [
+            base64.b64encode(COMMAND_TEXT[row.type_commande].encode("utf-8")).decode("utf-8")
+            for row in rows
+        ]
+        # Same-device commands keep their order: the dispatcher serializes per DevEUI
+        results = await asyncio.gather(*(
+            self._send(row.deveui, payload) for row, payload in zip(rows, payloads)
+        ))
+
+        now = datetime.utcnow()
+        outcomes = []
+        failed_engine = set()
+        for row, payload, ok in zip(rows, payloads, results):
+            outcome = {"command_id": row.id_commande, "date_envoi": now, "payload_envoye": payload, "fport": COMMAND_FPORT}
+            if ok:
+                outcome.update(statut=CommandStatus.ENVOYEE.value, erreur=None)
+                self.sent += 1
+                logger.info(f"[COMMAND] {row.type_commande} #{row.id_commande} sent to {row.deveui}")
+            else:
+                outcome.update(statut=CommandStatus.ECHOUEE.value, erreur="Downlink refusé par ChirpStack")
+                self.failed += 1
+                if row.type_commande in ENGINE_COMMANDS:
+                    failed_engine.add(row.id_vehicule)
+            outcomes.append(outcome)
+
+        async with SessionLocal() as db:
+            await db.execute(_RECORD_STATEMENT, outcomes)
+            vehicles = []
+            if failed_engine:
+                # No confirmation will come: drop the pending state right away
+                result = await db.execute(
+                    update(Vehicle)
+                    .where(Vehicle.id_vehicule.in_(failed_engine), Vehicle.moteur_en_attente.is_(True))
+                    .values(moteur_en_attente=False, moteur_commande_timestamp=None)
+                    .returning(Vehicle)
+                    .execution_options(synchronize_session=False)
+                )
+                vehicles = result.scalars().all()
+            await db.commit()
+
+        for vehicle in vehicles:
+            deveui_resolver.refresh(vehicle)
+            vehicle_state.refresh(vehicle)
+            if vehicle.id_utilisateur_proprietaire:
+                await manager.send_personal_message({
+                    "type": "VEHICLE_UPDATE",
+                    "data": {
+                        "vehicle_id": vehicle.id_vehicule,
+                        "moteur_coupe": vehicle.moteur_coupe,
+                        "moteur_en_attente": False,
+                    },
+                }, vehicle.id_utilisateur_proprietaire)
+        return len(rows)
+
+    @staticmethod
+    async def _send(deveui: Optional[str], payload: str) -> bool:
+        if not deveui:
+            return False  # Device removed from the vehicle since the command was queued
+        return await send_downlink(deveui, payload, COMMAND_FPORT)
+
+
+async def expire_timed_out_commands():
+    """
+    Scheduled job: reset the vehicles whose engine command went unconfirmed past the
+    timeout, fail the matching commands and raise one alert per vehicle.
+    One indexed UPDATE … RETURNING on vehicule (idx_vehicule_commande_en_attente),
+    one on commande_downlink (idx_commande_envoyee), one multi-row alert INSERT.
+    Mode commands sent and EN_ATTENTE commands older than the timeout become EXPIREE
+    (idx_commande_envoyee, idx_commande_a_envoyer).
+    """
+    timeout = settings.COMMAND_CONFIRM_TIMEOUT_SECONDS
+    # moteur_commande_timestamp is naive UTC (datetime.utcnow)
+    cutoff = func.timezone("utc", func.now()) - timedelta(seconds=timeout)
+    erreur = f"Aucune confirmation du boîtier après {timeout}s"
+    claim_cutoff = func.timezone("utc", func.now()) - timedelta(seconds=settings.COMMAND_CLAIM_TIMEOUT_SECONDS)
+    async with SessionLocal() as db:
+        # Claimed by a worker that stopped before recording the send: back in the queue
+        result = await db.execute(
+            update(DownlinkCommand)
+            .where(DownlinkCommand.statut == CommandStatus.EN_COURS_ENVOI.value, DownlinkCommand.date_envoi < claim_cutoff)
+            .values(statut=CommandStatus.EN_ATTENTE.value, date_envoi=None)
+            .execution_options(synchronize_session=False)
+        )
+        if result.rowcount:
+            logger.warning(f"[COMMAND] {result.rowcount} command(s) claimed but never recorded: queued again")
+
+        result = await db.execute(
+            update(Vehicle)
+            .where(Vehicle.moteur_en_attente.is_(True), Vehicle.moteur_commande_timestamp < cutoff)
+            .values(moteur_en_attente=False, moteur_commande_timestamp=None)
+            .returning(Vehicle)
+            .execution_options(synchronize_session=False)
+        )
+        vehicles = result.scalars().all()
+
+        # Mode commands: a txack may never come (HTTP transport). Unsent commands are obsolete by now
+        await db.execute(
+            update(DownlinkCommand)
+            .where(
+                DownlinkCommand.statut == CommandStatus.ENVOYEE.value,
+                DownlinkCommand.type_commande.in_(MODE_COMMANDS),
+                DownlinkCommand.date_envoi < cutoff,
+            )
+            .values(statut=CommandStatus.EXPIREE.value, erreur=f"Transmission non confirmée après {timeout}s")
+            .execution_options(synchronize_session=False)
+        )
+        await db.execute(
+            update(DownlinkCommand)
+            .where(DownlinkCommand.statut == CommandStatus.EN_ATTENTE.value, DownlinkCommand.created_at < cutoff)
+            .values(statut=CommandStatus.EXPIREE.value, erreur=f"Non envoyée dans les {timeout}s")
+            .execution_options(synchronize_session=False)
+        )
+
+        engine_sent = (
+            DownlinkCommand.statut == CommandStatus.ENVOYEE.value,
+            DownlinkCommand.type_commande.in_(ENGINE_COMMANDS),
+        )
+        await db.execute(
+            update(DownlinkCommand)
+            .where(*engine_sent, DownlinkCommand.date_envoi < cutoff)
+            .values(statut=CommandStatus.ECHOUEE.value, erreur=erreur)
+            .execution_options(synchronize_session=False)
+        )
+        if not vehicles:
+            await db.commit()
+            return
+
+        await db.execute(
+            update(DownlinkCommand)
+            .where(*engine_sent, DownlinkCommand.id_vehicule.in_([v.id_vehicule for v in vehicles]))
+            .values(statut=CommandStatus.ECHOUEE.value, erreur=erreur)
+            .execution_options(synchronize_session=False)
+        )
+        now = datetime.utcnow()
+        alerts = (await db.scalars(insert(Alert).returning(Alert), [
+            {
+                "id_vehicule": vehicle.id_vehicule,
+                "type_alerte": "MOTEUR_COUPE",
+                "severite": "CRITIQUE",
+                "message": (
+                    f"Erreur de communication : Le boîtier du véhicule "
+                    f"{vehicle.immatriculation or vehicle.nom or vehicle.deveui} "
+                    f"n'a pas répondu à la commande dans les {timeout // 60} minutes."
+                ),
+                "details_json": json.dumps({"action": "command_timeout", "deveui": vehicle.deveui}),
+                "created_at": now,
+                "acquittee": False,
+            }
+            for vehicle in vehicles
+        ])).all()
+        await db.commit()
+
+    logger.warning(
+        f"Timeout ({timeout}s) for engine command on {len(vehicles)} vehicle(s): "
+        f"{', '.join(v.deveui for v in vehicles)}. Reset."
+    )
+    owners = {}
+    for vehicle in vehicles:
+        deveui_resolver.refresh(vehicle)
+        vehicle_state.refresh(vehicle)
+        owners[vehicle.id_vehicule] = vehicle.id_utilisateur_proprietaire
+    await asyncio.gather(*(
+        manager.send_personal_message({
+            "type": "NEW_ALERT",
+            "data": {
+                "id": alert.id_alerte,
+                "vehicle_id": alert.id_vehicule,
+                "message": alert.message,
+                "severity": alert.severite,
+                "timestamp": alert.created_at.isoformat(),
+            },
+        }, owners[alert.id_vehicule])
+        for alert in alerts
+        if owners.get(alert.id_vehicule)
+    ))
+
+
+command_worker = CommandWorker(
+    poll_interval=settings.COMMAND_POLL_INTERVAL_SECONDS,
+    batch_size=settings.COMMAND_BATCH_SIZE,
+)
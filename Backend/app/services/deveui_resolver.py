@@ -0,0 +1,159 @@
+import logging
+import time
+from typing import Dict, Iterable, Optional
+from sqlalchemy import func
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+from app.core.config import settings
+from app.models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+
+class VehicleSnapshot:
+    """
+    The subset of a vehicule row the uplink path needs.
+    Cached snapshots are updated in place, so holders always see the current state.
+    """
+    __slots__ = (
+        "id_vehicule",
+        "deveui",
+        "id_utilisateur_proprietaire",
+        "mode_auto",
+        "moteur_coupe",
+        "moteur_en_attente",
+    )
+
+    def __init__(self, source):
+        self.update_from(source)
+
+    def update_from(self, source):
+        """Copy the cached fields from a Vehicle (or a row with the same attributes)."""
+        for field in self.__slots__:
+            setattr(self, field, getattr(source, field))
+
+
+_SNAPSHOT_COLUMNS = [getattr(Vehicle, field) for field in VehicleSnapshot.__slots__]
+
+
+class DevEuiResolver:
+    """
+    In-memory DevEUI → vehicle resolution.
+    Keys are normalized lowercase hex. Unknown DevEUIs are remembered for
+    `negative_ttl` seconds so a rogue device cannot hit the DB on every frame.
+    The vehicle endpoints refresh or invalidate entries when a vehicle changes; known
+    vehicles are also reloaded after `ttl` seconds, so changes made by another worker
+    (or straight in the DB) are picked up. A reload updates the snapshot in place.
+    """
+
+    def __init__(self, ttl: float, negative_ttl: float, negative_max_size: int = 10000):
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.negative_max_size = negative_max_size
+        self._vehicles: Dict[str, VehicleSnapshot] = {}
+        self._expiry: Dict[str, float] = {}  # dev_eui -> expiry of its snapshot (monotonic)
+        self._unknown: Dict[str, float] = {}  # dev_eui -> expiry (monotonic)
+        self.hits = 0
+        self.misses = 0
+        self.negative_hits = 0
+
+    @staticmethod
+    def normalize(dev_eui: str) -> str:
+        return dev_eui.strip().lower()
+
+    async def resolve(self, dev_eui: str, db: AsyncSession) -> Optional[VehicleSnapshot]:
+        key = self.normalize(dev_eui)
+        return (await self.resolve_many([key], db)).get(key)
+
+    async def resolve_many(self, dev_euis: Iterable[str], db: AsyncSession) -> Dict[str, Optional[VehicleSnapshot]]:
+        """
+        Resolve several DevEUIs at once. Cache misses are loaded with a single SELECT.
+        Returns a map normalized DevEUI → snapshot (None for unknown devices).
+        """
+        resolved: Dict[str, Optional[VehicleSnapshot]] = {}
+        missing = []
+        now = time.monotonic()
+        for dev_eui in set(self.normalize(d) for d in dev_euis):
+            snapshot = self._vehicles.get(dev_eui)
+            if snapshot is not None and self._expiry.get(dev_eui, 0) > now:
+                self.hits += 1
+                resolved[dev_eui] = snapshot
+                continue
+            expiry = self._unknown.get(dev_eui)
+            if expiry is not None:
+                if expiry > now:
+                    self.negative_hits += 1
+                    resolved[dev_eui] = None
+                    continue
+                del self._unknown[dev_eui]
+            self.misses += 1
+            missing.append(dev_eui)
+
+        if missing:
+            result = await db.execute(
+                select(*_SNAPSHOT_COLUMNS).where(func.lower(Vehicle.deveui).in_(missing))
+            )
+            for row in result.all():
+                snapshot = self.refresh(row)
+                resolved[self.normalize(row.deveui)] = snapshot
+            for dev_eui in missing:
+                if dev_eui not in resolved:
+                    # Expired snapshot of a vehicle deleted (or re-keyed) elsewhere
+                    self._vehicles.pop(dev_eui, None)
+                    self._expiry.pop(dev_eui, None)
+                    self._remember_unknown(dev_eui, now)
+                    resolved[dev_eui] = None
+        return resolved
+
+    def peek(self, dev_eui: str) -> Optional[VehicleSnapshot]:
+        """Cached snapshot of a DevEUI, without touching the DB (None if not cached)."""
+        return self._vehicles.get(self.normalize(dev_eui))
+
+    def peek_unknown(self, dev_eui: str) -> bool:
+        """Whether a DevEUI is cached as not registered, without touching the DB."""
+        expiry = self._unknown.get(self.normalize(dev_eui))
+        return expiry is not None and expiry > time.monotonic()
+
+    def refresh(self, vehicle) -> VehicleSnapshot:
+        """Insert or update the cached snapshot of a vehicle after it changed."""
+        key = self.normalize(vehicle.deveui)
+        self._unknown.pop(key, None)
+        snapshot = self._vehicles.get(key)
+        if snapshot is None:
+            snapshot = VehicleSnapshot(vehicle)
+            self._vehicles[key] = snapshot
+        else:
+            snapshot.update_from(vehicle)
+        self._expiry[key] = time.monotonic() + self.ttl
+        return snapshot
+
+    def invalidate(self, dev_eui: str):
+        """Forget a DevEUI (vehicle deleted or DevEUI changed)."""
+        key = self.normalize(dev_eui)
+        self._vehicles.pop(key, None)
+        self._expiry.pop(key, None)
+        self._unknown.pop(key, None)
+
+    def _remember_unknown(self, dev_eui: str, now: float):
+        if len(self._unknown) >= self.negative_max_size:
+            # Drop expired entries first, then the oldest ones
+            self._unknown = {k: exp for k, exp in self._unknown.items() if exp > now}
+            while len(self._unknown) >= self.negative_max_size:
+                self._unknown.pop(next(iter(self._unknown)))
+        self._unknown[dev_eui] = now + self.negative_ttl
+        logger.info(f"DevEUI {dev_eui} unknown, cached as negative for {self.negative_ttl:.0f}s")
+
+    def stats(self) -> dict:
+        return {
+            "cached_vehicles": len(self._vehicles),
+            "cached_unknown": len(self._unknown),
+            "hits": self.hits,
+            "misses": self.misses,
+            "negative_hits": self.negative_hits,
+        }
+
+
+deveui_resolver = DevEuiResolver(
+    ttl=settings.DEVEUI_CACHE_TTL_SECONDS,
+    negative_ttl=settings.DEVEUI_NEGATIVE_CACHE_TTL_SECONDS,
+)
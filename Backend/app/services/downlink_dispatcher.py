@@ -0,0 +1,91 @@
+import asyncio
+import logging
+import random
+from typing import Awaitable, Callable, Dict, Iterable, List, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class DownlinkError(Exception):
+    """A downlink was not accepted. `retryable` is False for errors a retry won't fix (4xx)."""
+
+    def __init__(self, message: str, retryable: bool = True):
+        super().__init__(message)
+        self.retryable = retryable
+
+
+class DownlinkDispatcher:
+    """
+    Sends downlinks with bounded concurrency, strict per-device ordering and retry with
+    exponential backoff. Downlinks for different devices go out in parallel (up to
+    `concurrency` requests in flight); downlinks for one device are sent in submission order.
+    Ordering is a chain rather than a lock: each downlink waits for the completion of the one
+    submitted before it for the same device, and the device's entry is dropped as soon as its
+    last downlink completes, so the map only holds the devices with downlinks in progress.
+    A retry backoff holds nothing but its own place in the device's chain.
+    """
+
+    def __init__(
+        self,
+        sender: Callable[[str, str, int], Awaitable[None]],
+        concurrency: int,
+        max_attempts: int,
+        backoff_seconds: float,
+    ):
+        self._sender = sender
+        self._semaphore = asyncio.Semaphore(concurrency)
+        self._tails: Dict[str, asyncio.Future] = {}  # dev_eui -> completion of its last submitted downlink
+        self.max_attempts = max_attempts
+        self.backoff_seconds = backoff_seconds
+        self.sent = 0
+        self.failed = 0
+        self.retried = 0
+
+    async def send(self, dev_eui: str, data: str, f_port: int = 10) -> bool:
+        """Send one downlink. Returns True once ChirpStack accepted it, False after the last attempt."""
+        key = dev_eui.lower()
+        previous = self._tails.get(key)
+        done = asyncio.get_running_loop().create_future()
+        self._tails[key] = done
+        try:
+            if previous is not None:
+                # Shielded: a cancelled send must not cancel its predecessor's completion
+                await asyncio.shield(previous)
+            return await self._attempts(dev_eui, data, f_port)
+        finally:
+            if previous is not None and not previous.done():
+                # Cancelled while waiting: the next downlink still waits for the previous one
+                previous.add_done_callback(lambda _: self._complete(key, done))
+            else:
+                self._complete(key, done)
+
+    def _complete(self, key: str, done: asyncio.Future):
+        done.set_result(None)
+        if self._tails.get(key) is done:
+            del self._tails[key]
+
+    async def _attempts(self, dev_eui: str, data: str, f_port: int) -> bool:
+        for attempt in range(1, self.max_attempts + 1):
+            try:
+                async with self._semaphore:
+                    await self._sender(dev_eui, data, f_port)
+                self.sent += 1
+                return True
+            except DownlinkError as e:
+                if not e.retryable or attempt == self.max_attempts:
+                    self.failed += 1
+                    logger.error(f"Failed to send downlink to {dev_eui} after {attempt} attempt(s): {e}")
+                    return False
+                # Backoff outside the semaphore so other devices keep going
+                delay = self.backoff_seconds * (2 ** (attempt - 1)) * random.uniform(0.8, 1.2)
+                self.retried += 1
+                logger.warning(f"Downlink to {dev_eui} failed ({e}), retry {attempt}/{self.max_attempts - 1} in {delay:.1f}s")
+                await asyncio.sleep(delay)
+        return False
+
+    async def send_many(self, downlinks: Iterable[Tuple[str, str, int]]) -> List[bool]:
+        """Fan out (dev_eui, data, f_port) downlinks in parallel."""
+        return await asyncio.gather(*(self.send(dev_eui, data, f_port) for dev_eui, data, f_port in downlinks))
+
+    def stats(self) -> dict:
+        return {"sent": self.sent, "failed": self.failed, "retried": self.retried, "devices_in_flight": len(self._tails)}
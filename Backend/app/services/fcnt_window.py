@@ -0,0 +1,111 @@
+"""
+Uplink de-duplication by LoRaWAN frame counter.
+The same frame can arrive twice: heard by several gateways, or re-posted by ChirpStack's
+HTTP integration after a timeout. Each device gets a sliding window over its fCnt, like
+the IPsec anti-replay window: the highest fCnt seen plus a bitmask of the FCNT_WINDOW_SIZE
+counters below it. A frame is checked in O(1) once its DevEUI resolves to a registered
+vehicle (unknown devices never get a window), before any write:
+  - above the highest → new, the window slides
+  - inside the window → new if its bit is clear (late, out of order), else a duplicate
+  - below the window → a replay, unless the device restarted its counter (rejoin, reboot,
+    32-bit wrap): a small fCnt while the device is well past it resets the window.
+The highest fCnt is persisted in vehicule.dernier_fcnt with the vehicle's last position and
+read back at startup; after a restart everything up to it is treated as already seen.
+"""
+
+import logging
+from typing import Dict, Optional
+
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+
+class _Window:
+    __slots__ = ("highest", "seen")
+
+    def __init__(self, highest: int, seen: int):
+        self.highest = highest
+        self.seen = seen  # bit i set: fCnt highest - i was received
+
+
+class FcntWindow:
+
+    def __init__(self, size: int, reset_threshold: int):
+        self.size = size
+        self.reset_threshold = reset_threshold
+        self._full = (1 << size) - 1
+        self._windows: Dict[str, _Window] = {}
+        self.accepted = 0
+        self.duplicates = 0
+        self.replays = 0
+        self.resets = 0
+
+    async def load(self):
+        """Seed the windows from vehicule.dernier_fcnt (startup)."""
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Vehicle.deveui, Vehicle.dernier_fcnt)
+                .where(Vehicle.deveui.isnot(None), Vehicle.dernier_fcnt.isnot(None))
+            )
+            rows = result.all()
+        for dev_eui, f_cnt in rows:
+            self._windows.setdefault(dev_eui.strip().lower(), _Window(f_cnt, self._full))
+        logger.info(f"fCnt windows loaded for {len(self._windows)} device(s)")
+
+    def check(self, dev_eui: str, f_cnt: Optional[int]) -> Optional[str]:
+        """Record a frame. Returns "duplicate" or "replay" when it must be dropped, else None."""
+        if f_cnt is None:
+            return None
+        key = dev_eui.strip().lower()
+        window = self._windows.get(key)
+        if window is None:
+            self._windows[key] = _Window(f_cnt, 1)
+            self.accepted += 1
+            return None
+
+        offset = window.highest - f_cnt
+        if offset < 0:
+            shift = -offset
+            window.seen = ((window.seen << shift) | 1) & self._full if shift < self.size else 1
+            window.highest = f_cnt
+        elif f_cnt <= self.reset_threshold < offset:
+            logger.info(f"fCnt reset detected for {key}: {window.highest} → {f_cnt}")
+            window.highest, window.seen = f_cnt, 1
+            self.resets += 1
+        elif offset >= self.size:
+            self.replays += 1
+            return "replay"
+        elif window.seen >> offset & 1:
+            self.duplicates += 1
+            return "duplicate"
+        else:
+            window.seen |= 1 << offset
+        self.accepted += 1
+        return None
+
+    def release(self, dev_eui: str, f_cnt: Optional[int]):
+        """Forget a frame that could not be stored, so that its retry is accepted."""
+        window = self._windows.get(dev_eui.strip().lower()) if f_cnt is not None else None
+        if window is not None and 0 <= window.highest - f_cnt < self.size:
+            window.seen &= ~(1 << (window.highest - f_cnt))
+
+    def highest(self, dev_eui: str) -> Optional[int]:
+        window = self._windows.get(dev_eui.strip().lower())
+        return window.highest if window is not None else None
+
+    def stats(self) -> dict:
+        return {
+            "devices": len(self._windows),
+            "accepted": self.accepted,
+            "duplicates": self.duplicates,
+            "replays": self.replays,
+            "resets": self.resets,
+        }
+
+
+fcnt_window = FcntWindow(size=settings.FCNT_WINDOW_SIZE, reset_threshold=settings.FCNT_RESET_THRESHOLD)
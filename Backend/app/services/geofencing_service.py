@@ -1,13 +1,21 @@
 import logging
 import math
-from typing import List, Dict, Any, Optional
+import time
+from array import array
+from typing import List, Dict, Any, Optional, Tuple, Union
+import numpy as np
+from sqlalchemy import update
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.future import select
 from app.models.vehicle import Vehicle
 from app.models.zone import Zone
 from app.models.alert import Alert
-from app.services.chirpstack import send_stop_command
+from app.models.command import CommandType
+from app.services.command_service import command_worker, enqueue_command
 from app.services.notification_service import manager
+from app.services.deveui_resolver import VehicleSnapshot
+from app.services.vehicle_state import vehicle_state
+from app.core.config import settings
 from datetime import datetime
 
 logger = logging.getLogger(__name__)
@@ -56,51 +64,241 @@ def is_point_in_circle(lat: float, lon: float, center_lat: float, center_lon: fl
     
     return distance <= radius_m
 
+EARTH_RADIUS_M = 6371000.0
+METRES_PER_DEGREE = math.pi * EARTH_RADIUS_M / 180.0
+
+class CompiledZone:
+    """
+    A zone compiled once for the per-frame hot path: vertices as float arrays,
+    a bounding box for a cheap reject, and for circles an equirectangular
+    longitude scale factor with a tolerance band where the exact Haversine is used.
+    contains() gives the same answers as is_point_in_polygon / is_point_in_circle.
+    """
+    __slots__ = (
+        "id_zone", "is_polygon", "always_inside",
+        "lats", "lons",
+        "min_lat", "max_lat", "min_lon", "max_lon",
+        "center_lat", "center_lon", "radius_m", "lon_scale", "tolerance",
+    )
+
+    def __init__(self, zone: Zone):
+        self.id_zone = zone.id_zone
+        self.is_polygon = zone.type == "POLYGON"
+        self.always_inside = False
+        if self.is_polygon:
+            coordinates = zone.coordinates or []
+            self.lats = array("d", (float(p["lat"]) for p in coordinates))
+            self.lons = array("d", (float(p["lng"]) for p in coordinates))
+            if len(self.lats) < 3:
+                # Same safety default as is_point_in_polygon
+                self.always_inside = True
+                return
+            self.min_lat, self.max_lat = min(self.lats), max(self.lats)
+            self.min_lon, self.max_lon = min(self.lons), max(self.lons)
+        else:
+            # Default to CIRCLE
+            self.center_lat = float(zone.latitude_centre)
+            self.center_lon = float(zone.longitude_centre)
+            self.radius_m = float(zone.rayon_metres)
+            self.lon_scale = math.cos(math.radians(self.center_lat))
+            # Relative error of the equirectangular distance grows with the radius
+            # and with tan(latitude); inside that band we fall back to Haversine.
+            dlat_rad = self.radius_m / EARTH_RADIUS_M
+            tan_lat = abs(math.tan(math.radians(min(abs(self.center_lat), 89.0))))
+            self.tolerance = 1e-3 + 4.0 * dlat_rad * (tan_lat + dlat_rad)
+            reach = self.radius_m * (1.0 + self.tolerance)
+            dlat_deg = reach / METRES_PER_DEGREE
+            self.min_lat, self.max_lat = self.center_lat - dlat_deg, self.center_lat + dlat_deg
+            lowest_cos = math.cos(math.radians(min(abs(self.center_lat) + dlat_deg, 90.0)))
+            if lowest_cos <= 1e-9 or reach / (METRES_PER_DEGREE * lowest_cos) >= 180.0:
+                self.min_lon, self.max_lon = -math.inf, math.inf
+            else:
+                dlon_deg = reach / (METRES_PER_DEGREE * lowest_cos)
+                self.min_lon, self.max_lon = self.center_lon - dlon_deg, self.center_lon + dlon_deg
+
+    def contains(self, lat: float, lon: float) -> bool:
+        if self.always_inside:
+            return True
+        # Cheap bounding box reject
+        if lat < self.min_lat or lat > self.max_lat or lon < self.min_lon or lon > self.max_lon:
+            return False
+        if self.is_polygon:
+            return self._ray_cast(lat, lon)
+        dy = lat - self.center_lat
+        dx = (lon - self.center_lon) * self.lon_scale
+        distance = math.sqrt(dx * dx + dy * dy) * METRES_PER_DEGREE
+        if distance < self.radius_m * (1.0 - self.tolerance):
+            return True
+        if distance > self.radius_m * (1.0 + self.tolerance):
+            return False
+        return is_point_in_circle(lat, lon, self.center_lat, self.center_lon, self.radius_m)
+
+    def _ray_cast(self, lat: float, lon: float) -> bool:
+        lats, lons = self.lats, self.lons
+        inside = False
+        j = len(lats) - 1
+        for i in range(len(lats)):
+            yi, yj = lats[i], lats[j]
+            if ((yi > lat) != (yj > lat)) and (yj != yi):
+                xi = lons[i]
+                if lon < (lons[j] - xi) * (lat - yi) / (yj - yi) + xi:
+                    inside = not inside
+            j = i
+        return inside
+
+
+# Max number of (point, edge) pairs evaluated at once by the polygon batch path
+_BATCH_CELLS = 2_000_000
+
+def check_points_batch(
+    zone: Union[Zone, CompiledZone],
+    lats,
+    lons,
+) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Vectorized geofence evaluation for many points (history replay, audits).
+    lats / lons: array-likes of the same length.
+    Returns (inside, distance): a bool array with the same answers as
+    is_point_in_polygon / is_point_in_circle, and the distance in metres from
+    each point to the zone boundary (NaN for a degenerate polygon).
+    """
+    if not isinstance(zone, CompiledZone):
+        zone = CompiledZone(zone)
+    lats = np.asarray(lats, dtype=np.float64)
+    lons = np.asarray(lons, dtype=np.float64)
+
+    if zone.always_inside:
+        return np.ones(lats.shape, dtype=bool), np.full(lats.shape, np.nan)
+
+    if not zone.is_polygon:
+        # Same Haversine formula as is_point_in_circle
+        phi1, phi2 = np.radians(lats), math.radians(zone.center_lat)
+        dphi = np.radians(zone.center_lat - lats)
+        dlambda = np.radians(zone.center_lon - lons)
+        a = np.sin(dphi / 2) ** 2 + np.cos(phi1) * math.cos(phi2) * np.sin(dlambda / 2) ** 2
+        c = 2 * np.arctan2(np.sqrt(a), np.sqrt(1 - a))
+        distance = EARTH_RADIUS_M * c
+        return distance <= zone.radius_m, np.abs(distance - zone.radius_m)
+
+    inside = np.zeros(lats.shape, dtype=bool)
+    distance = np.empty(lats.shape, dtype=np.float64)
+    yi = np.frombuffer(zone.lats, dtype=np.float64)
+    xi = np.frombuffer(zone.lons, dtype=np.float64)
+    yj, xj = np.roll(yi, 1), np.roll(xi, 1)  # previous vertex, like j = i - 1 in the scalar loop
+    flat = yj == yi
+    dy = np.where(flat, 1.0, yj - yi)
+
+    # Local equirectangular frame (metres) for the distance to the edges
+    scale = math.cos(math.radians((zone.min_lat + zone.max_lat) / 2))
+    ex, ey = (xj - xi) * scale, yj - yi
+    seg_len2 = ex * ex + ey * ey
+    seg_len2 = np.where(seg_len2 == 0, 1.0, seg_len2)
+
+    chunk = max(1, _BATCH_CELLS // len(yi))
+    for start in range(0, len(lats), chunk):
+        lat = lats[start:start + chunk, None]
+        lon = lons[start:start + chunk, None]
+
+        # Ray casting over all edges at once, same arithmetic as is_point_in_polygon
+        crosses = ((yi > lat) != (yj > lat)) & ~flat & (lon < (xj - xi) * (lat - yi) / dy + xi)
+        inside[start:start + chunk] = np.logical_xor.reduce(crosses, axis=1)
+
+        # Distance to the closest edge
+        px, py = (lon - xi) * scale, lat - yi
+        t = np.clip((px * ex + py * ey) / seg_len2, 0.0, 1.0)
+        dx, dyy = px - t * ex, py - t * ey
+        distance[start:start + chunk] = np.sqrt((dx * dx + dyy * dyy).min(axis=1)) * METRES_PER_DEGREE
+
+    return inside, distance
+
+
+class GeofenceIndex:
+    """
+    Per-vehicle cache of the compiled active zone (or None when the vehicle has none).
+    geofences.py invalidates a vehicle's entry whenever one of its zones is created,
+    updated or deleted; entries also expire after `ttl` seconds so edits made
+    through another worker process are picked up.
+    """
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._zones: Dict[int, tuple] = {}  # id_vehicule -> (CompiledZone | None, expiry)
+        self._generations: Dict[int, int] = {}
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, vehicle_id: int, db: AsyncSession) -> Optional[CompiledZone]:
+        entry = self._zones.get(vehicle_id)
+        if entry is not None and entry[1] > time.monotonic():
+            self.hits += 1
+            return entry[0]
+        self.misses += 1
+        generation = self._generations.get(vehicle_id, 0)
+        result = await db.execute(
+            select(Zone).where(Zone.id_vehicule == vehicle_id, Zone.active == True)
+        )
+        zone = result.scalars().first()
+        compiled = CompiledZone(zone) if zone else None
+        # Don't store a zone loaded before a concurrent invalidation
+        if self._generations.get(vehicle_id, 0) == generation:
+            self._zones[vehicle_id] = (compiled, time.monotonic() + self.ttl)
+        return compiled
+
+    def peek(self, vehicle_id: int) -> Tuple[bool, Optional[CompiledZone]]:
+        """(cached, zone) without touching the DB; an expired entry still counts as cached."""
+        entry = self._zones.get(vehicle_id)
+        return (True, entry[0]) if entry is not None else (False, None)
+
+    def invalidate(self, vehicle_id: Optional[int]):
+        if vehicle_id is None:
+            return
+        self._zones.pop(vehicle_id, None)
+        self._generations[vehicle_id] = self._generations.get(vehicle_id, 0) + 1
+
+    def stats(self) -> dict:
+        return {"cached_vehicles": len(self._zones), "hits": self.hits, "misses": self.misses}
+
+
+geofence_index = GeofenceIndex(ttl=settings.GEOFENCE_CACHE_TTL_SECONDS)
+
 async def check_and_enforce_geofence(
-    vehicle: Vehicle, 
+    vehicle: VehicleSnapshot, 
     lat: float, 
     lon: float, 
     db: AsyncSession
 ) -> Optional[bool]:
     """
     Main logic for backend-side geofencing.
+    `vehicle` is the cached snapshot from the DevEUI resolver; it is updated in place on breach.
     Returns:
         True if inside, False if outside, None if no zone/mode_auto disabled.
     """
     if not vehicle.mode_auto:
         return None
 
-    # Get active zone for this vehicle
-    result = await db.execute(
-        select(Zone).where(Zone.id_vehicule == vehicle.id_vehicule, Zone.active == True)
-    )
-    zone = result.scalars().first()
+    # Get active zone for this vehicle (compiled, cached per vehicle)
+    zone = await geofence_index.get(vehicle.id_vehicule, db)
     
     if not zone:
         return None
 
-    is_inside = True
-    if zone.type == "POLYGON":
-        is_inside = is_point_in_polygon(lat, lon, zone.coordinates or [])
-    else:
-        # Default to CIRCLE
-        is_inside = is_point_in_circle(
-            lat, lon, 
-            float(zone.latitude_centre), 
-            float(zone.longitude_centre), 
-            float(zone.rayon_metres)
-        )
+    is_inside = zone.contains(lat, lon)
 
     if not is_inside and not vehicle.moteur_coupe:
         logger.warning(f"[GEOFENCE] Breach detected for vehicle {vehicle.deveui} at {lat}, {lon}")
         
-        # 1. Trigger STOP downlink
-        await send_stop_command(vehicle.deveui)
+        # 1. Queue the STOP command (sent by the command worker once committed)
+        enqueue_command(db, vehicle.id_vehicule, CommandType.COUPER_MOTEUR)
         
         # 2. Update vehicle state to PENDING confirmation
+        command_timestamp = datetime.utcnow()
+        await db.execute(
+            update(Vehicle)
+            .where(Vehicle.id_vehicule == vehicle.id_vehicule)
+            .values(moteur_en_attente=True, moteur_commande_timestamp=command_timestamp)
+        )
         vehicle.moteur_en_attente = True
-        vehicle.moteur_commande_timestamp = datetime.utcnow()
-        db.add(vehicle)
+        vehicle_state.touch(vehicle.id_vehicule, moteur_en_attente=True, moteur_commande_timestamp=command_timestamp)
         
         # 3. Create Alert for Geofence Breach and Engine Stop Request
         alert = Alert(
@@ -115,6 +313,7 @@ async def check_and_enforce_geofence(
         db.add(alert)
         await db.commit()
         await db.refresh(alert)
+        command_worker.wake()
         
         # 4. Broadcast via WebSocket
         message_data = {
@@ -0,0 +1,130 @@
+"""
+GPS quality gate, run before geofencing and persistence.
+A bad fix (0,0 from a module without a fix, a jump of several kilometres) would otherwise
+be stored, and could put the vehicle outside its zone and trigger a STOP downlink.
+A fix is rejected when:
+  - its coordinates are out of range or on "null island" (0,0)
+  - its reported speed exceeds the position_gps CHECK (500 km/h)
+  - it reports too few satellites or a too high HDOP (when the device sends them)
+  - reaching it from the vehicle's last good fix implies an impossible speed
+The last good fix is the only per-vehicle state. After GPS_MAX_CONSECUTIVE_REJECTS jumps
+in a row the new position is accepted as the new reference: the vehicle did move (towed
+while off, or the reference was a bad fix accepted at startup).
+GPS_QUALITY_ACTION: "drop" discards rejected fixes, "flag" stores them with fix_status=0
+and statut OK (ignored by the trip and stop triggers), without geofencing them or updating
+the vehicle's last position. The track and position history skip them.
+"""
+
+import logging
+import math
+from datetime import datetime
+from typing import Dict, Optional
+
+from app.core.config import settings
+from app.services.geofencing_service import METRES_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+# ~100 m around (0, 0): what a GPS module reports before its first fix
+NULL_ISLAND_DEGREES = 1e-3
+MAX_REPORTED_SPEED_KMH = 500.0  # chk_position_vitesse
+
+REASONS = ("out_of_range", "null_island", "reported_speed", "satellites", "hdop", "implied_speed")
+
+
+class _GoodFix:
+    __slots__ = ("latitude", "longitude", "timestamp", "rejects")
+
+    def __init__(self, latitude: float, longitude: float, timestamp: datetime):
+        self.latitude = latitude
+        self.longitude = longitude
+        self.timestamp = timestamp
+        self.rejects = 0
+
+
+class GpsQualityFilter:
+
+    def __init__(
+        self,
+        action: str,
+        max_implied_speed_kmh: float,
+        jump_tolerance_m: float,
+        min_satellites: int,
+        max_hdop: float,
+        max_consecutive_rejects: int,
+    ):
+        self.keep_rejected = action == "flag"
+        self.max_implied_speed_kmh = max_implied_speed_kmh
+        self.jump_tolerance_m = jump_tolerance_m
+        self.min_satellites = min_satellites
+        self.max_hdop = max_hdop
+        self.max_consecutive_rejects = max_consecutive_rejects
+        self._last: Dict[int, _GoodFix] = {}
+        self.accepted = 0
+        self.rejected: Dict[str, int] = dict.fromkeys(REASONS, 0)
+
+    def _static_reason(self, lat: float, lon: float, speed: float, satellites: int, hdop: Optional[float]) -> Optional[str]:
+        if not (-90.0 <= lat <= 90.0 and -180.0 <= lon <= 180.0):
+            return "out_of_range"
+        if abs(lat) < NULL_ISLAND_DEGREES and abs(lon) < NULL_ISLAND_DEGREES:
+            return "null_island"
+        if speed > MAX_REPORTED_SPEED_KMH:
+            return "reported_speed"
+        # 0 = not reported (the FPort 1 frame carries no satellite count)
+        if 0 < satellites < self.min_satellites:
+            return "satellites"
+        if hdop is not None and hdop > self.max_hdop:
+            return "hdop"
+        return None
+
+    def check(
+        self,
+        vehicle_id: int,
+        lat: float,
+        lon: float,
+        timestamp: datetime,
+        speed: float = 0.0,
+        satellites: int = 0,
+        hdop: Optional[float] = None,
+    ) -> Optional[str]:
+        """Return the rejection reason of a fix, or None if it is good (it becomes the reference)."""
+        reason = self._static_reason(lat, lon, speed, satellites, hdop)
+        last = self._last.get(vehicle_id)
+        if reason is None and last is not None:
+            dx = (lon - last.longitude) * math.cos(math.radians(lat))
+            dy = lat - last.latitude
+            distance = math.sqrt(dx * dx + dy * dy) * METRES_PER_DEGREE
+            if distance > self.jump_tolerance_m:
+                elapsed = max((timestamp - last.timestamp).total_seconds(), 1.0)
+                if distance / elapsed * 3.6 > self.max_implied_speed_kmh:
+                    last.rejects += 1
+                    if last.rejects <= self.max_consecutive_rejects:
+                        reason = "implied_speed"
+
+        if reason is not None:
+            self.rejected[reason] += 1
+            return reason
+        if last is None:
+            self._last[vehicle_id] = _GoodFix(lat, lon, timestamp)
+        else:
+            last.latitude, last.longitude, last.timestamp, last.rejects = lat, lon, timestamp, 0
+        self.accepted += 1
+        return None
+
+    def stats(self) -> dict:
+        return {
+            "action": "flag" if self.keep_rejected else "drop",
+            "vehicles": len(self._last),
+            "accepted": self.accepted,
+            "rejected": dict(self.rejected),
+        }
+
+
+gps_filter = GpsQualityFilter(
+    action=settings.GPS_QUALITY_ACTION,
+    max_implied_speed_kmh=settings.GPS_MAX_IMPLIED_SPEED_KMH,
+    jump_tolerance_m=settings.GPS_JUMP_TOLERANCE_METRES,
+    min_satellites=settings.GPS_MIN_SATELLITES,
+    max_hdop=settings.GPS_MAX_HDOP,
+    max_consecutive_rejects=settings.GPS_MAX_CONSECUTIVE_REJECTS,
+)
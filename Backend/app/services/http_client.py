@@ -0,0 +1,49 @@
+import logging
+from typing import Optional
+import httpx
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+class HttpClientPool:
+    """
+    Application-lifetime httpx client shared by the ChirpStack and OSRM services,
+    so outgoing calls reuse keep-alive connections instead of paying TCP setup each time.
+    Opened in FastAPI startup and closed in shutdown.
+    """
+
+    def __init__(self, max_connections: int, max_keepalive_connections: int, timeout: float):
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+        )
+        self.timeout = timeout
+        self._client: Optional[httpx.AsyncClient] = None
+
+    async def start(self):
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+            logger.info(
+                f"HTTP client pool opened (max_connections={self.limits.max_connections}, "
+                f"keepalive={self.limits.max_keepalive_connections})"
+            )
+
+    async def stop(self):
+        if self._client is not None:
+            await self._client.aclose()
+            self._client = None
+            logger.info("HTTP client pool closed")
+
+    @property
+    def client(self) -> httpx.AsyncClient:
+        # Scripts running outside the app lifespan get a pool on first use
+        if self._client is None:
+            self._client = httpx.AsyncClient(limits=self.limits, timeout=self.timeout)
+        return self._client
+
+
+http_pool = HttpClientPool(
+    max_connections=settings.HTTP_MAX_CONNECTIONS,
+    max_keepalive_connections=settings.HTTP_MAX_KEEPALIVE_CONNECTIONS,
+    timeout=10.0,
+)
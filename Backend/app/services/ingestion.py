@@ -0,0 +1,614 @@
+"""
+Uplink ingestion pipeline.
+Shared processing path for ChirpStack uplinks. Frames are either processed inline
+by the webhook (INGESTION_MODE=sync) or pushed onto in-process queues and drained
+in micro-batches by background consumers (INGESTION_MODE=batched). Either way, frames
+are sharded by DevEUI onto INGESTION_LANES lanes that each process one frame (or batch)
+at a time, which keeps every device's frames in order; inline processing takes a lock of
+the device itself instead, so unrelated devices are never serialized.
+"""
+
+import asyncio
+import json
+import logging
+import os
+import time
+import zlib
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+
+from sqlalchemy import insert, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.vehicle import Vehicle
+from app.models.position import Position
+from app.models.alert import Alert
+from app.services.osrm import snap_to_road
+from app.services.uplink_schema import UplinkFrame, decode_frame, decode_frames
+from app.services.geofencing_service import check_and_enforce_geofence
+from app.services.notification_service import manager
+from app.services.deveui_resolver import VehicleSnapshot, deveui_resolver
+from app.services.command_service import confirm_engine_command
+from app.services.stationary import stationary
+from app.services.gps_quality import gps_filter
+from app.services.fcnt_window import fcnt_window
+from app.services.vehicle_state import vehicle_state
+
+logger = logging.getLogger(__name__)
+
+OSRM_ENABLED = os.getenv("OSRM_ENABLED", "false").lower() == "true"
+
+
+# ── Row values ──────────────────────────────────────────────────────────────
+
+def position_values(vehicle_id: int, frame: UplinkFrame, lat: float, lon: float, timestamp: datetime) -> Dict[str, Any]:
+    """Column values of the position_gps row stored for a GPS uplink."""
+    speed = frame.speed
+    return {
+        "id_vehicule": vehicle_id,
+        "latitude": lat,
+        "longitude": lon,
+        "altitude": frame.altitude,
+        "vitesse": speed,
+        "cap": frame.heading,
+        "timestamp_gps": timestamp,
+        "timestamp_fin": None,
+        "nb_repetitions": 1,
+        "fix_status": 1,
+        "satellites": frame.satellites,
+        "hdop": frame.hdop,
+        "statut": "EN_MOUVEMENT" if speed > 5 else "ARRET",
+        "dans_zone": None,
+        "distance_zone_metres": None,
+        "id_zone": None,
+        "batterie_pourcentage": None,
+        "payload_brut": f"CHIRPSTACK_FCNT_{frame.f_cnt}",
+        "f_cnt": frame.f_cnt,
+    }
+
+
+def live_position(vehicle_id: int, frame: UplinkFrame, lat: float, lon: float, timestamp: datetime, is_inside: Optional[bool]) -> Dict[str, Any]:
+    """Data of the POSITION_UPDATE streamed to the vehicle's WebSocket subscribers."""
+    return {
+        "vehicle_id": vehicle_id,
+        "latitude": lat,
+        "longitude": lon,
+        "vitesse": frame.speed,
+        "cap": frame.heading,
+        "timestamp": timestamp.isoformat(),
+        "dans_zone": is_inside,
+    }
+
+
+def flagged_position_values(vehicle_id: int, frame: UplinkFrame, lat: float, lon: float, timestamp: datetime) -> Dict[str, Any]:
+    """Row of a fix rejected by the GPS quality gate (GPS_QUALITY_ACTION=flag): kept for diagnosis only."""
+    values = position_values(vehicle_id, frame, lat, lon, timestamp)
+    values["fix_status"] = 0
+    # Out-of-range values would violate the position_gps CHECK constraints
+    values["latitude"] = min(max(lat, -90.0), 90.0)
+    values["longitude"] = min(max(lon, -180.0), 180.0)
+    values["vitesse"] = min(frame.speed, 500.0)
+    # Neither EN_MOUVEMENT nor ARRET: trg_gerer_trajet / trg_gerer_arret must not build trips
+    # and stops from a fix the gate rejected
+    values["statut"] = "OK"
+    return values
+
+
+# ── Relay confirmation ───────────────────────────────────────────────────────
+
+def is_relay_confirmation(vehicle: VehicleSnapshot, relay_status: Optional[str]) -> bool:
+    """Process relay confirmation only when a command is pending OR state changed."""
+    return relay_status in ("cut", "active") and (
+        vehicle.moteur_en_attente
+        or (relay_status == "cut") != vehicle.moteur_coupe
+    )
+
+
+async def confirm_relay(snapshot: VehicleSnapshot, relay_status: str, db: AsyncSession) -> str:
+    """Apply a relay_status confirmation sent by the device and notify the owner."""
+    vehicle = await db.get(Vehicle, snapshot.id_vehicule)
+    is_cut = relay_status == "cut"
+    vehicle.moteur_coupe = is_cut
+    vehicle.moteur_en_attente = False
+    db.add(vehicle)
+    await confirm_engine_command(db, vehicle.id_vehicule, is_cut)
+
+    confirmation_alert = Alert(
+        id_vehicule=vehicle.id_vehicule,
+        type_alerte="MOTEUR_COUPE",
+        severite="CRITIQUE" if is_cut else "FAIBLE",
+        message=(
+            f"Confirmation : Le relais du véhicule {vehicle.immatriculation} "
+            f"a été {'coupé' if is_cut else 'rétabli'} avec succès par le boîtier."
+        ),
+        details_json=json.dumps({
+            "action": "relay_cut_confirmed" if is_cut else "relay_active_confirmed",
+            "deveui": vehicle.deveui
+        }),
+        created_at=datetime.utcnow(),
+        acquittee=False,
+    )
+    db.add(confirmation_alert)
+    await db.commit()
+    await db.refresh(confirmation_alert)
+    deveui_resolver.refresh(vehicle)
+    vehicle_state.refresh(vehicle)
+
+    if vehicle.id_utilisateur_proprietaire:
+        # 1. Alert notification
+        await manager.send_personal_message({
+            "type": "NEW_ALERT",
+            "data": {
+                "id": confirmation_alert.id_alerte,
+                "vehicle_id": confirmation_alert.id_vehicule,
+                "message": confirmation_alert.message,
+                "severity": confirmation_alert.severite,
+                "timestamp": confirmation_alert.created_at.isoformat(),
+            },
+        }, vehicle.id_utilisateur_proprietaire)
+        # 2. Vehicle state update — triggers app to refresh vehicle list
+        await manager.send_personal_message({
+            "type": "VEHICLE_UPDATE",
+            "data": {
+                "vehicle_id": vehicle.id_vehicule,
+                "moteur_coupe": is_cut,
+                "moteur_en_attente": False,
+            },
+        }, vehicle.id_utilisateur_proprietaire)
+
+    action = "relay_cut_confirmed" if is_cut else "relay_active_confirmed"
+    logger.info(f"✅ {action} for {vehicle.deveui}")
+    return action
+
+
+# ── Steps done once per frame ───────────────────────────────────────────────
+# A relay confirmation and a geofence breach (STOP command, alert) are committed on their own,
+# and the GPS quality gate moves its state to every fix it checks. When a failed micro-batch is
+# processed again frame by frame, their outcome is read back from the frame instead.
+
+def _applied(frame: UplinkFrame) -> Dict[str, Any]:
+    if frame.applied is None:
+        frame.applied = {}
+    return frame.applied
+
+
+async def apply_relay_confirmation(vehicle: VehicleSnapshot, frame: UplinkFrame, db: AsyncSession) -> Optional[str]:
+    """Action of a relay confirmation frame, applied once; None for any other frame."""
+    applied = _applied(frame)
+    if "relay" not in applied:
+        if not is_relay_confirmation(vehicle, frame.relay_status):
+            return None
+        applied["relay"] = await confirm_relay(vehicle, frame.relay_status, db)
+    return applied["relay"]
+
+
+def check_fix_quality(vehicle, frame: UplinkFrame, lat: float, lon: float, timestamp: datetime) -> Optional[str]:
+    """gps_filter.check for the frame's fix, run once."""
+    applied = _applied(frame)
+    if "gps" not in applied:
+        applied["gps"] = gps_filter.check(vehicle.id_vehicule, lat, lon, timestamp, frame.speed, frame.satellites, frame.hdop)
+    return applied["gps"]
+
+
+async def enforce_geofence(vehicle, frame: UplinkFrame, lat: float, lon: float, db: AsyncSession) -> Optional[bool]:
+    """check_and_enforce_geofence for the frame's fix, run once."""
+    applied = _applied(frame)
+    if "zone" not in applied:
+        applied["zone"] = await check_and_enforce_geofence(vehicle, lat, lon, db)
+    return applied["zone"]
+
+
+# ── Inline processing (INGESTION_MODE=sync) ─────────────────────────────────
+
+async def process_uplink(frame: UplinkFrame, db: AsyncSession) -> Dict[str, Any]:
+    """Process a single uplink (envelope read by parse_envelope) inside the caller's request and session."""
+    dev_eui = frame.dev_eui
+    vehicle = await deveui_resolver.resolve(dev_eui, db)
+    if not vehicle:
+        logger.warning(f"Unknown devEui: {dev_eui}")
+        # Return 200 so ChirpStack doesn't retry indefinitely
+        return {"status": "ignored", "reason": f"devEui {dev_eui} not registered"}
+
+    # Only registered devices get an fCnt window: unknown DevEUIs must not grow the map
+    repeated = fcnt_window.check(dev_eui, frame.f_cnt)
+    if repeated:
+        logger.info(f"Ignoring {repeated} frame fCnt={frame.f_cnt} from devEui {dev_eui}")
+        return {"status": "ignored", "reason": f"{repeated} fCnt {frame.f_cnt}"}
+    try:
+        return await _process_uplink(frame, vehicle, db)
+    except Exception:
+        # Not stored: the HTTP integration's retry must get through
+        fcnt_window.release(dev_eui, frame.f_cnt)
+        raise
+
+
+async def _process_uplink(frame: UplinkFrame, vehicle, db: AsyncSession) -> Dict[str, Any]:
+    dev_eui = frame.dev_eui
+    decode_frame(frame)
+    lat, lon, relay_status = frame.latitude, frame.longitude, frame.relay_status
+    logger.info(f"relay_status='{relay_status}' moteur_en_attente={vehicle.moteur_en_attente}")
+
+    action = await apply_relay_confirmation(vehicle, frame, db)
+    if action:
+        return {"status": "ok", "message": action}
+
+    if lat is None or lon is None:
+        logger.warning(f"No GPS or relay_status in uplink for devEui {dev_eui}. Keys found: {frame.keys}")
+        if frame.object_keys:
+            logger.warning(f"Keys in 'object': {frame.object_keys}")
+        return {"status": "ignored", "reason": "No GPS or relay confirmation data"}
+
+    lat, lon = float(lat), float(lon)
+    timestamp = frame.received_at
+
+    # --- GPS quality gate: a bad fix must not reach geofencing (false STOP) ---
+    rejected = check_fix_quality(vehicle, frame, lat, lon, timestamp)
+    if rejected:
+        logger.warning(f"GPS fix rejected ({rejected}) for devEui {dev_eui}: lat={lat} lon={lon}")
+        if not gps_filter.keep_rejected:
+            return {"status": "ignored", "reason": f"GPS fix rejected: {rejected}"}
+        position = Position(**flagged_position_values(vehicle.id_vehicule, frame, lat, lon, timestamp))
+        db.add(position)
+        await db.commit()
+        return {"status": "flagged", "reason": rejected, "id_position": position.id_position}
+
+    if OSRM_ENABLED:
+        lat, lon = await snap_to_road(lat, lon)
+
+    # --- Backend Geofencing ---
+    is_inside = await enforce_geofence(vehicle, frame, lat, lon, db)
+
+    # --- Insert position (or extend the stop it repeats); last status is written behind ---
+    run = None
+    if stationary.enabled:
+        await stationary.load(db, [vehicle.id_vehicule])
+        run = stationary.match(vehicle.id_vehicule, lat, lon, frame.speed, is_inside, timestamp)
+    if run is not None:
+        # The stop in memory is only extended once the UPDATE is committed
+        await db.execute(
+            update(Position)
+            .where(Position.id_position == run.id_position)
+            .values(timestamp_fin=timestamp, nb_repetitions=run.nb_repetitions + 1)
+        )
+    else:
+        values = position_values(vehicle.id_vehicule, frame, lat, lon, timestamp)
+        values["dans_zone"] = is_inside
+        position = Position(**values)
+        db.add(position)
+    await db.commit()
+    if run is not None:
+        run.extend(timestamp)
+    vehicle_state.update(vehicle.id_vehicule, timestamp, lat, lon, fcnt_window.highest(dev_eui))
+    manager.publish_position(vehicle.id_vehicule, live_position(vehicle.id_vehicule, frame, lat, lon, timestamp, is_inside))
+
+    if run is not None:
+        logger.info(f"Stationary fix merged: vehicle={vehicle.id_vehicule} repetitions={run.nb_repetitions}")
+        return {"status": "ok", "id_position": run.id_position, "stationary": True}
+
+    if stationary.enabled:
+        stationary.remember(vehicle.id_vehicule, values, position.id_position)
+    logger.info(
+        f"Position saved: vehicle={vehicle.id_vehicule} "
+        f"lat={lat} lon={lon} speed={frame.speed} km/h"
+    )
+
+    return {"status": "ok", "id_position": position.id_position}
+
+
+# ── Batched processing (INGESTION_MODE=batched) ─────────────────────────────
+
+async def process_uplink_batch(frames: List[UplinkFrame], db: AsyncSession) -> int:
+    """
+    Process a micro-batch of frames (envelopes read by parse_envelope) in arrival order.
+    Vehicles are resolved through the DevEUI cache (misses in one SELECT) and positions are written with one
+    multi-row INSERT in a single commit; vehicule.derniere_* is written behind (services/vehicle_state.py).
+    With stationary compression, repeated fixes extend their stop instead (one bulk UPDATE,
+    or the pending row itself when the stop starts in this batch).
+    Fixes rejected by the GPS quality gate are dropped, or stored flagged with the batch.
+    Relay confirmations and geofence breaches keep their own commit and notifications.
+    Returns the number of positions stored.
+    """
+    vehicles = await deveui_resolver.resolve_many([frame.dev_eui for frame in frames], db)
+    # Duplicates and replays (fCnt window) are dropped before any write; unknown DevEUIs are
+    # left out of the window so they cannot grow it (they are skipped below with a warning)
+    frames = [
+        frame for frame in frames
+        if vehicles.get(deveui_resolver.normalize(frame.dev_eui)) is None
+        or not fcnt_window.check(frame.dev_eui, frame.f_cnt)
+    ]
+    try:
+        return await _process_uplink_batch(frames, vehicles, db)
+    except Exception:
+        # Not stored: reprocessing them (or a redelivery) must not be taken for duplicates
+        for frame in frames:
+            if vehicles.get(deveui_resolver.normalize(frame.dev_eui)) is not None:
+                fcnt_window.release(frame.dev_eui, frame.f_cnt)
+        # The stops in memory hold rows never inserted and extensions never written: reload them
+        stationary.forget(vehicle.id_vehicule for vehicle in vehicles.values() if vehicle)
+        raise
+
+
+async def _process_uplink_batch(frames: List[UplinkFrame], vehicles: Dict[str, Any], db: AsyncSession) -> int:
+    decode_frames(frames)
+    if stationary.enabled:
+        await stationary.load(db, {vehicle.id_vehicule for vehicle in vehicles.values() if vehicle})
+
+    rows: List[Dict[str, Any]] = []
+    row_runs = []  # Parallel to rows with stationary compression: the run each row starts (None: flagged)
+    extended: Dict[int, Any] = {}
+    last_status = []  # (vehicle_id, timestamp, lat, lon, f_cnt), recorded once the batch is committed
+    live = []  # POSITION_UPDATE data, streamed once the batch is committed
+    for frame in frames:
+        vehicle = vehicles.get(deveui_resolver.normalize(frame.dev_eui))
+        if vehicle is None:
+            logger.warning(f"Unknown devEui: {frame.dev_eui}")
+            continue
+
+        if await apply_relay_confirmation(vehicle, frame, db):
+            continue
+        if frame.latitude is None or frame.longitude is None:
+            logger.warning(f"No GPS or relay_status in uplink for devEui {frame.dev_eui}")
+            continue
+
+        lat, lon = float(frame.latitude), float(frame.longitude)
+        timestamp = frame.received_at  # Not the flush time: frames of a batch keep their own
+        rejected = check_fix_quality(vehicle, frame, lat, lon, timestamp)
+        if rejected:
+            logger.warning(f"GPS fix rejected ({rejected}) for devEui {frame.dev_eui}: lat={lat} lon={lon}")
+            if gps_filter.keep_rejected:
+                rows.append(flagged_position_values(vehicle.id_vehicule, frame, lat, lon, timestamp))
+                row_runs.append(None)
+            continue
+        if OSRM_ENABLED:
+            lat, lon = await snap_to_road(lat, lon)
+
+        is_inside = await enforce_geofence(vehicle, frame, lat, lon, db)
+        run = None
+        if stationary.enabled:
+            run = stationary.match(vehicle.id_vehicule, lat, lon, frame.speed, is_inside, timestamp)
+        if run is not None:
+            run.extend(timestamp)
+            if run.row is None:
+                extended[run.id_position] = run
+        else:
+            row = position_values(vehicle.id_vehicule, frame, lat, lon, timestamp)
+            row["dans_zone"] = is_inside
+            rows.append(row)
+            if stationary.enabled:
+                row_runs.append(stationary.remember(vehicle.id_vehicule, row))
+        last_status.append((vehicle.id_vehicule, timestamp, lat, lon, fcnt_window.highest(frame.dev_eui)))
+        live.append(live_position(vehicle.id_vehicule, frame, lat, lon, timestamp, is_inside))
+
+    if rows and stationary.enabled:
+        ids = await db.scalars(insert(Position).returning(Position.id_position, sort_by_parameter_order=True), rows)
+        for run, id_position in zip(row_runs, ids.all()):
+            if run is not None:
+                run.id_position, run.row = id_position, None
+    elif rows:
+        await db.execute(insert(Position), rows)
+    if extended:
+        await db.execute(update(Position), [
+            {"id_position": run.id_position, "timestamp_fin": run.timestamp_fin, "nb_repetitions": run.nb_repetitions}
+            for run in extended.values()
+        ])
+    await db.commit()
+    for status in last_status:
+        vehicle_state.update(*status)
+    for data in live:
+        manager.publish_position(data["vehicle_id"], data)
+    return len(rows)
+
+
+_STOP = object()
+
+
+def lane_of(dev_eui: str, lanes: int) -> int:
+    """Lane of a device. crc32 rather than hash(): stable across restarts and processes."""
+    return zlib.crc32(deveui_resolver.normalize(dev_eui).encode("utf-8")) % lanes
+
+
+class DeviceLocks:
+    """
+    One asyncio.Lock per DevEUI, only while some frame of the device holds or waits for it:
+    the map holds the devices in flight, not every device ever seen.
+    """
+
+    def __init__(self):
+        self._locks: Dict[str, list] = {}  # dev_eui -> [lock, holders and waiters]
+
+    @asynccontextmanager
+    async def hold(self, dev_eui: str):
+        key = deveui_resolver.normalize(dev_eui)
+        entry = self._locks.get(key)
+        if entry is None:
+            entry = self._locks[key] = [asyncio.Lock(), 0]
+        entry[1] += 1
+        try:
+            async with entry[0]:
+                yield
+        finally:
+            entry[1] -= 1
+            if not entry[1]:
+                del self._locks[key]
+
+    def __len__(self) -> int:
+        return len(self._locks)
+
+
+class _Lane:
+    __slots__ = ("index", "queue", "task", "batches", "frames", "dropped", "lag_ms", "max_lag_ms")
+
+    def __init__(self, index: int):
+        self.index = index
+        self.queue: Optional[asyncio.Queue] = None
+        self.task: Optional[asyncio.Task] = None
+        self.batches = 0
+        self.frames = 0
+        self.dropped = 0  # Failed alone too, after their batch failed
+        self.lag_ms = 0.0
+        self.max_lag_ms = 0.0
+
+
+class UplinkBatcher:
+    """
+    In-process queues between the transports and the database, sharded into lanes.
+    A device always maps to the same lane (crc32 of its DevEUI) and each lane has a single
+    consumer, so the frames of one device are processed in arrival order, never two at a
+    time (moteur_en_attente, derniere_*), while the lanes run concurrently.
+    Each consumer drains its queue in micro-batches of `batch_size` frames or `max_wait_ms`
+    milliseconds, whichever comes first. When a batch fails, its frames are processed again
+    one by one, so that one bad frame or a transient error does not lose the whole batch.
+    In sync mode nothing is queued; lock() gives inline processing the same per-device ordering.
+    """
+
+    def __init__(self, batch_size: int, max_wait_ms: int, maxsize: int, lanes: int = 1):
+        self.batch_size = batch_size
+        self.max_wait = max_wait_ms / 1000.0
+        self.maxsize = maxsize
+        self._lanes = [_Lane(i) for i in range(max(lanes, 1))]
+        self._device_locks = DeviceLocks()
+        self._running = False
+        self.rejected = 0
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    def start(self):
+        if self._running:
+            return
+        lane_maxsize = max(self.maxsize // len(self._lanes), 1)
+        for lane in self._lanes:
+            lane.queue = asyncio.Queue(maxsize=lane_maxsize)
+            lane.task = asyncio.create_task(self._consume(lane))
+        self._running = True
+        logger.info(
+            f"Uplink batcher started (lanes={len(self._lanes)}, batch_size={self.batch_size}, "
+            f"max_wait={self.max_wait * 1000:.0f}ms, queue={lane_maxsize} per lane)"
+        )
+
+    async def stop(self):
+        """Flush the frames already queued, then stop the consumers."""
+        if not self._running:
+            return
+        self._running = False
+        for lane in self._lanes:
+            await lane.queue.put(_STOP)
+        await asyncio.gather(*(lane.task for lane in self._lanes))
+        for lane in self._lanes:
+            lane.task = None
+        logger.info("Uplink batcher stopped")
+
+    def _lane(self, dev_eui: str) -> _Lane:
+        return self._lanes[lane_of(dev_eui, len(self._lanes))]
+
+    def lock(self, dev_eui: str):
+        """Lock of the device, held while a frame is processed inline (sync mode): `async with`."""
+        return self._device_locks.hold(dev_eui)
+
+    def submit(self, frame: UplinkFrame) -> bool:
+        """Enqueue a frame without waiting. Returns False when its lane is full."""
+        try:
+            self._lane(frame.dev_eui).queue.put_nowait((frame, time.monotonic(), None))
+            return True
+        except asyncio.QueueFull:
+            self.rejected += 1
+            return False
+
+    async def put(self, frame: UplinkFrame, done: Optional[asyncio.Future] = None):
+        """
+        Enqueue a frame, waiting for room when its lane is full (MQTT transport).
+        `done` is resolved once the batch holding the frame was flushed (stored, or dropped
+        after its own retry), so the caller can acknowledge it only then.
+        """
+        await self._lane(frame.dev_eui).queue.put((frame, time.monotonic(), done))
+
+    def depth(self) -> int:
+        """Frames queued over all lanes."""
+        return sum(lane.queue.qsize() for lane in self._lanes if lane.queue is not None)
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "queue_depth": self.depth(),
+            "batches": sum(lane.batches for lane in self._lanes),
+            "frames": sum(lane.frames for lane in self._lanes),
+            "dropped": sum(lane.dropped for lane in self._lanes),
+            "rejected": self.rejected,
+            "inline_devices": len(self._device_locks),
+            "lanes": [
+                {
+                    "lane": lane.index,
+                    "queue_depth": lane.queue.qsize() if lane.queue is not None else 0,
+                    "batches": lane.batches,
+                    "frames": lane.frames,
+                    "dropped": lane.dropped,
+                    # Time the oldest frame of the last batch waited in the queue
+                    "lag_ms": round(lane.lag_ms, 1),
+                    "max_lag_ms": round(lane.max_lag_ms, 1),
+                }
+                for lane in self._lanes
+            ],
+        }
+
+    async def _consume(self, lane: _Lane):
+        loop = asyncio.get_running_loop()
+        stopping = False
+        while not stopping:
+            item = await lane.queue.get()
+            if item is _STOP:
+                break
+            batch = [item]
+            deadline = loop.time() + self.max_wait
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    item = await asyncio.wait_for(lane.queue.get(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                if item is _STOP:
+                    stopping = True
+                    break
+                batch.append(item)
+            await self._flush(lane, batch)
+
+    async def _flush(self, lane: _Lane, batch: List[tuple]):
+        lane.lag_ms = (time.monotonic() - batch[0][1]) * 1000
+        lane.max_lag_ms = max(lane.max_lag_ms, lane.lag_ms)
+        frames = [frame for frame, _, _ in batch]
+        try:
+            async with SessionLocal() as db:
+                stored = await process_uplink_batch(frames, db)
+            lane.batches += 1
+            lane.frames += len(frames)
+            logger.info(f"Uplink batch flushed (lane {lane.index}): {len(frames)} frame(s), {stored} position(s) stored")
+        except Exception as e:
+            logger.error(f"Uplink batch of {len(frames)} frame(s) failed (lane {lane.index}): {e}; processing them one by one")
+            await self._process_each(lane, frames)
+        finally:
+            for _, _, done in batch:
+                if done is not None and not done.done():
+                    done.set_result(None)
+
+    async def _process_each(self, lane: _Lane, frames: List[UplinkFrame]):
+        for frame in frames:
+            try:
+                async with SessionLocal() as db:
+                    await process_uplink(frame, db)
+                lane.frames += 1
+            except Exception as e:
+                lane.dropped += 1
+                logger.error(f"Uplink dropped (lane {lane.index}): devEui {frame.dev_eui} fCnt={frame.f_cnt}: {e}")
+
+
+uplink_batcher = UplinkBatcher(
+    batch_size=settings.INGESTION_BATCH_SIZE,
+    max_wait_ms=settings.INGESTION_BATCH_MAX_WAIT_MS,
+    maxsize=settings.INGESTION_QUEUE_MAXSIZE,
+    lanes=settings.INGESTION_LANES,
+)
@@ -0,0 +1,238 @@
+"""
+MQTT ingestion transport (MQTT_ENABLED=true).
+Consumes ChirpStack's application integration on the broker instead of receiving one
+HTTP request per frame. Uplinks go through the same path as the webhook: parse_envelope,
+then the batcher (INGESTION_MODE=batched) or process_uplink in a session of their own.
+
+Topics (ChirpStack application server v3, QoS 1):
+    application/+/device/+/rx     — uplink
+    application/+/device/+/ack    — confirmed downlink acknowledged (or not) by the device
+    application/+/device/+/txack  — downlink transmitted by the gateway
+
+Delivery: the session is persistent (clean_session=False, fixed client id) and QoS-1
+messages are acknowledged once handled rather than on receipt, so frames queued while the
+backend is down, or received but not handled yet, are delivered again by the broker.
+In batched mode an uplink counts as handled once the batch holding it was flushed, not
+when it is queued.
+Backpressure: at most MQTT_MAX_INFLIGHT messages are handled at once (a semaphore); beyond
+that, the consumer stops reading the client's incoming queue. Since messages are only
+acknowledged once handled, the broker's per-client window of unacknowledged QoS-1 messages
+(mosquitto: max_inflight_messages) fills up and the broker holds the rest. Keep
+MQTT_MAX_QUEUED_MESSAGES above that window: aiomqtt discards messages beyond its queue.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Optional, Set
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.services.command_service import confirm_transmitted_commands
+from app.services.deveui_resolver import deveui_resolver
+from app.services.ingestion import process_uplink, uplink_batcher
+from app.services.uplink_schema import parse_envelope
+
+logger = logging.getLogger(__name__)
+
+QOS = 1
+UPLINK_EVENTS = ("rx",)
+DOWNLINK_EVENTS = ("ack", "txack")
+SUBSCRIPTIONS = tuple(f"application/+/device/+/{event}" for event in UPLINK_EVENTS + DOWNLINK_EVENTS)
+
+
+def event_type(topic: str) -> str:
+    """Event of an application topic: its last level (rx, ack, txack…)."""
+    return topic.rsplit("/", 1)[-1]
+
+
+# ── Manual PUBACK ───────────────────────────────────────────────────────────
+# aiomqtt has no public API for manual acknowledgement: these two helpers are the only code
+# reaching its private paho client (Client._client). Checked against the version pinned in
+# requirements.txt; re-check them before moving the pin.
+AIOMQTT_CHECKED_VERSION = "2.5.1"
+
+
+def enable_manual_ack(client, aiomqtt):
+    """Make paho wait for ack_message() instead of acknowledging QoS-1 messages on receipt."""
+    paho = getattr(client, "_client", None)
+    if paho is None or not hasattr(paho, "manual_ack_set") or not hasattr(paho, "ack"):
+        raise RuntimeError(f"aiomqtt {aiomqtt.__version__}: manual acknowledgement not available")
+    if aiomqtt.__version__ != AIOMQTT_CHECKED_VERSION:
+        logger.warning(f"[MQTT] Manual ack checked with aiomqtt {AIOMQTT_CHECKED_VERSION}, running {aiomqtt.__version__}")
+    paho.manual_ack_set(True)
+
+
+def ack_message(client, message):
+    """Send the PUBACK of a message received with manual acknowledgement enabled."""
+    if message.qos > 0:
+        client._client.ack(message.mid, message.qos)
+
+
+class MqttConsumer:
+    """Background MQTT subscriber, reconnecting until stopped."""
+
+    def __init__(
+        self,
+        host: str,
+        port: int,
+        client_id: str,
+        max_inflight: int,
+        max_queued: int,
+        reconnect_interval: float,
+        username: Optional[str] = None,
+        password: Optional[str] = None,
+    ):
+        self.host = host
+        self.port = port
+        self.client_id = client_id
+        self.max_inflight = max_inflight
+        self.max_queued = max_queued
+        self.reconnect_interval = reconnect_interval
+        self.username = username
+        self.password = password
+        self._task: Optional[asyncio.Task] = None
+        self._slots: Optional[asyncio.Semaphore] = None
+        self._handlers: Set[asyncio.Task] = set()
+        self.connected = False
+        self.received = 0
+        self.uplinks = 0
+        self.downlink_events = 0
+        self.failed = 0
+        self.reconnects = 0
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None
+
+    def start(self):
+        if self._task is None:
+            self._slots = asyncio.Semaphore(self.max_inflight)
+            self._task = asyncio.create_task(self._run())
+            logger.info(
+                f"MQTT consumer started ({self.host}:{self.port}, client_id={self.client_id}, "
+                f"max_inflight={self.max_inflight})"
+            )
+
+    async def stop(self):
+        """Stop reading; the messages being handled finish and are acknowledged first."""
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+        logger.info("MQTT consumer stopped")
+
+    def stats(self) -> dict:
+        return {
+            "running": self.running,
+            "connected": self.connected,
+            "inflight": len(self._handlers),
+            "received": self.received,
+            "uplinks": self.uplinks,
+            "downlink_events": self.downlink_events,
+            "failed": self.failed,
+            "reconnects": self.reconnects,
+        }
+
+    async def _run(self):
+        import aiomqtt  # Only needed when the MQTT transport is enabled
+
+        while True:
+            try:
+                await self._session(aiomqtt)
+            except aiomqtt.MqttError as e:
+                logger.warning(f"[MQTT] Connection to {self.host}:{self.port} lost: {e}")
+            self.connected = False
+            await asyncio.sleep(self.reconnect_interval)
+            self.reconnects += 1
+
+    async def _session(self, aiomqtt):
+        client = aiomqtt.Client(
+            self.host,
+            self.port,
+            username=self.username,
+            password=self.password,
+            identifier=self.client_id,
+            clean_session=False,
+            max_queued_incoming_messages=self.max_queued,
+        )
+        # PUBACK once the message is handled, not when paho receives it
+        enable_manual_ack(client, aiomqtt)
+        async with client:
+            self.connected = True
+            await client.subscribe([(topic, QOS) for topic in SUBSCRIPTIONS])
+            logger.info(f"[MQTT] Subscribed to {', '.join(SUBSCRIPTIONS)}")
+            try:
+                async for message in client.messages:
+                    self.received += 1
+                    await self._slots.acquire()
+                    task = asyncio.create_task(self._handle(client, message))
+                    self._handlers.add(task)
+                    task.add_done_callback(self._handlers.discard)
+            finally:
+                # Acknowledge what is being handled before disconnecting
+                if self._handlers:
+                    await asyncio.gather(*self._handlers, return_exceptions=True)
+
+    async def _handle(self, client, message):
+        topic = message.topic.value
+        try:
+            payload = json.loads(message.payload)
+            event = event_type(topic)
+            if event in UPLINK_EVENTS:
+                await self._on_uplink(payload)
+            elif event in DOWNLINK_EVENTS:
+                await self._on_downlink_event(event, payload)
+        except Exception as e:
+            # Acknowledged anyway: the broker would redeliver a malformed frame forever
+            self.failed += 1
+            logger.error(f"[MQTT] Failed to handle message on {topic}: {e}")
+        finally:
+            ack_message(client, message)
+            self._slots.release()
+
+    async def _on_uplink(self, payload: dict):
+        frame = parse_envelope(payload)
+        if not frame.dev_eui:
+            logger.error(f"[MQTT] Failed to find devEui in uplink keys: {frame.keys}")
+            return
+        self.uplinks += 1
+        if uplink_batcher.running:
+            # Waits while the queue is full, then until the batch is flushed: the message
+            # stays unacknowledged meanwhile
+            flushed = asyncio.get_running_loop().create_future()
+            await uplink_batcher.put(frame, flushed)
+            await flushed
+            return
+        async with uplink_batcher.lock(frame.dev_eui), SessionLocal() as db:
+            await process_uplink(frame, db)
+
+    async def _on_downlink_event(self, event: str, payload: dict):
+        dev_eui = parse_envelope(payload).dev_eui
+        if not dev_eui:
+            return
+        self.downlink_events += 1
+        if event == "ack" and payload.get("acknowledged") is False:
+            logger.warning(f"[MQTT] Downlink not acknowledged by {dev_eui}")
+            return
+        async with SessionLocal() as db:
+            vehicle = await deveui_resolver.resolve(dev_eui, db)
+            if vehicle is None:
+                return
+            confirmed = await confirm_transmitted_commands(db, vehicle.id_vehicule)
+            await db.commit()
+        if confirmed:
+            logger.info(f"[MQTT] {event}: {confirmed} mode command(s) confirmed for {dev_eui}")
+
+
+mqtt_consumer = MqttConsumer(
+    host=settings.MQTT_HOST,
+    port=settings.MQTT_PORT,
+    client_id=settings.MQTT_CLIENT_ID,
+    max_inflight=settings.MQTT_MAX_INFLIGHT,
+    max_queued=settings.MQTT_MAX_QUEUED_MESSAGES,
+    reconnect_interval=settings.MQTT_RECONNECT_SECONDS,
+    username=settings.MQTT_USERNAME,
+    password=settings.MQTT_PASSWORD,
+)
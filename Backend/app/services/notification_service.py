@@ -1,37 +1,596 @@
-from fastapi import WebSocket
-from typing import List, Dict
+"""
+WebSocket fan-out to the users' sockets (/ws/{token}).
+send_personal_message() never waits on a client: the message is serialized once and the
+same text is appended to the outbound queue of each of the user's sockets, drained by a
+writer task per socket. A slow phone therefore delays only itself, never the uplink or
+alert handler that produced the message.
+Each queue is bounded (WS_QUEUE_SIZE):
+  - state messages (COALESCED_TYPES) supersede the one still queued for the same vehicle
+    (the newer one takes the end of the queue), so a client that falls behind receives the
+    latest state rather than the backlog
+  - any other message (alerts) overflowing the queue closes the socket (1013): the client
+    reconnects and reloads, instead of silently missing an alert
+A send that fails or takes longer than WS_SEND_TIMEOUT_SECONDS drops the socket as well.
+
+Messages go through the pub/sub bus (services/pubsub.py) so that they reach the user's
+sockets in every worker: the event is a one-line JSON route ({"user": …, "key": …}), a
+newline, then the serialized message, which each worker queues as is.
+
+The messages of a user get a sequence number ("seq") and the last WS_REPLAY_BUFFER_SIZE of
+them are kept, so that a phone losing its socket for a moment only gets what it missed:
+    ← {"type": "STREAM", "data": {"epoch": "3f9c…", "seq": 1718000000000123}}  (on connect)
+    ← {"seq": 1718000000000124, "type": "NEW_ALERT", "data": {…}}
+    /ws/{token}?last_seq=1718000000000124&epoch=3f9c…  →  STREAM, then the messages after last_seq
+When they cannot be replayed (other worker or restarted: epoch differs; evicted from the
+buffer; too many for the queue), the client gets RESYNC_REQUIRED (same data as STREAM) and
+reloads through the REST API, then resumes from that seq. Numbers are given by the worker
+holding the socket and start at the time the user's buffer was created, in microseconds, so
+that they keep increasing when an evicted buffer is created again.
+Subscriptions, their events (positions, other users' vehicles) and replies carry no seq:
+the client subscribes again after reconnecting.
+
+Live positions (POSITION_UPDATE) are only sent to the sockets subscribed to the vehicle, by id,
+by fleet or by map viewport; so is its VEHICLE_UPDATE, besides the owner's own sockets:
+    → {"type": "SUBSCRIBE", "vehicles": [3, 7], "max_rate": 2}
+    → {"type": "SUBSCRIBE", "fleet": true}
+    → {"type": "SUBSCRIBE", "bbox": [min_lon, min_lat, max_lon, max_lat]}  (replaces the previous viewport)
+    → {"type": "UNSUBSCRIBE", "vehicles": [7], "fleet": true, "bbox": true}
+    ← {"type": "SUBSCRIBED", "data": {"vehicles": [3], "denied": [], "fleet": true, "bbox": null, "max_rate": 2.0}}
+A user may subscribe to their own vehicles, and their fleet and viewports only match those
+(ADMIN: any vehicle). Owners are checked against the OwnerCache: read from the vehicule table
+at startup and every VEHICLE_STATE_RECONCILE_SECONDS, and told of each owner change by the
+worker that made it through the bus (publish_owner), so that no worker lets a former owner
+follow a vehicle. Vehicle events carry the vehicle, its owner and last position in their
+route, and viewports are indexed by a spatial grid (services/spatial_grid.py): finding the
+sockets of an event reads one grid cell, whatever the number of open maps.
+Every WS_POSITION_TICK_SECONDS the latest fix of each vehicle is published, and each socket
+gets the latest fix of its vehicles at most `max_rate` times per second (capped by
+WS_POSITION_MAX_RATE): intermediate fixes are coalesced, never queued.
+"""
+
+import asyncio
 import json
 import logging
+import time
+import uuid
+from collections import OrderedDict, deque
+from typing import Dict, List, Optional, Set, Tuple
+
+from fastapi import WebSocket
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.vehicle import Vehicle
+from app.services.pubsub import create_pubsub
+from app.services.spatial_grid import BBox, SpatialGrid, parse_bbox
+from app.services.vehicle_state import vehicle_state
 
 logger = logging.getLogger(__name__)
 
-class ConnectionManager:
+# Messages carrying the whole state of a vehicle: only the latest one per vehicle matters
+COALESCED_TYPES = frozenset({"VEHICLE_UPDATE", "POSITION_UPDATE"})
+
+CLOSE_TRY_AGAIN_LATER = 1013
+
+
+def serialize(message: dict) -> str:
+    """Same encoding as WebSocket.send_json."""
+    return json.dumps(message, separators=(",", ":"), ensure_ascii=False)
+
+
+def coalesce_key(message: dict) -> Optional[Tuple[str, int]]:
+    if message.get("type") in COALESCED_TYPES:
+        vehicle_id = (message.get("data") or {}).get("vehicle_id")
+        if vehicle_id is not None:
+            return message["type"], vehicle_id
+    return None
+
+
+class Connection:
+    """One socket, its bounded outbound queue and writer task, and its position subscriptions."""
+    __slots__ = (
+        "websocket",
+        "user_id",
+        "is_admin",
+        "queue",
+        "dead",
+        "pending",
+        "wakeup",
+        "task",
+        "closed",
+        "vehicles",
+        "fleet",
+        "bbox",
+        "positions",
+        "interval",
+        "next_flush",
+    )
+
+    def __init__(self, websocket: WebSocket, user_id: int, is_admin: bool = False):
+        self.websocket = websocket
+        self.user_id = user_id
+        self.is_admin = is_admin
+        # Items: text, or [text, key] for a coalescable message (text replaced in place)
+        self.queue: deque = deque()
+        self.dead = 0  # Superseded entries (text None) still in the queue
+        self.pending: Dict[Tuple[str, int], list] = {}
+        self.wakeup = asyncio.Event()
+        self.task: Optional[asyncio.Task] = None
+        self.closed = False
+        self.vehicles: Set[int] = set()  # Subscribed to their positions
+        self.fleet = False
+        self.bbox: Optional[BBox] = None  # Map viewport
+        self.positions: Dict[int, str] = {}  # vehicle_id -> latest POSITION_UPDATE not sent yet
+        self.interval = 1.0  # Seconds between two position flushes (1 / max_rate)
+        self.next_flush = 0.0  # monotonic
+
+    def may_follow(self, owner: Optional[int]) -> bool:
+        """Whether this socket may follow a vehicle of `owner` (None: unowned or unknown)."""
+        return self.is_admin or (owner is not None and owner == self.user_id)
+
+
+class OwnerCache:
+    """Owner of every vehicle, as in the vehicule table, for subscription checks and routes."""
+
     def __init__(self):
-        # Map user_id to list of active websockets
-        self.active_connections: Dict[int, List[WebSocket]] = {}
+        self._owners: Dict[int, Optional[int]] = {}
+        self._changed: Set[int] = set()  # Set since the last load started: newer than its read
+        self.loads = 0
+
+    def get(self, vehicle_id: int) -> Optional[int]:
+        return self._owners.get(vehicle_id)
+
+    def set(self, vehicle_id: int, owner: Optional[int]):
+        self._owners[vehicle_id] = owner
+        self._changed.add(vehicle_id)
+
+    async def load(self):
+        """Read every vehicle's owner; owner changes received meanwhile from the bus are kept."""
+        self._changed = set()
+        async with SessionLocal() as db:
+            result = await db.execute(select(Vehicle.id_vehicule, Vehicle.id_utilisateur_proprietaire))
+            owners = dict(result.all())
+        for vehicle_id in self._changed:
+            owners[vehicle_id] = self._owners.get(vehicle_id)
+        self._owners = owners
+        self.loads += 1
+
+
+class UserStream:
+    """Numbered recent messages of a user, replayed to a socket resuming after a disconnection."""
+    __slots__ = ("seq", "events")
+
+    def __init__(self, size: int):
+        # Above any seq this process gave the user before (buffer evicted meanwhile)
+        self.seq = time.time_ns() // 1000
+        self.events: deque = deque(maxlen=size)  # (seq, text, key), seqs contiguous
+
+    def since(self, last_seq: int) -> Optional[list]:
+        """Messages after last_seq; None when some of them are no longer buffered (or unknown seq)."""
+        if last_seq > self.seq or last_seq < self.seq - len(self.events):
+            return None
+        return [event for event in self.events if event[0] > last_seq]
+
+
+class ConnectionManager:
 
-    async def connect(self, websocket: WebSocket, user_id: int):
+    def __init__(
+        self,
+        queue_size: int,
+        send_timeout: float,
+        bus,
+        position_tick: float = 0.25,
+        position_default_rate: float = 1.0,
+        position_max_rate: float = 4.0,
+        max_subscriptions: int = 1000,
+        grid_cell_degrees: float = 0.5,
+        grid_max_cells: int = 4096,
+        replay_size: int = 200,
+        replay_max_users: int = 10000,
+    ):
+        self.queue_size = queue_size
+        self.send_timeout = send_timeout
+        self.bus = bus
+        bus.subscribe(self.deliver)
+        self.position_tick = position_tick
+        self.position_default_rate = position_default_rate
+        self.position_max_rate = position_max_rate
+        self.max_subscriptions = max_subscriptions
+        self.replay_size = replay_size
+        self.replay_max_users = replay_max_users
+        self.epoch = uuid.uuid4().hex[:12]  # This process' numbering of the user streams
+        self._streams: "OrderedDict[int, UserStream]" = OrderedDict()  # Least recently used first
+        # Map user_id to list of active connections
+        self.active_connections: Dict[int, List[Connection]] = {}
+        self._followers: Dict[int, Set[Connection]] = {}  # vehicle_id -> subscribed connections
+        self._fleet: Dict[Optional[int], Set[Connection]] = {}  # owner (None: ADMIN, every vehicle) -> connections
+        self._grid = SpatialGrid(grid_cell_degrees, grid_max_cells)  # Connections by viewport
+        self._outgoing: Dict[int, dict] = {}  # vehicle_id -> latest fix stored by this worker
+        self._due: Set[Connection] = set()  # Connections holding unsent positions
+        self._ticker: Optional[asyncio.Task] = None
+        self._closing: Set[asyncio.Task] = set()
+        self.owners = OwnerCache()
+        self.messages = 0
+        self.sent = 0
+        self.coalesced = 0
+        self.overflows = 0
+        self.failed = 0
+        self.positions_published = 0
+        self.positions_coalesced = 0
+        self.replayed = 0
+        self.resyncs = 0
+
+    async def start(self):
+        await self.bus.start()
+        if self._ticker is None:
+            self._ticker = asyncio.create_task(self._tick())
+
+    async def stop(self):
+        if self._ticker is not None:
+            self._ticker.cancel()
+            await asyncio.gather(self._ticker, return_exceptions=True)
+            self._ticker = None
+        await self.bus.stop()
+
+    async def connect(
+        self,
+        websocket: WebSocket,
+        user_id: int,
+        is_admin: bool = False,
+        last_seq: Optional[int] = None,
+        epoch: Optional[str] = None,
+    ) -> Connection:
+        """Register a socket; when resuming (last_seq), queue the messages it missed or RESYNC_REQUIRED."""
         await websocket.accept()
-        if user_id not in self.active_connections:
-            self.active_connections[user_id] = []
-        self.active_connections[user_id].append(websocket)
+        connection = Connection(websocket, user_id, is_admin)
+        connection.interval = 1.0 / self.position_default_rate
+        connection.task = asyncio.create_task(self._write(connection))
+        self.active_connections.setdefault(user_id, []).append(connection)
         logger.info(f"User {user_id} connected via WebSocket. Total connections for user: {len(self.active_connections[user_id])}")
 
+        # No await from here: nothing can be delivered between the replay and the live messages
+        stream = self._stream(user_id)
+        missed = None
+        if last_seq is not None and epoch == self.epoch:
+            missed = stream.since(last_seq)
+            if missed is not None and len(missed) >= self.queue_size:
+                missed = None
+        status = {"epoch": self.epoch, "seq": stream.seq}
+        if last_seq is not None and missed is None:
+            self.resyncs += 1
+            logger.info(f"User {user_id} cannot resume from seq {last_seq}: resync")
+            self._reply(connection, {"type": "RESYNC_REQUIRED", "data": status})
+        else:
+            self._reply(connection, {"type": "STREAM", "data": status})
+            for _, text, key in missed or ():
+                self._enqueue(connection, text, key)
+                self.replayed += 1
+        return connection
+
     def disconnect(self, websocket: WebSocket, user_id: int):
-        if user_id in self.active_connections:
-            if websocket in self.active_connections[user_id]:
-                self.active_connections[user_id].remove(websocket)
-            if not self.active_connections[user_id]:
-                del self.active_connections[user_id]
+        for connection in self.active_connections.get(user_id, ()):
+            if connection.websocket is websocket:
+                self._drop(connection)
+                break
         logger.info(f"User {user_id} disconnected via WebSocket")
 
     async def send_personal_message(self, message: dict, user_id: int):
-        if user_id in self.active_connections:
-            for connection in self.active_connections[user_id]:
+        """Publish a message for every socket of a user, whichever worker holds them; never waits."""
+        self.messages += 1
+        key = coalesce_key(message)
+        route = {"user": user_id, "key": key}
+        if key is not None:  # Vehicle state: also for the sockets following the vehicle
+            route.update(self._vehicle_route(key[1]))
+        self.bus.publish(f"{serialize(route)}\n{serialize(message)}")
+
+    def publish_owner(self, vehicle_id: int, owner: Optional[int]):
+        """Tell every worker the new owner of a vehicle (None: released or deleted), after the commit."""
+        self.bus.publish(f"{serialize({'vehicle': vehicle_id, 'owner': owner, 'owner_change': True})}\n")
+
+    def publish_position(self, vehicle_id: int, data: dict):
+        """Stream a stored fix to the vehicle's subscribers (published at the next tick, latest only)."""
+        if vehicle_id in self._outgoing:
+            self.positions_coalesced += 1
+        self._outgoing[vehicle_id] = data
+
+    def _vehicle_route(self, vehicle_id: int, lat: Optional[float] = None, lon: Optional[float] = None) -> dict:
+        """Route of a vehicle event: owner from the OwnerCache, last position (viewports) from the store."""
+        if lat is None:
+            state = vehicle_state.get(vehicle_id)
+            if state is not None:
+                lat, lon = state.derniere_position_lat, state.derniere_position_lon
+        return {"vehicle": vehicle_id, "owner": self.owners.get(vehicle_id), "lat": lat, "lon": lon}
+
+    def deliver(self, event: str):
+        """Queue an event received from the bus for the sockets of this worker."""
+        route, _, text = event.partition("\n")
+        route = json.loads(route)
+        if route.get("owner_change"):
+            self.owners.set(route["vehicle"], route["owner"])
+            return
+        user_id = route.get("user")
+        if user_id is None:
+            self._deliver_position(route, text)
+            return
+        key = tuple(route["key"]) if route["key"] else None
+        stream = self._stream(user_id)
+        stream.seq += 1
+        sequenced = f'{{"seq":{stream.seq},{text[1:]}'
+        stream.events.append((stream.seq, sequenced, key))
+        for connection in list(self.active_connections.get(user_id, ())):
+            self._enqueue(connection, sequenced, key)
+        if "vehicle" in route:  # Not part of the subscribers' own stream
+            for connection in self._subscribers(route):
+                if connection.user_id != user_id:
+                    self._enqueue(connection, text, key)
+
+    def _stream(self, user_id: int) -> UserStream:
+        stream = self._streams.get(user_id)
+        if stream is None:
+            stream = self._streams[user_id] = UserStream(self.replay_size)
+            while len(self._streams) > self.replay_max_users:
+                self._streams.popitem(last=False)
+        else:
+            self._streams.move_to_end(user_id)
+        return stream
+
+    def _subscribers(self, route: dict) -> List[Connection]:
+        """Connections following the vehicle of a route: by id, fleet or viewport, and allowed to see it."""
+        owner = route["owner"]
+        found = set(self._fleet.get(None, ()))
+        found.update(self._followers.get(route["vehicle"], ()))
+        if owner is not None:
+            found.update(self._fleet.get(owner, ()))
+        if route["lat"] is not None and route["lon"] is not None:
+            found.update(self._grid.query(route["lat"], route["lon"]))
+        # Ownership may have changed since SUBSCRIBE
+        return [connection for connection in found if connection.is_admin or connection.user_id == owner]
+
+    def _deliver_position(self, route: dict, text: str):
+        vehicle_id = route["vehicle"]
+        for connection in self._subscribers(route):
+            if vehicle_id in connection.positions:
+                self.positions_coalesced += 1
+            connection.positions[vehicle_id] = text
+            self._due.add(connection)
+
+    # ── Client messages ────────────────────────────────────────────────────
+
+    def handle_client_message(self, connection: Connection, text: str):
+        """Apply a message sent by the client (subscriptions); answers on the same socket."""
+        try:
+            message = json.loads(text)
+            kind = message.get("type")
+            if kind == "SUBSCRIBE":
+                self._subscribe(connection, message)
+            elif kind == "UNSUBSCRIBE":
+                self._unsubscribe(connection, message)
+            else:
+                raise ValueError(f"type de message inconnu : {kind}")
+        except (ValueError, TypeError, AttributeError) as e:
+            self._reply(connection, {"type": "ERROR", "data": {"message": f"Message invalide : {e}"}})
+
+    def _subscribe(self, connection: Connection, message: dict):
+        bbox = parse_bbox(message["bbox"]) if message.get("bbox") is not None else None
+        max_rate = message.get("max_rate")
+        if max_rate is not None:
+            max_rate = float(max_rate)
+            if max_rate <= 0:
+                raise ValueError("max_rate doit être positif")
+            connection.interval = 1.0 / min(max_rate, self.position_max_rate)
+        denied = []
+        for vehicle_id in map(int, message.get("vehicles") or ()):
+            if vehicle_id in connection.vehicles:
+                continue
+            if len(connection.vehicles) >= self.max_subscriptions or not connection.may_follow(self.owners.get(vehicle_id)):
+                denied.append(vehicle_id)
+                continue
+            connection.vehicles.add(vehicle_id)
+            self._followers.setdefault(vehicle_id, set()).add(connection)
+        if message.get("fleet") and not connection.fleet:
+            connection.fleet = True
+            self._fleet.setdefault(self._fleet_owner(connection), set()).add(connection)
+        if bbox is not None:
+            connection.bbox = bbox
+            self._grid.insert(connection, bbox)
+        self._acknowledge(connection, denied)
+
+    def _unsubscribe(self, connection: Connection, message: dict):
+        for vehicle_id in map(int, message.get("vehicles") or ()):
+            self._unfollow(connection, vehicle_id)
+        if message.get("fleet"):
+            self._leave_fleet(connection)
+        if message.get("bbox"):
+            connection.bbox = None
+            self._grid.remove(connection)
+        self._acknowledge(connection, [])
+
+    @staticmethod
+    def _fleet_owner(connection: Connection) -> Optional[int]:
+        return None if connection.is_admin else connection.user_id
+
+    def _leave_fleet(self, connection: Connection):
+        if not connection.fleet:
+            return
+        connection.fleet = False
+        owner = self._fleet_owner(connection)
+        members = self._fleet.get(owner)
+        if members is not None:
+            members.discard(connection)
+            if not members:
+                del self._fleet[owner]
+
+    def _unfollow(self, connection: Connection, vehicle_id: int):
+        connection.vehicles.discard(vehicle_id)
+        connection.positions.pop(vehicle_id, None)
+        followers = self._followers.get(vehicle_id)
+        if followers is not None:
+            followers.discard(connection)
+            if not followers:
+                del self._followers[vehicle_id]
+
+    def _acknowledge(self, connection: Connection, denied: List[int]):
+        self._reply(connection, {"type": "SUBSCRIBED", "data": {
+            "vehicles": sorted(connection.vehicles),
+            "denied": denied,
+            "fleet": connection.fleet,
+            "bbox": list(connection.bbox) if connection.bbox is not None else None,
+            "max_rate": round(1.0 / connection.interval, 3),
+        }})
+
+    def _reply(self, connection: Connection, message: dict):
+        self._enqueue(connection, serialize(message), None)
+
+    # ── Position ticks ─────────────────────────────────────────────────────
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(self.position_tick)
+            try:
+                self._publish_positions()
+                self._flush_positions(time.monotonic())
+            except Exception as e:
+                logger.error(f"[WS] Position tick failed: {e}")
+
+    def _publish_positions(self):
+        outgoing, self._outgoing = self._outgoing, {}
+        for vehicle_id, data in outgoing.items():
+            self.positions_published += 1
+            route = self._vehicle_route(vehicle_id, data.get("latitude"), data.get("longitude"))
+            self.bus.publish(f'{serialize(route)}\n{serialize({"type": "POSITION_UPDATE", "data": data})}')
+
+    def _flush_positions(self, now: float):
+        """Move the pending positions of the connections whose rate allows it to their queue."""
+        for connection in list(self._due):
+            if connection.next_flush > now:
+                continue
+            self._due.discard(connection)
+            positions, connection.positions = connection.positions, {}
+            for vehicle_id, text in positions.items():
+                self._enqueue(connection, text, ("POSITION_UPDATE", vehicle_id))
+                if connection.closed:
+                    break
+            connection.next_flush = now + connection.interval
+
+    # ── Outbound queues ────────────────────────────────────────────────────
+
+    def _enqueue(self, connection: Connection, text: str, key: Optional[Tuple[str, int]]):
+        if key is not None:
+            entry = connection.pending.get(key)
+            if entry is not None:
+                # Superseded where it stands; the newer state is appended so that seqs stay in order
+                entry[0] = None
+                connection.dead += 1
+                self.coalesced += 1
+                if connection.dead > self.queue_size:
+                    connection.queue = deque(item for item in connection.queue if not (isinstance(item, list) and item[0] is None))
+                    connection.dead = 0
+        if len(connection.queue) - connection.dead >= self.queue_size:
+            self.overflows += 1
+            logger.warning(f"WebSocket queue full for user {connection.user_id} ({self.queue_size} messages): closing")
+            self._drop(connection, CLOSE_TRY_AGAIN_LATER)
+            return
+        if key is not None:
+            entry = connection.pending[key] = [text, key]
+            connection.queue.append(entry)
+        else:
+            connection.queue.append(text)
+        connection.wakeup.set()
+
+    async def _write(self, connection: Connection):
+        while True:
+            await connection.wakeup.wait()
+            connection.wakeup.clear()
+            while connection.queue:  # Not kept aside: _enqueue may compact it
+                item = connection.queue.popleft()
+                if isinstance(item, list):
+                    text, key = item
+                    if text is None:
+                        connection.dead -= 1
+                        continue
+                    del connection.pending[key]
+                else:
+                    text = item
                 try:
-                    await connection.send_json(message)
+                    await asyncio.wait_for(connection.websocket.send_text(text), self.send_timeout)
+                except asyncio.TimeoutError:
+                    self.failed += 1
+                    logger.warning(f"WebSocket send to user {connection.user_id} timed out after {self.send_timeout}s: closing")
+                    self._drop(connection, CLOSE_TRY_AGAIN_LATER)
+                    return
                 except Exception as e:
-                    logger.error(f"Error sending message to user {user_id}: {e}")
-                    # Cleanup dead connections if needed, but disconnect handles removal usually
+                    self.failed += 1
+                    logger.warning(f"WebSocket send to user {connection.user_id} failed: {e!r}")
+                    self._drop(connection)
+                    return
+                self.sent += 1
+
+    def _drop(self, connection: Connection, close_code: Optional[int] = None):
+        """Forget a connection and stop its writer; close the socket from our side if asked."""
+        if connection.closed:
+            return
+        connection.closed = True
+        connections = self.active_connections.get(connection.user_id)
+        if connections is not None and connection in connections:
+            connections.remove(connection)
+            if not connections:
+                del self.active_connections[connection.user_id]
+        for vehicle_id in list(connection.vehicles):
+            self._unfollow(connection, vehicle_id)
+        self._leave_fleet(connection)
+        self._grid.remove(connection)
+        self._due.discard(connection)
+        connection.queue.clear()
+        connection.dead = 0
+        connection.pending.clear()
+        if connection.task is not None and connection.task is not asyncio.current_task():
+            connection.task.cancel()
+        if close_code is not None:
+            task = asyncio.create_task(self._close(connection.websocket, close_code))
+            self._closing.add(task)
+            task.add_done_callback(self._closing.discard)
+
+    @staticmethod
+    async def _close(websocket: WebSocket, code: int):
+        try:
+            await websocket.close(code=code)
+        except Exception:
+            pass  # Already gone
+
+    def stats(self) -> dict:
+        return {
+            "users": len(self.active_connections),
+            "connections": sum(len(c) for c in self.active_connections.values()),
+            "queued": sum(len(c.queue) - c.dead for cs in self.active_connections.values() for c in cs),
+            "messages": self.messages,
+            "sent": self.sent,
+            "coalesced": self.coalesced,
+            "overflows": self.overflows,
+            "failed": self.failed,
+            "followed_vehicles": len(self._followers),
+            "fleet_subscribers": sum(len(c) for c in self._fleet.values()),
+            "viewports": self._grid.stats(),
+            "positions_published": self.positions_published,
+            "positions_coalesced": self.positions_coalesced,
+            "streams": len(self._streams),
+            "replayed": self.replayed,
+            "resyncs": self.resyncs,
+            "pubsub": self.bus.stats(),
+            "owner_loads": self.owners.loads,
+        }
+
 
-manager = ConnectionManager()
+manager = ConnectionManager(
+    queue_size=settings.WS_QUEUE_SIZE,
+    send_timeout=settings.WS_SEND_TIMEOUT_SECONDS,
+    bus=create_pubsub(),
+    position_tick=settings.WS_POSITION_TICK_SECONDS,
+    position_default_rate=settings.WS_POSITION_DEFAULT_RATE,
+    position_max_rate=settings.WS_POSITION_MAX_RATE,
+    max_subscriptions=settings.WS_MAX_SUBSCRIPTIONS,
+    grid_cell_degrees=settings.WS_GRID_CELL_DEGREES,
+    grid_max_cells=settings.WS_GRID_MAX_CELLS,
+    replay_size=settings.WS_REPLAY_BUFFER_SIZE,
+    replay_max_users=settings.WS_REPLAY_MAX_USERS,
+)
@@ -1,7 +1,7 @@
 import os
-import httpx
 import logging
 from typing import Optional, Tuple
+from app.services.http_client import http_pool
 
 logger = logging.getLogger(__name__)
 
@@ -14,18 +14,17 @@ async def snap_to_road(lat: float, lon: float) -> Tuple[float, float]:
     """
     url = f"{OSRM_NEAREST_URL}/{lon},{lat}?number=1"
     
-    async with httpx.AsyncClient() as client:
-        try:
-            response = await client.get(url, timeout=2.0)
-            if response.status_code == 200:
-                data = response.json()
-                if data.get("code") == "Ok" and data.get("waypoints"):
-                    snapped_lon, snapped_lat = data["waypoints"][0]["location"]
-                    logger.debug(f"OSRM Snap: ({lat}, {lon}) -> ({snapped_lat}, {snapped_lon})")
-                    return snapped_lat, snapped_lon
-            
-            logger.warning(f"OSRM nearest failed with status {response.status_code}: {response.text}")
-        except Exception as e:
-            logger.error(f"OSRM snap error: {e}")
+    try:
+        response = await http_pool.client.get(url, timeout=2.0)
+        if response.status_code == 200:
+            data = response.json()
+            if data.get("code") == "Ok" and data.get("waypoints"):
+                snapped_lon, snapped_lat = data["waypoints"][0]["location"]
+                logger.debug(f"OSRM Snap: ({lat}, {lon}) -> ({snapped_lat}, {snapped_lon})")
+                return snapped_lat, snapped_lon
+        
+        logger.warning(f"OSRM nearest failed with status {response.status_code}: {response.text}")
+    except Exception as e:
+        logger.error(f"OSRM snap error: {e}")
             
     return lat, lon
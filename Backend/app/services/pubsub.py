@@ -0,0 +1,176 @@
+"""
+Pub/sub between API workers for the WebSocket fan-out (WS_PUBSUB_BACKEND).
+A user's sockets can live in any uvicorn worker or container, so the ConnectionManager
+publishes each outbound event on a bus and delivers the events it receives to the
+sockets of its own process.
+  local     — single process: publish() hands the event straight to the local handler
+  postgres  — NOTIFY on WS_PUBSUB_CHANNEL; each worker LISTENs on a dedicated asyncpg
+              connection (no new service: the database is already there). Every worker,
+              the publisher included, receives every event and delivers it locally.
+publish() never waits: payloads are queued and sent by one task, several per round trip
+(SELECT pg_notify … FROM unnest). While the listener connection is down, and for payloads
+over the NOTIFY limit, events are delivered to this worker's sockets only.
+"""
+
+import asyncio
+import logging
+from typing import Callable, List, Optional
+
+from app.core.config import settings
+from app.db.session import engine
+
+logger = logging.getLogger(__name__)
+
+# Postgres rejects NOTIFY payloads of 8000 bytes or more
+MAX_NOTIFY_BYTES = 7999
+
+Handler = Callable[[str], None]
+
+
+class LocalPubSub:
+    """Single-process bus."""
+
+    name = "local"
+
+    def __init__(self):
+        self._handler: Optional[Handler] = None
+        self.published = 0
+
+    def subscribe(self, handler: Handler):
+        self._handler = handler
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    def publish(self, payload: str):
+        self.published += 1
+        self._handler(payload)
+
+    def stats(self) -> dict:
+        return {"backend": self.name, "published": self.published}
+
+
+class PostgresPubSub:
+    """Bus over Postgres LISTEN/NOTIFY, shared by every worker connected to the database."""
+
+    name = "postgres"
+
+    def __init__(self, dsn: str, channel: str, max_batch: int, queue_size: int, reconnect_interval: float, keepalive: float):
+        self.dsn = dsn
+        self.channel = channel
+        self.max_batch = max_batch
+        self.reconnect_interval = reconnect_interval
+        self.keepalive = keepalive
+        self._handler: Optional[Handler] = None
+        self._queue: asyncio.Queue = asyncio.Queue(maxsize=queue_size)
+        self._task: Optional[asyncio.Task] = None
+        self.connected = False
+        self.published = 0
+        self.received = 0
+        self.local_only = 0  # Delivered to this worker only (disconnected, queue full, too large)
+        self.reconnects = 0
+
+    def subscribe(self, handler: Handler):
+        self._handler = handler
+
+    async def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+            logger.info(f"WebSocket pub/sub on Postgres channel {self.channel}")
+
+    async def stop(self):
+        if self._task is None:
+            return
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+    def publish(self, payload: str):
+        if self.connected and len(payload.encode("utf-8")) <= MAX_NOTIFY_BYTES:
+            try:
+                self._queue.put_nowait(payload)
+                self.published += 1
+                return
+            except asyncio.QueueFull:
+                pass
+        self.local_only += 1
+        self._handler(payload)
+
+    def _on_notify(self, connection, pid, channel, payload):
+        self.received += 1
+        try:
+            self._handler(payload)
+        except Exception as e:
+            logger.error(f"[PUBSUB] Failed to deliver event: {e}")
+
+    async def _run(self):
+        import asyncpg
+
+        while True:
+            connection = None
+            try:
+                connection = await asyncpg.connect(self.dsn)
+                await connection.add_listener(self.channel, self._on_notify)
+                self.connected = True
+                logger.info(f"[PUBSUB] Listening on {self.channel}")
+                await self._send_loop(connection)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.warning(f"[PUBSUB] Connection lost: {e}")
+            finally:
+                self.connected = False
+                if connection is not None:
+                    connection.terminate()
+            await asyncio.sleep(self.reconnect_interval)
+            self.reconnects += 1
+
+    async def _send_loop(self, connection):
+        while True:
+            try:
+                payload = await asyncio.wait_for(self._queue.get(), self.keepalive)
+            except asyncio.TimeoutError:
+                # An idle LISTEN connection would not notice it is dead
+                await connection.execute("SELECT 1")
+                continue
+            batch: List[str] = [payload]
+            while len(batch) < self.max_batch and not self._queue.empty():
+                batch.append(self._queue.get_nowait())
+            try:
+                await connection.execute(
+                    "SELECT pg_notify($1, payload) FROM unnest($2::text[]) AS payload",
+                    self.channel, batch,
+                )
+            except Exception:
+                # At least this worker's sockets get them
+                self.local_only += len(batch)
+                for payload in batch:
+                    self._handler(payload)
+                raise
+
+    def stats(self) -> dict:
+        return {
+            "backend": self.name,
+            "connected": self.connected,
+            "queued": self._queue.qsize(),
+            "published": self.published,
+            "received": self.received,
+            "local_only": self.local_only,
+            "reconnects": self.reconnects,
+        }
+
+
+def create_pubsub():
+    if settings.WS_PUBSUB_BACKEND == "postgres":
+        return PostgresPubSub(
+            dsn=engine.url.set(drivername="postgresql").render_as_string(hide_password=False),
+            channel=settings.WS_PUBSUB_CHANNEL,
+            max_batch=settings.WS_PUBSUB_MAX_BATCH,
+            queue_size=settings.WS_PUBSUB_QUEUE_SIZE,
+            reconnect_interval=settings.WS_PUBSUB_RECONNECT_SECONDS,
+            keepalive=settings.WS_PUBSUB_KEEPALIVE_SECONDS,
+        )
+    return LocalPubSub()
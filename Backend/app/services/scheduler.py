@@ -0,0 +1,78 @@
+"""
+Periodic background jobs.
+Jobs are registered at startup and each runs in its own task, so a slow job never
+delays another. A failing run is logged and retried at the next interval.
+"""
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List
+
+logger = logging.getLogger(__name__)
+
+
+class _Job:
+    __slots__ = ("name", "interval", "func", "runs", "failures", "last_duration_ms")
+
+    def __init__(self, name: str, interval: float, func: Callable[[], Awaitable[None]]):
+        self.name = name
+        self.interval = interval
+        self.func = func
+        self.runs = 0
+        self.failures = 0
+        self.last_duration_ms = None
+
+
+class PeriodicScheduler:
+    """Runs registered coroutines every `interval` seconds (measured start to start)."""
+
+    def __init__(self):
+        self._jobs: Dict[str, _Job] = {}
+        self._tasks: List[asyncio.Task] = []
+
+    def add_job(self, name: str, interval: float, func: Callable[[], Awaitable[None]]):
+        if name in self._jobs:
+            raise ValueError(f"Job {name} already registered")
+        self._jobs[name] = _Job(name, interval, func)
+
+    def start(self):
+        if self._tasks:
+            return
+        self._tasks = [asyncio.create_task(self._loop(job)) for job in self._jobs.values()]
+        logger.info(f"Scheduler started: {', '.join(f'{j.name} every {j.interval}s' for j in self._jobs.values())}")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def stats(self) -> dict:
+        return {
+            job.name: {
+                "interval_seconds": job.interval,
+                "runs": job.runs,
+                "failures": job.failures,
+                "last_duration_ms": job.last_duration_ms,
+            }
+            for job in self._jobs.values()
+        }
+
+    async def _loop(self, job: _Job):
+        while True:
+            started = time.monotonic()
+            try:
+                await job.func()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                job.failures += 1
+                logger.error(f"[SCHEDULER] Job {job.name} failed: {e}")
+            job.runs += 1
+            elapsed = time.monotonic() - started
+            job.last_duration_ms = round(elapsed * 1000, 1)
+            await asyncio.sleep(max(0.0, job.interval - elapsed))
+
+
+scheduler = PeriodicScheduler()
@@ -0,0 +1,86 @@
+"""
+Uniform grid over lat/lon for the WebSocket viewport subscriptions.
+Each bounding box is registered in the cells it overlaps, so finding the boxes containing
+a fix reads one cell instead of testing every subscribed viewport. A box covering more
+than `max_cells` cells (a map zoomed out on the whole country) is kept aside and tested
+on every query: there are few of them, and they would fill most of the grid.
+Boxes do not cross the antimeridian (min_lon <= max_lon).
+"""
+
+import math
+from typing import Dict, Hashable, List, Set, Tuple
+
+BBox = Tuple[float, float, float, float]  # min_lon, min_lat, max_lon, max_lat
+
+
+def parse_bbox(value) -> BBox:
+    """[min_lon, min_lat, max_lon, max_lat] sent by a client; ValueError if invalid."""
+    if not isinstance(value, (list, tuple)) or len(value) != 4:
+        raise ValueError("bbox attendu : [min_lon, min_lat, max_lon, max_lat]")
+    min_lon, min_lat, max_lon, max_lat = (float(v) for v in value)
+    if not (-180 <= min_lon <= max_lon <= 180 and -90 <= min_lat <= max_lat <= 90):
+        raise ValueError(f"bbox invalide : {list(value)}")
+    return min_lon, min_lat, max_lon, max_lat
+
+
+def contains(bbox: BBox, lat: float, lon: float) -> bool:
+    return bbox[0] <= lon <= bbox[2] and bbox[1] <= lat <= bbox[3]
+
+
+class SpatialGrid:
+
+    def __init__(self, cell_degrees: float = 0.5, max_cells: int = 4096):
+        self.cell_degrees = cell_degrees
+        self.max_cells = max_cells
+        self._cells: Dict[Tuple[int, int], Set[Hashable]] = {}
+        self._boxes: Dict[Hashable, BBox] = {}
+        self._large: Set[Hashable] = set()
+
+    def _index(self, lat: float, lon: float) -> Tuple[int, int]:
+        return math.floor(lon / self.cell_degrees), math.floor(lat / self.cell_degrees)
+
+    def _span(self, bbox: BBox):
+        x0, y0 = self._index(bbox[1], bbox[0])
+        x1, y1 = self._index(bbox[3], bbox[2])
+        return range(x0, x1 + 1), range(y0, y1 + 1)
+
+    def insert(self, key: Hashable, bbox: BBox):
+        """Register (or move) the box of `key`."""
+        self.remove(key)
+        self._boxes[key] = bbox
+        xs, ys = self._span(bbox)
+        if len(xs) * len(ys) > self.max_cells:
+            self._large.add(key)
+            return
+        for x in xs:
+            for y in ys:
+                self._cells.setdefault((x, y), set()).add(key)
+
+    def remove(self, key: Hashable):
+        bbox = self._boxes.pop(key, None)
+        if bbox is None:
+            return
+        if key in self._large:
+            self._large.discard(key)
+            return
+        xs, ys = self._span(bbox)
+        for x in xs:
+            for y in ys:
+                cell = self._cells.get((x, y))
+                if cell is not None:
+                    cell.discard(key)
+                    if not cell:
+                        del self._cells[(x, y)]
+
+    def query(self, lat: float, lon: float) -> List[Hashable]:
+        """Keys whose box contains the point."""
+        boxes = self._boxes
+        found = [key for key in self._cells.get(self._index(lat, lon), ()) if contains(boxes[key], lat, lon)]
+        found.extend(key for key in self._large if contains(boxes[key], lat, lon))
+        return found
+
+    def __len__(self) -> int:
+        return len(self._boxes)
+
+    def stats(self) -> dict:
+        return {"boxes": len(self._boxes), "cells": len(self._cells), "large": len(self._large)}
@@ -0,0 +1,153 @@
+"""
+Stationary-fix run-length compression (STATIONARY_COMPRESSION=true).
+A parked vehicle keeps uplinking the same coordinates. When a fix is within
+STATIONARY_RADIUS_METRES of the vehicle's last stored row, both at or below
+STATIONARY_MAX_SPEED_KMH and with the same zone state, that row is extended
+(timestamp_fin, nb_repetitions) instead of a new row being inserted.
+A run is closed when it reaches STATIONARY_MAX_RUN_SECONDS, which bounds how far back a
+track query has to look for a stop overlapping its window, or when the device was silent
+for more than STATIONARY_MAX_GAP_SECONDS (the vehicle may have moved in between).
+The last stored row of each vehicle is kept in memory, read from the DB on first use.
+"""
+
+import logging
+import math
+from datetime import datetime
+from typing import Any, Dict, Iterable, Optional
+
+from sqlalchemy import Float, cast
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.models.position import Position
+from app.services.geofencing_service import METRES_PER_DEGREE
+
+logger = logging.getLogger(__name__)
+
+
+class StoredFix:
+    """Last position_gps row of a vehicle. `row` is set while it is not inserted yet."""
+    __slots__ = (
+        "id_position", "latitude", "longitude", "vitesse", "dans_zone",
+        "timestamp_gps", "timestamp_fin", "nb_repetitions", "row",
+    )
+
+    def __init__(self, id_position, latitude, longitude, vitesse, dans_zone,
+                 timestamp_gps, timestamp_fin=None, nb_repetitions=1, row=None):
+        self.id_position = id_position
+        self.latitude = latitude
+        self.longitude = longitude
+        self.vitesse = vitesse
+        self.dans_zone = dans_zone
+        self.timestamp_gps = timestamp_gps
+        self.timestamp_fin = timestamp_fin
+        self.nb_repetitions = nb_repetitions
+        self.row = row
+
+    @property
+    def last_seen(self) -> datetime:
+        return self.timestamp_fin or self.timestamp_gps
+
+    def extend(self, timestamp: datetime):
+        self.timestamp_fin = timestamp
+        self.nb_repetitions += 1
+        if self.row is not None:
+            # Inserted with the current micro-batch: extend the pending row itself
+            self.row["timestamp_fin"] = timestamp
+            self.row["nb_repetitions"] = self.nb_repetitions
+
+
+class StationaryCompressor:
+
+    def __init__(self, enabled: bool, radius_m: float, max_speed_kmh: float, max_run_seconds: int, max_gap_seconds: int):
+        self.enabled = enabled
+        self.radius_m = radius_m
+        self.max_speed_kmh = max_speed_kmh
+        self.max_run_seconds = max_run_seconds
+        self.max_gap_seconds = max_gap_seconds
+        # vehicle id → last stored row (None: vehicle has no position yet)
+        self._last: Dict[int, Optional[StoredFix]] = {}
+        self.extended = 0
+        self.runs = 0
+
+    async def load(self, db: AsyncSession, vehicle_ids: Iterable[int]):
+        """Read the last row of the vehicles not in memory yet, in one query."""
+        missing = {vehicle_id for vehicle_id in vehicle_ids if vehicle_id not in self._last}
+        if not missing:
+            return
+        # DISTINCT ON served by idx_position_vehicule_keyset
+        result = await db.execute(
+            select(
+                Position.id_vehicule,
+                Position.id_position,
+                cast(Position.latitude, Float),
+                cast(Position.longitude, Float),
+                cast(Position.vitesse, Float),
+                Position.dans_zone,
+                Position.timestamp_gps,
+                Position.timestamp_fin,
+                Position.nb_repetitions,
+            )
+            # Not a fix flagged by the GPS quality gate: later fixes must not be merged into it
+            .where(Position.id_vehicule.in_(missing), Position.fix_status.is_distinct_from(0))
+            .distinct(Position.id_vehicule)
+            .order_by(Position.id_vehicule, Position.timestamp_gps.desc(), Position.id_position.desc())
+        )
+        for vehicle_id, *values in result.all():
+            self._last[vehicle_id] = StoredFix(*values)
+        for vehicle_id in missing:
+            self._last.setdefault(vehicle_id, None)
+
+    def match(self, vehicle_id: int, lat: float, lon: float, speed: float,
+              dans_zone: Optional[bool], timestamp: datetime) -> Optional[StoredFix]:
+        """The stored row this fix extends, or None when it needs a row of its own."""
+        last = self._last.get(vehicle_id)
+        if last is None or speed > self.max_speed_kmh or last.vitesse > self.max_speed_kmh:
+            return None
+        if last.dans_zone != dans_zone:
+            return None
+        if (timestamp - last.last_seen).total_seconds() > self.max_gap_seconds:
+            return None
+        if (timestamp - last.timestamp_gps).total_seconds() >= self.max_run_seconds:
+            return None
+        dx = (lon - last.longitude) * math.cos(math.radians(lat))
+        dy = lat - last.latitude
+        if math.sqrt(dx * dx + dy * dy) * METRES_PER_DEGREE > self.radius_m:
+            return None
+        self.extended += 1
+        return last
+
+    def forget(self, vehicle_ids: Iterable[int]):
+        """Drop the in-memory rows of these vehicles (a batch that failed left them ahead of the
+        DB: pending rows, extended counts); they are read again on next use."""
+        for vehicle_id in vehicle_ids:
+            self._last.pop(vehicle_id, None)
+
+    def remember(self, vehicle_id: int, row: Dict[str, Any], id_position: Optional[int] = None) -> StoredFix:
+        """Record the row just stored (or about to be, when id_position is None)."""
+        fix = StoredFix(
+            id_position, row["latitude"], row["longitude"], row["vitesse"], row["dans_zone"],
+            row["timestamp_gps"], row["timestamp_fin"], row["nb_repetitions"],
+            row=row if id_position is None else None,
+        )
+        self._last[vehicle_id] = fix
+        self.runs += 1
+        return fix
+
+    def stats(self) -> dict:
+        return {
+            "enabled": self.enabled,
+            "vehicles": len(self._last),
+            "rows_inserted": self.runs,
+            "fixes_merged": self.extended,
+        }
+
+
+stationary = StationaryCompressor(
+    enabled=settings.STATIONARY_COMPRESSION,
+    radius_m=settings.STATIONARY_RADIUS_METRES,
+    max_speed_kmh=settings.STATIONARY_MAX_SPEED_KMH,
+    max_run_seconds=settings.STATIONARY_MAX_RUN_SECONDS,
+    max_gap_seconds=settings.STATIONARY_MAX_GAP_SECONDS,
+)
@@ -0,0 +1,171 @@
+"""
+Track simplification for map rendering.
+Positions are fed in time order, chunk by chunk, as they come off a server-side cursor.
+After each chunk, Douglas–Peucker (tolerance in metres) runs over the points not settled
+yet. Kept points before the second-to-last one are emitted; the tail is carried into the
+next chunk, capped at `max_buffer` points so memory stays bounded on long straight runs.
+If more than `max_points` survive, Visvalingam–Whyatt removes the least significant ones
+(smallest effective area) until the budget is met.
+Dwell points (a stationary run stored as one row, see stationary.py) carry their end
+time and are always kept, so stops survive simplification with their duration.
+Distances use an equirectangular projection scaled at the first point's latitude, which is
+accurate to well under a metre over the extent of a trip.
+"""
+
+import heapq
+import math
+from datetime import datetime
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from app.services.geofencing_service import METRES_PER_DEGREE
+
+TrackPoint = Tuple[datetime, float, float, Optional[datetime]]  # (timestamp, lat, lon, dwell end)
+
+
+def douglas_peucker(x: np.ndarray, y: np.ndarray, tolerance: float) -> np.ndarray:
+    """Return the boolean mask of the points kept. Iterative, distances to the segment (not the line)."""
+    n = len(x)
+    keep = np.zeros(n, dtype=bool)
+    if n == 0:
+        return keep
+    keep[0] = keep[-1] = True
+    stack = [(0, n - 1)]
+    while stack:
+        i, j = stack.pop()
+        if j - i < 2:
+            continue
+        px, py = x[i + 1:j], y[i + 1:j]
+        dx, dy = x[j] - x[i], y[j] - y[i]
+        length2 = dx * dx + dy * dy
+        if length2 == 0.0:
+            # Closed loop (vehicle back at its start): distance to the point
+            dist = np.hypot(px - x[i], py - y[i])
+        else:
+            t = np.clip(((px - x[i]) * dx + (py - y[i]) * dy) / length2, 0.0, 1.0)
+            dist = np.hypot(px - (x[i] + t * dx), py - (y[i] + t * dy))
+        k = int(np.argmax(dist))
+        if dist[k] > tolerance:
+            k += i + 1
+            keep[k] = True
+            stack.append((i, k))
+            stack.append((k, j))
+    return keep
+
+
+def visvalingam(
+    x: Sequence[float], y: Sequence[float], max_points: int, pinned: Optional[Sequence[bool]] = None,
+) -> List[int]:
+    """
+    Indices of the `max_points` most significant points (endpoints always kept).
+    `pinned` points are never removed, even if that leaves more than `max_points`.
+    """
+    n = len(x)
+    if n <= max_points or n <= 2:
+        return list(range(n))
+    max_points = max(max_points, 2)
+
+    def area(a: int, b: int, c: int) -> float:
+        return abs((x[b] - x[a]) * (y[c] - y[a]) - (x[c] - x[a]) * (y[b] - y[a])) / 2
+
+    prev = list(range(-1, n - 1))
+    nxt = list(range(1, n + 1))
+    areas = [math.inf] * n
+    heap = []
+    for i in range(1, n - 1):
+        if pinned is None or not pinned[i]:
+            areas[i] = area(i - 1, i, i + 1)
+            heap.append((areas[i], i))
+    heapq.heapify(heap)
+
+    removed = [False] * n
+    remaining = n
+    while remaining > max_points and heap:
+        a, i = heapq.heappop(heap)
+        if removed[i] or a != areas[i]:
+            continue  # Stale entry
+        removed[i] = True
+        remaining -= 1
+        p, q = prev[i], nxt[i]
+        nxt[p], prev[q] = q, p
+        # A neighbour's area never drops below the removed one (keeps the order monotonic)
+        for j in (p, q):
+            if 0 < j < n - 1 and areas[j] != math.inf:
+                areas[j] = max(area(prev[j], j, nxt[j]), a)
+                heapq.heappush(heap, (areas[j], j))
+    return [i for i in range(n) if not removed[i]]
+
+
+class TrackSimplifier:
+    """Streaming simplifier: `add()` chunks in time order, then `finish()`."""
+
+    def __init__(self, tolerance_m: float, max_buffer: int = 20000):
+        self.tolerance_m = tolerance_m
+        self.max_buffer = max_buffer
+        self.total = 0
+        self._kept: List[TrackPoint] = []
+        # Tail not settled yet: starts at the last committed point
+        self._timestamps: List[datetime] = []
+        self._lats: List[float] = []
+        self._lons: List[float] = []
+        self._ends: List[Optional[datetime]] = []
+        self._lon_scale = None
+
+    def _simplify(self) -> np.ndarray:
+        lats = np.asarray(self._lats, dtype=np.float64)
+        lons = np.asarray(self._lons, dtype=np.float64)
+        keep = douglas_peucker(*self._project(lats, lons), self.tolerance_m)
+        # Extra points only lower the deviation: dwell points can be added to any DP result
+        keep |= np.fromiter((end is not None for end in self._ends), dtype=bool, count=len(self._ends))
+        return np.flatnonzero(keep)
+
+    def _project(self, lats: np.ndarray, lons: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        return lons * self._lon_scale, lats * METRES_PER_DEGREE
+
+    def _commit(self, keep: np.ndarray, cut: int):
+        """Move the kept points before `cut` to the output; the buffer restarts at `cut`."""
+        for i in keep:
+            if i >= cut:
+                break
+            self._kept.append((self._timestamps[i], self._lats[i], self._lons[i], self._ends[i]))
+        del self._timestamps[:cut], self._lats[:cut], self._lons[:cut], self._ends[:cut]
+
+    def add(
+        self,
+        timestamps: Sequence[datetime],
+        lats: Sequence[float],
+        lons: Sequence[float],
+        ends: Optional[Sequence[Optional[datetime]]] = None,
+    ):
+        """`ends`: end of each point's stationary run, None for a single fix."""
+        if not timestamps:
+            return
+        self.total += len(timestamps)
+        if self._lon_scale is None:
+            self._lon_scale = METRES_PER_DEGREE * math.cos(math.radians(lats[0]))
+        self._timestamps.extend(timestamps)
+        self._lats.extend(lats)
+        self._lons.extend(lons)
+        self._ends.extend(ends if ends is not None else [None] * len(timestamps))
+
+        keep = self._simplify()
+        if len(self._timestamps) > self.max_buffer:
+            # Long straight stretch: settle everything up to the buffer's end
+            self._commit(keep, keep[-1])
+        elif len(keep) > 2:
+            # The last kept segment can still change with the next points; the others cannot
+            self._commit(keep, keep[-2])
+
+    def finish(self, max_points: int) -> List[TrackPoint]:
+        if self._timestamps:
+            self._commit(self._simplify(), len(self._timestamps))
+        points = self._kept
+        if len(points) > max_points:
+            x, y = self._project(
+                np.fromiter((p[1] for p in points), dtype=np.float64, count=len(points)),
+                np.fromiter((p[2] for p in points), dtype=np.float64, count=len(points)),
+            )
+            pinned = [p[3] is not None for p in points]
+            points = [points[i] for i in visvalingam(x.tolist(), y.tolist(), max_points, pinned)]
+        return points
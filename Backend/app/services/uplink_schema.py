@@ -0,0 +1,185 @@
+"""
+Uplink normalization, shared by every ingestion transport.
+A ChirpStack uplink (v3 or v4 JSON, HTTP integration or MQTT) is read once into a slotted
+UplinkFrame. The v3/v4 envelope spellings (`deviceInfo.devEui`/`devEUI`, `fPort`, `fCnt`)
+are direct dict lookups; a dict is lowercased once, instead of being scanned per field,
+only when case-insensitive access is needed (decoded object, unusual casing).
+Reading happens in two steps so the batched consumer can decode a whole micro-batch at once:
+  parse_envelope()  — DevEUI, FPort, fCnt, raw bytes and receipt time; cheap, done by the transport
+  decode_frame(s)() — frame contents, from the backend codecs or ChirpStack's object/objectJSON
+"""
+
+import base64
+import binascii
+import json
+import logging
+from datetime import datetime
+from typing import List, Optional, Sequence
+
+from app.services import codecs
+
+logger = logging.getLogger(__name__)
+
+_HEX_DIGITS = frozenset("0123456789abcdefABCDEF")
+
+
+_POSITION_KEYS = frozenset(("latitude", "longitude", "speed", "heading", "altitude", "satellites"))
+_EMPTY: dict = {}
+
+
+def _lower_keys(d) -> dict:
+    return {k.lower(): v for k, v in d.items()} if isinstance(d, dict) else {}
+
+
+def _normalize_dev_eui(dev_eui: str) -> str:
+    """Some ChirpStack versions send the DevEUI base64-encoded: convert it to hex."""
+    # Base64 for 8 bytes is 11 chars (unpadded) or 12 chars (padded)
+    if len(dev_eui) in (11, 12) and not _HEX_DIGITS.issuperset(dev_eui):
+        try:
+            decoded = base64.b64decode(dev_eui + "=" * (-len(dev_eui) % 4))
+            if len(decoded) == 8:
+                logger.info(f"Decoded Base64 DevEUI to hex: '{decoded.hex()}'")
+                return decoded.hex()
+        except (binascii.Error, ValueError) as e:
+            logger.error(f"Base64 decode failed for '{dev_eui}': {e}")
+    return dev_eui
+
+
+class UplinkFrame:
+    """
+    One uplink, normalized. parse_envelope sets the transport fields; the position and
+    relay fields are set by decode_frame(s). `applied` records the processing steps already
+    done for the frame (see ingestion), so that a retry does not repeat them.
+    """
+    __slots__ = (
+        "dev_eui",
+        "f_port",
+        "f_cnt",
+        "data",
+        "received_at",
+        "_payload",
+        "_object",
+        "latitude",
+        "longitude",
+        "speed",
+        "heading",
+        "altitude",
+        "satellites",
+        "hdop",
+        "relay_status",
+        "fix_count",
+        "decoded",
+        "applied",
+    )
+
+    @property
+    def keys(self) -> List[str]:
+        return list(self._payload)
+
+    @property
+    def object_keys(self) -> List[str]:
+        return list(self._object)
+
+    def apply(self, decoded: Optional[dict]):
+        """
+        Fill the position/relay fields. `decoded` is the backend codec output (lowercase
+        keys, complete). When None, ChirpStack's decoded object (`object`, or `objectJSON`
+        as a string) is used, with the fields it lacks looked up at the top level.
+        """
+        if decoded:
+            obj = decoded
+            top = _EMPTY
+        else:
+            payload = self._payload
+            raw = payload.get("object")
+            object_json = payload.get("objectJSON")
+            if not raw and object_json:
+                try:
+                    raw = json.loads(object_json)
+                except (TypeError, ValueError) as e:
+                    logger.error(f"Failed to parse objectJSON: {e}")
+            obj = _lower_keys(raw)
+            top = _EMPTY if obj.keys() >= _POSITION_KEYS else _lower_keys(payload)
+        self._object = obj
+
+        self.latitude = obj.get("latitude") or top.get("latitude")
+        self.longitude = obj.get("longitude") or top.get("longitude")
+        self.speed = float(obj.get("speed") or top.get("speed") or 0.0)
+        self.heading = float(obj.get("heading") or top.get("heading") or 0.0)
+        self.altitude = float(obj.get("altitude") or top.get("altitude") or 0.0)
+        self.satellites = int(obj.get("satellites") or top.get("satellites") or 0)
+        hdop = obj.get("hdop") or top.get("hdop")
+        self.hdop = float(hdop) if hdop is not None else None
+        fixes = obj.get("fixes")
+        self.fix_count = len(fixes) if fixes else (1 if self.latitude is not None else 0)
+
+        # Primary: relay_status from the decoded object
+        relay_status = obj.get("relay_status")
+        # Support relay_cut / relay_active boolean fields sent by the device
+        if relay_status in (None, "unknown", ""):
+            if obj.get("relay_cut") is True:
+                relay_status = "cut"
+            elif obj.get("relay_active") is True:
+                relay_status = "active"
+        # Last resort (no fPort in the payload): guess the relay state from the frame length
+        if relay_status not in ("cut", "active") and self.latitude is None and self.data:
+            if len(self.data) == 1:
+                relay_status = "cut"
+            elif len(self.data) == 2:
+                relay_status = "active"
+        self.relay_status = relay_status
+        self.decoded = True
+
+
+def parse_envelope(payload: dict) -> UplinkFrame:
+    """Read the transport-level fields of an uplink. `frame.dev_eui` is None if absent."""
+    frame = UplinkFrame()
+    frame._payload = payload
+    # Time of the position: a frame may wait in a lane before it is stored
+    frame.received_at = datetime.utcnow()
+
+    # v4: deviceInfo.devEui, v3: devEUI at the top level
+    device_info = payload.get("deviceInfo")
+    dev_eui = (device_info.get("devEui") if device_info else None) or payload.get("devEUI") or payload.get("devEui")
+    f_port = payload.get("fPort")
+    f_cnt = payload.get("fCnt")
+    data_b64 = payload.get("data")
+    if dev_eui is None or f_port is None or f_cnt is None:
+        # Unusual casing: one case-insensitive pass over the payload
+        top = _lower_keys(payload)
+        dev_eui = dev_eui or _lower_keys(top.get("deviceinfo")).get("deveui") or top.get("deveui")
+        f_port = top.get("fport") if f_port is None else f_port
+        f_cnt = top.get("fcnt") if f_cnt is None else f_cnt
+        data_b64 = data_b64 or top.get("data")
+
+    frame.decoded = False
+    frame.applied = None
+    frame.dev_eui = _normalize_dev_eui(dev_eui) if dev_eui else None
+    frame.f_port = f_port
+    frame.f_cnt = int(f_cnt) if f_cnt is not None else None
+    frame.data = None
+    if data_b64:
+        try:
+            frame.data = base64.b64decode(data_b64)
+        except (binascii.Error, ValueError) as e:
+            logger.error(f"Failed to decode raw data bytes: {e}")
+    return frame
+
+def decode_frame(frame: UplinkFrame) -> UplinkFrame:
+    """Decode the frame contents; a no-op if already done (e.g. by admission control)."""
+    if not frame.decoded:
+        frame.apply(codecs.decode(frame.f_port, frame.data) if frame.data else None)
+    return frame
+
+
+def decode_frames(frames: Sequence[UplinkFrame]) -> Sequence[UplinkFrame]:
+    """decode_frame for a batch; GPS frames are decoded together (see codecs.decode_many)."""
+    pending = [frame for frame in frames if not frame.decoded]
+    decoded = codecs.decode_many([(frame.f_port, frame.data or b"") for frame in pending])
+    for frame, obj in zip(pending, decoded):
+        frame.apply(obj)
+    return frames
+
+
+def parse_uplink(payload: dict) -> UplinkFrame:
+    return decode_frame(parse_envelope(payload))
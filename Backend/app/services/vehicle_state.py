@@ -0,0 +1,368 @@
+"""
+Last-known state of each vehicle, kept in memory and written behind.
+Every stored fix used to UPDATE vehicule.derniere_* (and the position_gps trigger wrote
+the same row again): two writes on a hot row per fix, and as many dead tuples.
+The ingestion path now records the fix here; the scheduler job `vehicle_state_flush`
+persists the vehicles changed since the last run with one bulk UPDATE every
+VEHICLE_STATE_FLUSH_SECONDS, and once more on shutdown.
+Reads of the last position go through get(): the store is fresher than the row, which
+lags by at most one flush interval (a crash loses that interval, never a position).
+
+The store also serves GET /vehicles/live. It is loaded with the whole fleet at startup and
+kept current by the code paths that change a vehicle (next to deveui_resolver.refresh).
+Changes this process does not see (another worker, direct SQL) are picked up by the
+scheduler job `vehicle_state_reconcile`, which re-reads the table every
+VEHICLE_STATE_RECONCILE_SECONDS and gives the vehicles that differ a new version.
+Every change takes the next value of a monotonic version, so a client holding version V
+only needs the vehicles changed after V, plus tombstones for the ones it can no longer see
+(deleted, or moved to another owner). Versions start at the startup time in microseconds:
+they keep increasing across restarts, and a version older than the startup (or than the
+oldest tombstone kept) gets a full snapshot instead of a delta.
+Each worker keeps its own store, so versions only mean something in the process that issued
+them: clients get an opaque token "<epoch>.<version>", where the epoch identifies the store,
+and a token from another worker (or an earlier run) gets a full snapshot.
+The store also tracks the last version that changed each owner's vehicles, so the ETag of a
+user only changes with their own fleet.
+"""
+
+import asyncio
+import logging
+import secrets
+import time
+from datetime import datetime
+from typing import Dict, List, Optional, Set, Tuple
+
+from sqlalchemy import bindparam, or_, update
+from sqlalchemy.future import select
+
+from app.db.session import SessionLocal
+from app.models.vehicle import Vehicle
+
+logger = logging.getLogger(__name__)
+
+# Columns served by GET /vehicles/live besides the last position
+INFO_FIELDS = (
+    "nom",
+    "immatriculation",
+    "marque",
+    "modele",
+    "annee",
+    "deveui",
+    "statut",
+    "moteur_coupe",
+    "moteur_en_attente",
+    "moteur_commande_timestamp",
+    "mode_auto",
+    "id_utilisateur_proprietaire",
+    "created_at",
+    "activated_at",
+)
+POSITION_FIELDS = ("derniere_communication", "derniere_position_lat", "derniere_position_lon")
+
+# Core executemany rather than an ORM bulk UPDATE: a vehicle deleted meanwhile matches no row
+# instead of failing the whole flush (StaleDataError)
+_vehicule = Vehicle.__table__
+# Only moves the row forward: a fix older than the stored one (written by another worker, or
+# by a flush that lagged behind) leaves it untouched
+_FLUSH_STATEMENT = update(_vehicule).where(
+    _vehicule.c.id_vehicule == bindparam("vehicle_id"),
+    or_(
+        _vehicule.c.derniere_communication.is_(None),
+        _vehicule.c.derniere_communication < bindparam("fix_time"),
+    ),
+)
+
+
+class VehicleState:
+    """vehicule.derniere_* and dernier_fcnt of one vehicle, its other live columns and version."""
+    __slots__ = (
+        "id_vehicule",
+        "derniere_communication",
+        "derniere_position_lat",
+        "derniere_position_lon",
+        "dernier_fcnt",
+        "info",
+        "version",
+    )
+
+    def __init__(self, id_vehicule: int):
+        self.id_vehicule = id_vehicule
+        self.derniere_communication: Optional[datetime] = None
+        self.derniere_position_lat: Optional[float] = None
+        self.derniere_position_lon: Optional[float] = None
+        self.dernier_fcnt: Optional[int] = None
+        self.info: Optional[dict] = None  # INFO_FIELDS; None until the vehicle row was seen
+        self.version = 0
+
+    def values(self) -> dict:
+        """Row of the write-behind UPDATE."""
+        return {
+            "vehicle_id": self.id_vehicule,
+            "fix_time": self.derniere_communication,
+            "derniere_communication": self.derniere_communication,
+            "derniere_position_lat": self.derniere_position_lat,
+            "derniere_position_lon": self.derniere_position_lon,
+            "dernier_fcnt": self.dernier_fcnt,
+        }
+
+    @property
+    def owner(self) -> Optional[int]:
+        return self.info["id_utilisateur_proprietaire"] if self.info is not None else None
+
+    def live(self) -> dict:
+        """Item of GET /vehicles/live."""
+        return {
+            "id_vehicule": self.id_vehicule,
+            **self.info,
+            "derniere_communication": self.derniere_communication,
+            "derniere_position_lat": self.derniere_position_lat,
+            "derniere_position_lon": self.derniere_position_lon,
+            "version": self.version,
+        }
+
+
+class VehicleStateStore:
+
+    def __init__(self, max_tombstones: int = 10000):
+        self.max_tombstones = max_tombstones
+        self._states: Dict[int, VehicleState] = {}
+        self._dirty: Set[int] = set()
+        # A flush in progress must not write back a vehicle cleared meanwhile
+        self._lock = asyncio.Lock()
+        self.base_version = time.time_ns() // 1000
+        self.version = self.base_version
+        # Identifies this store in version tokens (one per worker process)
+        self.epoch = secrets.token_hex(4)
+        self._owner_versions: Dict[int, int] = {}  # owner -> version of the last change to their vehicles
+        # Oldest version a delta can start from (raised when tombstones are dropped)
+        self._floor = self.base_version
+        # Both ordered by version, oldest first: a delta walks them back from the end
+        self._changed: Dict[int, int] = {}  # vehicle_id -> version of its last change
+        self._removed: Dict[Tuple[int, Optional[int]], int] = {}  # (vehicle_id, owner or None: everyone) -> version
+        self.updates = 0
+        self.flushes = 0
+        self.rows_written = 0
+        self.last_flush_ms = None
+
+    @staticmethod
+    async def _read_fleet() -> list:
+        async with SessionLocal() as db:
+            result = await db.execute(
+                select(Vehicle.id_vehicule, Vehicle.dernier_fcnt, *(getattr(Vehicle, f) for f in POSITION_FIELDS + INFO_FIELDS))
+            )
+            return result.all()
+
+    async def load(self):
+        """Load the whole fleet (startup). Vehicles changed afterwards take versions above base_version."""
+        rows = await self._read_fleet()
+        for row in rows:
+            state = self._states.get(row.id_vehicule)
+            if state is None:
+                state = self._states[row.id_vehicule] = VehicleState(row.id_vehicule)
+                for field in POSITION_FIELDS + ("dernier_fcnt",):
+                    setattr(state, field, getattr(row, field))
+                state.version = self.base_version
+            if state.info is None:
+                state.info = {field: getattr(row, field) for field in INFO_FIELDS}
+        logger.info(f"Vehicle state loaded for {len(rows)} vehicle(s)")
+
+    async def reconcile(self):
+        """
+        Catch up with the vehicule table: rows changed or deleted without this process knowing.
+        A vehicle changed here while the table was read keeps the store's state.
+        """
+        since = self.version
+        rows = await self._read_fleet()
+        seen = set()
+        for row in rows:
+            seen.add(row.id_vehicule)
+            state = self._state(row.id_vehicule)
+            if state.version > since:
+                continue
+            changed = False
+            info = {field: getattr(row, field) for field in INFO_FIELDS}
+            if state.info != info:
+                previous_owner = state.owner
+                state.info = info
+                if previous_owner is not None and previous_owner != state.owner:
+                    self._tombstone(state.id_vehicule, previous_owner)
+                changed = True
+            if row.derniere_communication is not None and (
+                state.derniere_communication is None or row.derniere_communication > state.derniere_communication
+            ):
+                for field in POSITION_FIELDS:
+                    setattr(state, field, getattr(row, field))
+                changed = True
+            if changed:
+                self._bump(state)
+        deleted = [
+            vehicle_id for vehicle_id, state in self._states.items()
+            if vehicle_id not in seen and state.info is not None and state.version <= since
+        ]
+        for vehicle_id in deleted:
+            await self.remove(vehicle_id)
+        if deleted:
+            logger.info(f"Vehicle state: {len(deleted)} vehicle(s) deleted elsewhere")
+
+    def get(self, vehicle_id: int) -> Optional[VehicleState]:
+        return self._states.get(vehicle_id)
+
+    def _state(self, vehicle_id: int) -> VehicleState:
+        state = self._states.get(vehicle_id)
+        if state is None:
+            state = self._states[vehicle_id] = VehicleState(vehicle_id)
+        return state
+
+    def _bump(self, state: VehicleState):
+        self.version += 1
+        state.version = self.version
+        self._changed.pop(state.id_vehicule, None)
+        self._changed[state.id_vehicule] = self.version
+        if state.owner is not None:
+            self._owner_versions[state.owner] = self.version
+
+    def _tombstone(self, vehicle_id: int, owner: Optional[int]):
+        """vehicle_id is no longer visible to owner (None: to anyone)."""
+        self.version += 1
+        key = (vehicle_id, owner)
+        self._removed.pop(key, None)
+        self._removed[key] = self.version
+        if owner is not None:
+            self._owner_versions[owner] = self.version
+        while len(self._removed) > self.max_tombstones:
+            self._floor = self._removed.pop(next(iter(self._removed)))
+
+    def update(self, vehicle_id: int, timestamp: datetime, lat: float, lon: float, f_cnt: Optional[int]):
+        """Record a stored fix; persisted at the next flush."""
+        state = self._state(vehicle_id)
+        state.derniere_communication = timestamp
+        state.derniere_position_lat = lat
+        state.derniere_position_lon = lon
+        if f_cnt is not None:
+            state.dernier_fcnt = f_cnt
+        self._dirty.add(vehicle_id)
+        self._bump(state)
+        self.updates += 1
+
+    def refresh(self, vehicle):
+        """Take the live columns of a vehicle after it changed (a Vehicle or a row with the same attributes)."""
+        state = self._state(vehicle.id_vehicule)
+        previous_owner = state.owner
+        state.info = {field: getattr(vehicle, field) for field in INFO_FIELDS}
+        if previous_owner is not None and previous_owner != state.owner:
+            self._tombstone(state.id_vehicule, previous_owner)
+        if state.derniere_communication is None and getattr(vehicle, "derniere_communication", None) is not None:
+            for field in POSITION_FIELDS:
+                setattr(state, field, getattr(vehicle, field))
+        self._bump(state)
+
+    def touch(self, vehicle_id: int, **fields):
+        """Change some live columns of a vehicle updated without loading its row."""
+        state = self._states.get(vehicle_id)
+        if state is None or state.info is None:
+            return
+        state.info.update(fields)
+        self._bump(state)
+
+    async def clear(self, vehicle_id: int):
+        """Forget a vehicle's last position (release) before its row is reset: nothing pending is written back."""
+        async with self._lock:
+            self._dirty.discard(vehicle_id)
+            state = self._states.get(vehicle_id)
+            if state is not None:
+                for field in POSITION_FIELDS:
+                    setattr(state, field, None)
+                self._bump(state)
+
+    async def remove(self, vehicle_id: int):
+        """Forget a deleted vehicle; live clients get a tombstone."""
+        async with self._lock:
+            self._dirty.discard(vehicle_id)
+            state = self._states.pop(vehicle_id, None)
+            self._changed.pop(vehicle_id, None)
+            self._tombstone(vehicle_id, None)
+            if state is not None and state.owner is not None:
+                self._owner_versions[state.owner] = self.version
+
+    def token(self, version: int) -> str:
+        """Version token handed to clients: only this store can serve a delta from it."""
+        return f"{self.epoch}.{version}"
+
+    def parse_token(self, token: str) -> Optional[int]:
+        """Version of a token issued by this store, else None (another worker, an earlier run, garbage)."""
+        epoch, _, version = token.partition(".")
+        if epoch != self.epoch or not version.isdigit():
+            return None
+        return int(version)
+
+    def owner_version(self, owner: Optional[int] = None) -> int:
+        """Last version that changed what `owner` sees (None: the whole fleet)."""
+        if owner is None:
+            return self.version
+        return self._owner_versions.get(owner, self.base_version)
+
+    @staticmethod
+    def _visible(state: VehicleState, owner: Optional[int]) -> bool:
+        return state.info is not None and (owner is None or state.owner == owner)
+
+    def snapshot(self, owner: Optional[int] = None) -> List[dict]:
+        """Live state of the fleet (owner: only that user's vehicles)."""
+        return [state.live() for state in self._states.values() if self._visible(state, owner)]
+
+    def changes(self, since: int, owner: Optional[int] = None) -> Optional[Tuple[List[dict], List[int]]]:
+        """
+        (vehicles changed after `since`, ids no longer visible), walking only those changes.
+        None when `since` cannot be served (before the startup or the oldest tombstone kept).
+        """
+        if since < self._floor or since > self.version:
+            return None
+        vehicles = []
+        for vehicle_id in reversed(self._changed):
+            state = self._states[vehicle_id]
+            if state.version <= since:
+                break
+            if self._visible(state, owner):
+                vehicles.append(state.live())
+        changed = {vehicle["id_vehicule"] for vehicle in vehicles}
+        removed = []
+        for (vehicle_id, removed_for), version in reversed(self._removed.items()):
+            if version <= since:
+                break
+            if (removed_for is None or removed_for == owner) and vehicle_id not in changed:
+                removed.append(vehicle_id)
+        return vehicles, removed
+
+    async def flush(self):
+        """Persist the vehicles changed since the last flush in one bulk UPDATE."""
+        async with self._lock:
+            if not self._dirty:
+                return
+            dirty, self._dirty = self._dirty, set()
+            rows = [self._states[vehicle_id].values() for vehicle_id in dirty]
+            started = time.monotonic()
+            try:
+                async with SessionLocal() as db:
+                    await db.execute(_FLUSH_STATEMENT, rows)
+                    await db.commit()
+            except Exception:
+                # Written at the next run, with any fix received meanwhile
+                self._dirty |= dirty
+                raise
+            self.flushes += 1
+            self.rows_written += len(rows)
+            self.last_flush_ms = round((time.monotonic() - started) * 1000, 1)
+
+    def stats(self) -> dict:
+        return {
+            "vehicles": len(self._states),
+            "dirty": len(self._dirty),
+            "version": self.version,
+            "tombstones": len(self._removed),
+            "updates": self.updates,
+            "flushes": self.flushes,
+            "rows_written": self.rows_written,
+            "last_flush_ms": self.last_flush_ms,
+        }
+
+
+vehicle_state = VehicleStateStore()
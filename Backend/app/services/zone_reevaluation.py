@@ -0,0 +1,233 @@
+"""
+Historical geofence re-evaluation.
+When a zone is edited, the dans_zone / distance_zone_metres values already stored for
+its vehicle are stale. A job streams the vehicle's positions in id order through a
+server-side cursor, recomputes them in chunks with check_points_batch and writes them
+back with batched UPDATEs. The last processed id is checkpointed in reevaluation_zone
+after every chunk, so an interrupted job resumes where it stopped.
+Every worker runs this runner, so a job belongs to the worker named in `proprietaire`.
+Pending jobs are claimed with one UPDATE … RETURNING: those with no owner (released on
+shutdown) or whose owner stopped checkpointing for ZONE_REEVALUATION_LEASE_SECONDS
+(crashed). A checkpoint only commits while the job is still EN_COURS and owned by this
+worker, so a job cancelled or taken over elsewhere stops at its next chunk.
+"""
+
+import asyncio
+import logging
+import os
+import socket
+from datetime import timedelta
+from typing import Dict
+
+from sqlalchemy import Float, cast, func, or_, update
+from sqlalchemy.future import select
+
+from app.core.config import settings
+from app.db.session import SessionLocal
+from app.models.position import Position
+from app.models.reevaluation import ZoneReevaluation, ReevaluationStatus
+from app.models.zone import Zone
+from app.services.geofencing_service import CompiledZone, check_points_batch
+
+logger = logging.getLogger(__name__)
+
+
+class ZoneReevaluationRunner:
+    """Runs re-evaluation jobs as background tasks, one at a time per zone."""
+
+    def __init__(self, chunk_size: int, lease_seconds: float):
+        self.chunk_size = chunk_size
+        self.lease_seconds = lease_seconds
+        self.worker = f"{socket.gethostname()}:{os.getpid()}"
+        self._tasks: Dict[int, asyncio.Task] = {}  # id_zone -> running task
+
+    async def schedule(self, zone_id: int, vehicle_id: int) -> int:
+        """
+        Start a re-evaluation of all the vehicle's positions stored so far against the zone.
+        A job already running for the same zone is cancelled: the new geometry wins.
+        Only the upper bound is read here; the job counts its positions itself.
+        Returns the job id.
+        """
+        await self._cancel(zone_id)
+        async with SessionLocal() as db:
+            max_id = await db.scalar(
+                select(func.max(Position.id_position)).where(Position.id_vehicule == vehicle_id)
+            )
+            job = ZoneReevaluation(
+                id_zone=zone_id,
+                id_vehicule=vehicle_id,
+                statut=ReevaluationStatus.EN_COURS.value,
+                proprietaire=self.worker,
+                dernier_id_position=0,
+                id_position_max=max_id or 0,
+                positions_total=None,
+                positions_traitees=0,
+            )
+            db.add(job)
+            await db.commit()
+            await db.refresh(job)
+        logger.info(f"[REEVAL] Job {job.id_reevaluation} scheduled: zone={zone_id} vehicle={vehicle_id}")
+        self._launch(job.id_reevaluation, zone_id)
+        return job.id_reevaluation
+
+    async def resume_pending(self):
+        """
+        Claim and resume, from their checkpoint, the jobs no worker is running: released by a
+        shutdown, or left by a worker that crashed (no checkpoint for lease_seconds).
+        Run at startup and by the scheduler.
+        """
+        lease_cutoff = func.timezone("utc", func.now()) - timedelta(seconds=self.lease_seconds)
+        async with SessionLocal() as db:
+            result = await db.execute(
+                update(ZoneReevaluation)
+                .where(
+                    ZoneReevaluation.statut == ReevaluationStatus.EN_COURS.value,
+                    ZoneReevaluation.id_zone.notin_(list(self._tasks)),
+                    or_(ZoneReevaluation.proprietaire.is_(None), ZoneReevaluation.updated_at < lease_cutoff),
+                )
+                .values(proprietaire=self.worker, updated_at=func.timezone("utc", func.now()))
+                .returning(ZoneReevaluation.id_reevaluation, ZoneReevaluation.id_zone)
+                .execution_options(synchronize_session=False)
+            )
+            claimed = result.all()
+            await db.commit()
+        for job_id, zone_id in claimed:
+            logger.info(f"[REEVAL] Resuming job {job_id} for zone {zone_id}")
+            self._launch(job_id, zone_id)
+
+    async def stop(self):
+        """Cancel running jobs; they stay EN_COURS, released for the next worker to claim."""
+        tasks = list(self._tasks.values())
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._tasks.clear()
+        async with SessionLocal() as db:
+            await db.execute(
+                update(ZoneReevaluation)
+                .where(
+                    ZoneReevaluation.statut == ReevaluationStatus.EN_COURS.value,
+                    ZoneReevaluation.proprietaire == self.worker,
+                )
+                .values(proprietaire=None)
+            )
+            await db.commit()
+
+    def _launch(self, job_id: int, zone_id: int):
+        task = asyncio.create_task(self._run(job_id))
+        self._tasks[zone_id] = task
+        task.add_done_callback(lambda t: self._forget(zone_id, t))
+
+    def _forget(self, zone_id: int, task: asyncio.Task):
+        if self._tasks.get(zone_id) is task:
+            del self._tasks[zone_id]
+
+    async def _cancel(self, zone_id: int):
+        task = self._tasks.pop(zone_id, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        # Also a job run by another worker: it stops at its next checkpoint
+        async with SessionLocal() as db:
+            await db.execute(
+                update(ZoneReevaluation)
+                .where(
+                    ZoneReevaluation.id_zone == zone_id,
+                    ZoneReevaluation.statut == ReevaluationStatus.EN_COURS.value,
+                )
+                .values(statut=ReevaluationStatus.ANNULEE.value)
+            )
+            await db.commit()
+
+    async def _run(self, job_id: int):
+        try:
+            await self._process(job_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"[REEVAL] Job {job_id} failed: {e}")
+            async with SessionLocal() as db:
+                await db.execute(
+                    update(ZoneReevaluation)
+                    .where(ZoneReevaluation.id_reevaluation == job_id)
+                    .values(statut=ReevaluationStatus.ECHOUEE.value, erreur=str(e))
+                )
+                await db.commit()
+
+    async def _process(self, job_id: int):
+        async with SessionLocal() as read_db, SessionLocal() as write_db:
+            job = await write_db.get(ZoneReevaluation, job_id)
+            zone = await write_db.get(Zone, job.id_zone)
+            compiled = CompiledZone(zone)
+            if job.positions_total is None:
+                # Counted here rather than in the zone update request
+                job.positions_total = await write_db.scalar(
+                    select(func.count(Position.id_position)).where(
+                        Position.id_vehicule == job.id_vehicule,
+                        Position.id_position <= job.id_position_max,
+                    )
+                )
+                await write_db.commit()
+            checkpoint = (
+                update(ZoneReevaluation)
+                .where(
+                    ZoneReevaluation.id_reevaluation == job_id,
+                    ZoneReevaluation.statut == ReevaluationStatus.EN_COURS.value,
+                    ZoneReevaluation.proprietaire == self.worker,
+                )
+                .execution_options(synchronize_session=False)
+            )
+            processed = job.positions_traitees or 0
+
+            stream = await read_db.stream(
+                select(
+                    Position.id_position,
+                    cast(Position.latitude, Float),
+                    cast(Position.longitude, Float),
+                )
+                .where(
+                    Position.id_vehicule == job.id_vehicule,
+                    Position.id_position > job.dernier_id_position,
+                    Position.id_position <= job.id_position_max,
+                )
+                .order_by(Position.id_position)
+                .execution_options(yield_per=self.chunk_size)
+            )
+            async for rows in stream.partitions(self.chunk_size):
+                ids = [row[0] for row in rows]
+                lats = [row[1] for row in rows]
+                lons = [row[2] for row in rows]
+                # NumPy work off the event loop
+                inside, distance = await asyncio.to_thread(check_points_batch, compiled, lats, lons)
+
+                await write_db.execute(update(Position), [
+                    {
+                        "id_position": position_id,
+                        "dans_zone": bool(is_inside),
+                        "distance_zone_metres": None if dist != dist else round(float(dist), 2),
+                        "id_zone": zone.id_zone,
+                    }
+                    for position_id, is_inside, dist in zip(ids, inside, distance)
+                ])
+                processed += len(ids)
+                # The checkpoint also renews the lease
+                result = await write_db.execute(checkpoint.values(dernier_id_position=ids[-1], positions_traitees=processed))
+                if result.rowcount == 0:
+                    await write_db.rollback()
+                    logger.info(f"[REEVAL] Job {job_id} cancelled or taken over, stopping")
+                    return
+                await write_db.commit()
+                logger.info(
+                    f"[REEVAL] Job {job_id}: {processed}/{job.positions_total} positions "
+                    f"(checkpoint id_position={ids[-1]})"
+                )
+
+            await write_db.execute(checkpoint.values(statut=ReevaluationStatus.TERMINEE.value, proprietaire=None))
+            await write_db.commit()
+            logger.info(f"[REEVAL] Job {job_id} done: {processed} positions re-evaluated")
+
+
+zone_reevaluation = ZoneReevaluationRunner(
+    chunk_size=settings.ZONE_REEVALUATION_CHUNK_SIZE,
+    lease_seconds=settings.ZONE_REEVALUATION_LEASE_SECONDS,
+)
@@ -0,0 +1,111 @@
+"""
+Micro-benchmark: per-frame cost of reading a ChirpStack uplink.
+  avant : l'ancienne extraction (get_case_insensitive sur chaque champ, objectJSON re-parsé)
+  après : uplink_schema.parse_uplink (clés mises en minuscules une fois, UplinkFrame à slots)
+Usage : python bench_uplink_parse.py [nombre_de_trames]
+"""
+
+import base64
+import json
+import os
+import struct
+import sys
+import timeit
+
+# Les services importent la configuration : valeurs factices hors Docker
+for _var in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB", "SECRET_KEY"):
+    os.environ.setdefault(_var, "bench")
+
+from app.services.uplink_schema import parse_uplink
+
+DATA_GPS = base64.b64encode(struct.pack(">ffH", 3.8666, 11.5166, 305)).decode()
+GPS_OBJECT = {"latitude": 3.8666, "longitude": 11.5166, "speed": 30.5, "altitude": 720.0,
+              "heading": 87.0, "satellites": 9}
+RX_INFO = [{"gatewayID": "a84041ffff1f7a50", "rssi": -97, "loRaSNR": 7.5, "name": "gw-yaounde"}]
+
+PAYLOADS = {
+    "v3 objectJSON": {
+        "applicationID": "1", "applicationName": "safetrack", "deviceName": "tracker-01",
+        "devEUI": "a84041000181c061", "rxInfo": RX_INFO, "txInfo": {"frequency": 868100000, "dr": 5},
+        "adr": True, "fCnt": 125, "fPort": 2, "data": DATA_GPS, "objectJSON": json.dumps(GPS_OBJECT),
+    },
+    "v4 object": {
+        "deduplicationId": "3f1e", "time": "2024-01-01T00:00:00Z",
+        "deviceInfo": {"tenantId": "52f1", "applicationId": "1", "deviceName": "tracker-01",
+                       "devEui": "a84041000181c061", "deviceProfileName": "gps-tracker-profile"},
+        "devAddr": "00e4304d", "adr": True, "dr": 5, "fCnt": 125, "fPort": 2, "confirmed": False,
+        "data": DATA_GPS, "object": GPS_OBJECT, "rxInfo": RX_INFO,
+    },
+    "v3 objet partiel": {
+        "applicationID": "1", "applicationName": "safetrack", "deviceName": "tracker-01",
+        "devEUI": "a84041000181c061", "rxInfo": RX_INFO, "txInfo": {"frequency": 868100000, "dr": 5},
+        "adr": True, "fCnt": 125, "fPort": 2, "data": DATA_GPS,
+        "object": {"Latitude": 3.8666, "Longitude": 11.5166, "Speed": 30.5},
+    },
+    "v4 binaire FPort 1": {
+        "deduplicationId": "3f1e", "time": "2024-01-01T00:00:00Z",
+        "deviceInfo": {"tenantId": "52f1", "applicationId": "1", "deviceName": "tracker-01",
+                       "devEui": "a84041000181c061", "deviceProfileName": "gps-tracker-profile"},
+        "devAddr": "00e4304d", "adr": True, "dr": 5, "fCnt": 125, "fPort": 1, "confirmed": False,
+        "data": DATA_GPS, "rxInfo": RX_INFO,
+    },
+}
+
+
+# --- Ancienne extraction (telle qu'avant uplink_schema) ---
+
+def get_case_insensitive(d, key):
+    if not d: return None
+    for k, v in d.items():
+        if k.lower() == key.lower():
+            return v
+    return None
+
+
+def legacy_parse(payload):
+    device_info = payload.get("deviceInfo", {})
+    dev_eui = device_info.get("devEui") or payload.get("devEui") or payload.get("devEUI")
+    gps = payload.get("object", {})
+    object_json_str = payload.get("objectJSON")
+    if not gps and object_json_str:
+        gps = json.loads(object_json_str)
+    lat = get_case_insensitive(gps, "latitude") or get_case_insensitive(payload, "latitude")
+    lon = get_case_insensitive(gps, "longitude") or get_case_insensitive(payload, "longitude")
+    relay_status = get_case_insensitive(gps, "relay_status")
+    if relay_status in (None, "unknown", ""):
+        if get_case_insensitive(gps, "relay_cut") is True:
+            relay_status = "cut"
+        elif get_case_insensitive(gps, "relay_active") is True:
+            relay_status = "active"
+    if relay_status not in ("cut", "active") and lat is None:
+        data_b64 = payload.get("data")
+        if data_b64:
+            raw_bytes = base64.b64decode(data_b64)
+            if len(raw_bytes) == 1:
+                relay_status = "cut"
+            elif len(raw_bytes) == 2:
+                relay_status = "active"
+    return {
+        "dev_eui": dev_eui, "lat": lat, "lon": lon, "relay_status": relay_status,
+        "speed": float(get_case_insensitive(gps, "speed") or get_case_insensitive(payload, "speed") or 0.0),
+        "heading": float(get_case_insensitive(gps, "heading") or get_case_insensitive(payload, "heading") or 0.0),
+        "altitude": float(get_case_insensitive(gps, "altitude") or get_case_insensitive(payload, "altitude") or 0.0),
+        "satellites": int(get_case_insensitive(gps, "satellites") or get_case_insensitive(payload, "satellites") or 0),
+        "f_cnt": payload.get("fCnt", 0),
+    }
+
+
+def per_frame_us(func, payload, number):
+    best = min(timeit.repeat(lambda: func(payload), number=number, repeat=5))
+    return best / number * 1e6
+
+
+if __name__ == "__main__":
+    number = int(sys.argv[1]) if len(sys.argv) > 1 else 20000
+    print(f"{'format':<22}{'avant (µs)':>12}{'après (µs)':>12}{'gain':>8}")
+    for name, payload in PAYLOADS.items():
+        before = per_frame_us(legacy_parse, payload, number)
+        after = per_frame_us(parse_uplink, payload, number)
+        print(f"{name:<22}{before:>12.2f}{after:>12.2f}{before / after:>7.1f}x")
+    # L'ancienne extraction ne lit pas la trame binaire : sans codec ChirpStack, pas de position
+    print("Note : 'avant' ne décode pas la trame binaire FPort 1 (lat=None sans codec ChirpStack).")
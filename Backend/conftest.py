@@ -0,0 +1,5 @@
+import os
+
+# Les services importent la configuration : valeurs factices pour les tests hors Docker
+for _var in ("POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB", "SECRET_KEY"):
+    os.environ.setdefault(_var, "test")
@@ -69,10 +69,13 @@ CREATE TABLE vehicule (
     appkey VARCHAR(255),
     statut VARCHAR(20) DEFAULT 'ACTIF',
     moteur_coupe BOOLEAN DEFAULT FALSE,
+    moteur_en_attente BOOLEAN DEFAULT FALSE,
+    moteur_commande_timestamp TIMESTAMP,
     mode_auto BOOLEAN DEFAULT FALSE,
     derniere_position_lat DECIMAL(10,8),
     derniere_position_lon DECIMAL(11,8),
     derniere_communication TIMESTAMP,
+    dernier_fcnt BIGINT, -- Plus grand fCnt reçu (fenêtre anti-doublons)
     id_utilisateur_proprietaire INTEGER,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
@@ -88,9 +91,15 @@ CREATE TABLE vehicule (
 );
 
 CREATE INDEX idx_vehicule_deveui ON vehicule(deveui);
+-- Résolution DevEUI insensible à la casse (webhook ChirpStack)
+CREATE INDEX idx_vehicule_deveui_lower ON vehicule(lower(deveui));
 CREATE INDEX idx_vehicule_immat ON vehicule(immatriculation);
 CREATE INDEX idx_vehicule_statut ON vehicule(statut);
 CREATE INDEX idx_vehicule_user ON vehicule(id_utilisateur_proprietaire);
+-- Balayage des commandes moteur sans confirmation (tâche planifiée)
+CREATE INDEX idx_vehicule_commande_en_attente ON vehicule(moteur_commande_timestamp) WHERE moteur_en_attente;
+-- Bases existantes :
+--   ALTER TABLE vehicule ADD COLUMN IF NOT EXISTS dernier_fcnt BIGINT;
 
 -- ============================================================================
 -- TABLE : zone_securisee
@@ -138,6 +147,8 @@ CREATE TABLE position_gps (
     vitesse DECIMAL(6,2) NOT NULL, -- km/h
     cap DECIMAL(5,2), -- direction (0-360°)
     timestamp_gps TIMESTAMP NOT NULL, -- Horodatage du GPS
+    timestamp_fin TIMESTAMP, -- Arrêt compressé : horodatage du dernier fix identique
+    nb_repetitions INTEGER NOT NULL DEFAULT 1, -- Nombre de fix fusionnés dans la ligne
     fix_status SMALLINT, -- 0=pas de fix, 1=fix GPS
     satellites INTEGER, -- Nombre de satellites
     hdop DECIMAL(4,2), -- Précision horizontale
@@ -147,6 +158,7 @@ CREATE TABLE position_gps (
     id_zone INTEGER, -- Zone de référence utilisée pour le calcul
     batterie_pourcentage INTEGER,
     payload_brut TEXT, -- Payload LoRaWAN brut pour debug
+    f_cnt BIGINT, -- Compteur de trames LoRaWAN (uint32)
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     
     CONSTRAINT fk_position_vehicule
@@ -169,10 +181,60 @@ CREATE TABLE position_gps (
 );
 
 CREATE INDEX idx_position_vehicule ON position_gps(id_vehicule);
+CREATE INDEX idx_position_vehicule_id ON position_gps(id_vehicule, id_position); -- Parcours par id (réévaluation)
 CREATE INDEX idx_position_timestamp ON position_gps(timestamp_gps DESC);
+-- Pagination par curseur de l'historique (timestamp_gps, id_position)
+CREATE INDEX idx_position_vehicule_keyset ON position_gps(id_vehicule, timestamp_gps DESC, id_position DESC);
+CREATE INDEX idx_position_vehicule_fcnt ON position_gps(id_vehicule, f_cnt);
 CREATE INDEX idx_position_statut ON position_gps(statut);
 CREATE INDEX idx_position_dans_zone ON position_gps(dans_zone);
 CREATE INDEX idx_position_created ON position_gps(created_at DESC);
+-- Bases existantes :
+--   ALTER TABLE position_gps ADD COLUMN IF NOT EXISTS timestamp_fin TIMESTAMP;
+--   ALTER TABLE position_gps ADD COLUMN IF NOT EXISTS nb_repetitions INTEGER NOT NULL DEFAULT 1;
+--   ALTER TABLE position_gps ADD COLUMN IF NOT EXISTS fix_status SMALLINT;
+--   ALTER TABLE position_gps ADD COLUMN IF NOT EXISTS f_cnt BIGINT;
+--   CREATE INDEX IF NOT EXISTS idx_position_vehicule_fcnt ON position_gps(id_vehicule, f_cnt);
+
+-- ============================================================================
+-- TABLE : reevaluation_zone
+-- Recalcul de dans_zone / distance_zone_metres après modification d'une zone
+-- (reprise possible depuis dernier_id_position)
+-- ============================================================================
+CREATE TABLE reevaluation_zone (
+    id_reevaluation SERIAL PRIMARY KEY,
+    id_zone INTEGER NOT NULL,
+    id_vehicule INTEGER NOT NULL,
+    statut VARCHAR(20) DEFAULT 'EN_COURS',
+    proprietaire VARCHAR(100), -- Worker qui exécute le job (NULL : à reprendre)
+    dernier_id_position INTEGER NOT NULL DEFAULT 0, -- Point de reprise
+    id_position_max INTEGER NOT NULL, -- Borne haute figée au lancement
+    positions_total INTEGER, -- Compté au démarrage du job
+    positions_traitees INTEGER DEFAULT 0,
+    erreur TEXT,
+    created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+    updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+
+    CONSTRAINT fk_reevaluation_zone
+        FOREIGN KEY (id_zone)
+        REFERENCES zone_securisee(id_zone)
+        ON DELETE CASCADE
+        ON UPDATE CASCADE,
+
+    CONSTRAINT fk_reevaluation_vehicule
+        FOREIGN KEY (id_vehicule)
+        REFERENCES vehicule(id_vehicule)
+        ON DELETE CASCADE
+        ON UPDATE CASCADE,
+
+    CONSTRAINT chk_reevaluation_statut CHECK (statut IN ('EN_COURS', 'TERMINEE', 'ECHOUEE', 'ANNULEE'))
+);
+
+CREATE INDEX idx_reevaluation_zone ON reevaluation_zone(id_zone);
+CREATE INDEX idx_reevaluation_statut ON reevaluation_zone(statut);
+-- Bases existantes :
+--   ALTER TABLE reevaluation_zone ADD COLUMN proprietaire VARCHAR(100);
+--   ALTER TABLE reevaluation_zone ALTER COLUMN positions_total DROP DEFAULT;
 
 -- ============================================================================
 -- TABLE : trajet
@@ -284,6 +346,7 @@ CREATE INDEX idx_alerte_vehicule ON alerte(id_vehicule);
 CREATE INDEX idx_alerte_type ON alerte(type_alerte);
 CREATE INDEX idx_alerte_acquittee ON alerte(acquittee);
 CREATE INDEX idx_alerte_created ON alerte(created_at DESC);
+CREATE INDEX idx_alerte_vehicule_keyset ON alerte(id_vehicule, created_at DESC, id_alerte DESC);
 
 -- ============================================================================
 -- TABLE : commande_downlink
@@ -315,13 +378,24 @@ CREATE TABLE commande_downlink (
         ON DELETE SET NULL
         ON UPDATE CASCADE,
     
-    CONSTRAINT chk_commande_type CHECK (type_commande IN ('COUPER_MOTEUR', 'DEMARRER_MOTEUR', 'DEFINIR_ZONE', 'CHANGER_INTERVALLE')),
-    CONSTRAINT chk_commande_statut CHECK (statut IN ('EN_ATTENTE', 'ENVOYEE', 'CONFIRMEE', 'ECHOUEE'))
+    CONSTRAINT chk_commande_type CHECK (type_commande IN ('COUPER_MOTEUR', 'DEMARRER_MOTEUR', 'DEFINIR_ZONE', 'CHANGER_INTERVALLE', 'MODE_AUTO', 'MODE_MANUEL')),
+    CONSTRAINT chk_commande_statut CHECK (statut IN ('EN_ATTENTE', 'EN_COURS_ENVOI', 'ENVOYEE', 'CONFIRMEE', 'ECHOUEE', 'EXPIREE'))
 );
+-- EN_COURS_ENVOI : commande réservée par un worker, downlink en cours (services/command_service.py).
+-- EXPIREE : jamais envoyée, ou mode AUTO/MANUAL sans accusé, dans COMMAND_CONFIRM_TIMEOUT_SECONDS.
+-- Bases existantes :
+--   ALTER TABLE commande_downlink DROP CONSTRAINT chk_commande_statut;
+--   ALTER TABLE commande_downlink ADD CONSTRAINT chk_commande_statut
+--       CHECK (statut IN ('EN_ATTENTE', 'EN_COURS_ENVOI', 'ENVOYEE', 'CONFIRMEE', 'ECHOUEE', 'EXPIREE'));
+--   DROP INDEX idx_commande_envoyee;
+--   CREATE INDEX idx_commande_envoyee ON commande_downlink(date_envoi) WHERE statut = 'ENVOYEE';
 
 CREATE INDEX idx_commande_vehicule ON commande_downlink(id_vehicule);
 CREATE INDEX idx_commande_statut ON commande_downlink(statut);
 CREATE INDEX idx_commande_created ON commande_downlink(created_at DESC);
+-- File d'envoi et balayage des timeouts : index partiels, seules les commandes en cours y figurent
+CREATE INDEX idx_commande_a_envoyer ON commande_downlink(id_commande) WHERE statut = 'EN_ATTENTE';
+CREATE INDEX idx_commande_envoyee ON commande_downlink(date_envoi) WHERE statut = 'ENVOYEE';
 
 -- ============================================================================
 -- TABLE : uplink_messages
@@ -480,24 +554,12 @@ CREATE TRIGGER update_zone_updated_at
     BEFORE UPDATE ON zone_securisee
     FOR EACH ROW EXECUTE FUNCTION update_updated_at_column();
 
--- Trigger pour mettre à jour la dernière position du véhicule
-CREATE OR REPLACE FUNCTION update_vehicule_derniere_position()
-RETURNS TRIGGER AS $$
-BEGIN
-    UPDATE vehicule
-    SET 
-        derniere_position_lat = NEW.latitude,
-        derniere_position_lon = NEW.longitude,
-        derniere_communication = NEW.created_at
-    WHERE id_vehicule = NEW.id_vehicule;
-    
-    RETURN NEW;
-END;
-$$ LANGUAGE plpgsql;
-
-CREATE TRIGGER trg_update_vehicule_position
-    AFTER INSERT ON position_gps
-    FOR EACH ROW EXECUTE FUNCTION update_vehicule_derniere_position();
+-- La dernière position du véhicule (vehicule.derniere_*) est écrite en différé par le backend
+-- (services/vehicle_state.py). Bases existantes :
+--   DROP TRIGGER IF EXISTS trg_update_vehicule_position ON position_gps;
+--   DROP FUNCTION IF EXISTS update_vehicule_derniere_position();
+--   puis ré-exécuter CREATE OR REPLACE FUNCTION fn_parser_sim808_gps() (plus bas), qui écrit
+--   désormais elle-même la dernière position des trames SIM808
 
 -- Trigger pour créer une alerte lors d'une position HORS_ZONE
 CREATE OR REPLACE FUNCTION create_alerte_hors_zone()
@@ -831,6 +893,15 @@ BEGIN
         COALESCE(NEW.created_at, NOW())
     );
 
+    -- Dernière position du véhicule : ce chemin SQL ne passe pas par le backend
+    -- (services/vehicle_state.py) ; jamais en arrière, comme le flush différé
+    UPDATE vehicule
+    SET derniere_position_lat = v_latitude,
+        derniere_position_lon = v_longitude,
+        derniere_communication = COALESCE(NEW.created_at, NOW())
+    WHERE id_vehicule = v_vehicule_id
+      AND (derniere_communication IS NULL OR derniere_communication < COALESCE(NEW.created_at, NOW()));
+
     -- Marquer comme traité
     NEW.processed := TRUE;
     RAISE NOTICE 'Position GPS créée pour véhicule ID % - Statut: %', v_vehicule_id, v_statut;
@@ -0,0 +1,85 @@
+import base64
+import struct
+import time
+import unittest
+from unittest import mock
+from types import SimpleNamespace
+
+from app.services import admission as admission_module
+from app.services.admission import AdmissionController, Decision, Priority, classify
+from app.services.deveui_resolver import deveui_resolver
+from app.services.uplink_schema import parse_envelope
+
+DEV_EUI = "a84041000181c061"
+
+
+def gps_frame(speed_kmh, dev_eui=DEV_EUI):
+    data = struct.pack(">ffH", 3.8666, 11.5166, int(speed_kmh * 10))
+    return parse_envelope({"devEUI": dev_eui, "fPort": 1, "fCnt": 1, "data": base64.b64encode(data).decode()})
+
+
+def relay_frame():
+    return parse_envelope({"devEUI": DEV_EUI, "fPort": 10, "fCnt": 2, "data": base64.b64encode(b"\x01").decode()})
+
+
+def controller():
+    return AdmissionController(max_inflight=10, routine_share=0.5, routine_sample_seconds=60, retry_after_seconds=5)
+
+
+class TestAdmission(unittest.TestCase):
+
+    def test_classify(self):
+        """Confirmation relais critique, véhicule à l'arrêt routinier, en mouvement normal"""
+        deveui_resolver.refresh(SimpleNamespace(
+            id_vehicule=424301, deveui=DEV_EUI, id_utilisateur_proprietaire=7,
+            mode_auto=False, moteur_coupe=False, moteur_en_attente=False,
+        ))
+        try:
+            self.assertEqual(classify(relay_frame()), Priority.CRITICAL)
+            self.assertEqual(classify(gps_frame(0)), Priority.ROUTINE)
+            self.assertEqual(classify(gps_frame(60)), Priority.NORMAL)
+        finally:
+            deveui_resolver.invalidate(DEV_EUI)
+
+    def test_uncached_vehicle_is_critical(self):
+        """Véhicule absent du cache : mode et zone inconnus, la position n'est jamais délestée"""
+        self.assertEqual(classify(gps_frame(0, "a84041000181c0ff")), Priority.CRITICAL)
+        deveui_resolver._remember_unknown("a84041000181c0ff", time.monotonic())
+        try:
+            self.assertEqual(classify(gps_frame(0, "a84041000181c0ff")), Priority.ROUTINE)  # Non enregistré : ignoré de toute façon
+        finally:
+            deveui_resolver.invalidate("a84041000181c0ff")
+
+    def test_overload_sheds_normal_never_critical(self):
+        """Budget dépassé : 503 pour une position, jamais pour une confirmation relais"""
+        c = controller()
+        c.inflight = 10
+        self.assertEqual(c.admit(gps_frame(60), Priority.NORMAL), Decision.SHED)
+        self.assertEqual(c.admit(relay_frame(), Priority.CRITICAL), Decision.ACCEPT)
+        self.assertEqual(c.stats()["shed"], 1)
+
+    def test_routine_sampled_under_load(self):
+        """Au-delà de la part routinière : une position à l'arrêt par véhicule et par minute"""
+        c = controller()
+        c.inflight = 6
+        self.assertEqual(c.admit(gps_frame(0), Priority.ROUTINE), Decision.ACCEPT)
+        self.assertEqual(c.admit(gps_frame(0), Priority.ROUTINE), Decision.SAMPLE_OUT)
+        self.assertEqual(c.admit(gps_frame(0, "a84041000181c062"), Priority.ROUTINE), Decision.ACCEPT)
+        self.assertEqual(c.admit(gps_frame(60), Priority.NORMAL), Decision.ACCEPT)
+
+    def test_routine_samples_pruned(self):
+        """Les échantillons plus vieux que l'intervalle sont oubliés : la table ne grossit pas sans fin"""
+        c = controller()
+        c.inflight = 6
+        now = time.monotonic()
+        for n in range(3):
+            c.admit(gps_frame(0, f"a8404100ffff10{n:02x}"), Priority.ROUTINE)
+        self.assertEqual(c.stats()["routine_devices"], 3)
+        later = now + 61
+        with mock.patch.object(admission_module.time, "monotonic", return_value=later):
+            self.assertEqual(c.admit(gps_frame(0), Priority.ROUTINE), Decision.ACCEPT)
+        self.assertEqual(c.stats()["routine_devices"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import random
+import struct
+import unittest
+
+from app.services import codecs
+
+
+def trame_gps(lat, lon, vitesse_kmh):
+    """Trame FPort 1 telle qu'envoyée par safetrack_auto (10 octets Big Endian)"""
+    return struct.pack(">ffH", lat, lon, int(vitesse_kmh * 10))
+
+
+class TestCodecs(unittest.TestCase):
+
+    def test_gps_frame(self):
+        """Décodage de la trame GPS de 10 octets"""
+        obj = codecs.decode(codecs.FPORT_GPS, trame_gps(3.8666, 11.5166, 30.5))
+        self.assertAlmostEqual(obj["latitude"], 3.8666, places=5)
+        self.assertAlmostEqual(obj["longitude"], 11.5166, places=5)
+        self.assertEqual(obj["speed"], 30.5)
+
+    def test_relay_frames(self):
+        """Accusés de réception du relais sur le FPort 10"""
+        self.assertEqual(codecs.decode(codecs.FPORT_RELAY, b"\x00"), {"relay_status": "cut"})
+        self.assertEqual(codecs.decode(codecs.FPORT_RELAY, b"\x00\x00"), {"relay_status": "active"})
+        self.assertIsNone(codecs.decode(codecs.FPORT_RELAY, b"\x00\x00\x00"))
+
+    def test_unknown_or_malformed(self):
+        """FPort inconnu ou trame tronquée : rien n'est décodé"""
+        self.assertIsNone(codecs.decode(42, trame_gps(1, 2, 3)))
+        self.assertIsNone(codecs.decode(None, trame_gps(1, 2, 3)))
+        self.assertIsNone(codecs.decode(codecs.FPORT_GPS, trame_gps(1, 2, 3)[:7]))
+
+    def test_multi_fix_frame(self):
+        """Trame multi-positions : la dernière position est la position courante"""
+        data = trame_gps(3.80, 11.50, 10) + trame_gps(3.81, 11.51, 20) + trame_gps(3.82, 11.52, 30)
+        obj = codecs.decode(codecs.FPORT_GPS, data)
+        self.assertEqual(len(obj["fixes"]), 3)
+        self.assertAlmostEqual(obj["latitude"], 3.82, places=5)
+        self.assertEqual(obj["speed"], 30.0)
+
+    def test_batch_matches_scalar(self):
+        """Le décodage par lot (NumPy) donne exactement les mêmes valeurs que le décodage unitaire"""
+        rng = random.Random(42)
+        frames = []
+        for _ in range(3000):
+            kind = rng.random()
+            if kind < 0.8:
+                frames.append((codecs.FPORT_GPS, trame_gps(rng.uniform(-90, 90), rng.uniform(-180, 180), rng.uniform(0, 200))))
+            elif kind < 0.9:
+                frames.append((codecs.FPORT_RELAY, b"\x00" * rng.choice([1, 2])))
+            else:
+                frames.append((rng.choice([None, 2, codecs.FPORT_GPS]), bytes(rng.randrange(0, 15))))
+
+        self.assertEqual(codecs.decode_many(frames), [codecs.decode(fport, data) for fport, data in frames])
+
+
+if __name__ == '__main__':
+    unittest.main()
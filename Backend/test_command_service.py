@@ -0,0 +1,167 @@
+import asyncio
+import base64
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from app.models.command import CommandStatus, CommandType
+from app.services import command_service
+from app.services.command_service import _RECORD_STATEMENT, CommandWorker, enqueue_command, expire_timed_out_commands
+from test_vehicle_state import row
+
+
+class FakeSession:
+    """
+    Session enregistrant les requêtes. `returning` donne, par table, les lignes renvoyées
+    par un UPDATE … RETURNING (command.all(), ou vehicle.scalars().all()).
+    """
+
+    def __init__(self, returning=None):
+        self.returning = returning or {}
+        self.statements = []
+        self.added = []
+        self.commits = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def add(self, obj):
+        self.added.append(obj)
+
+    async def execute(self, statement, params=None):
+        self.statements.append((statement, params))
+        rows = self.returning.get(getattr(getattr(statement, "table", None), "name", None), [])
+        return SimpleNamespace(rowcount=len(rows), all=lambda: list(rows), scalars=lambda: SimpleNamespace(all=lambda: list(rows)))
+
+    async def scalars(self, statement, params=None):
+        self.statements.append((statement, params))
+        return SimpleNamespace(all=lambda: [SimpleNamespace(id_alerte=i, **p) for i, p in enumerate(params or [])])
+
+    async def commit(self):
+        self.commits += 1
+
+
+def sessions(*fakes):
+    """Remplace SessionLocal : chaque `async with SessionLocal()` reçoit la session suivante."""
+    return mock.patch.object(command_service, "SessionLocal", side_effect=list(fakes))
+
+
+def transition(statement) -> tuple:
+    """(table, statut(s) visés par le WHERE, statut écrit) d'un UPDATE."""
+    params = statement.compile(dialect=postgresql.dialect()).params
+    return statement.table.name, params.get("statut_1"), params.get("statut")
+
+
+def claimed(command_id, vehicle_id, command_type, deveui="a84041000181c061"):
+    return SimpleNamespace(id_commande=command_id, id_vehicule=vehicle_id, type_commande=command_type.value, deveui=deveui)
+
+
+class TestCommandService(unittest.TestCase):
+
+    def test_enqueue_adds_pending_command(self):
+        """enqueue_command : commande EN_ATTENTE ajoutée à la session, commit laissé à l'appelant"""
+        db = FakeSession()
+        command = enqueue_command(db, 3, CommandType.COUPER_MOTEUR, user_id=7)
+        self.assertEqual(db.added, [command])
+        self.assertEqual(
+            (command.id_vehicule, command.type_commande, command.statut, command.id_utilisateur_emetteur),
+            (3, "COUPER_MOTEUR", CommandStatus.EN_ATTENTE.value, 7),
+        )
+        self.assertEqual(db.commits, 0)
+
+    def test_dispatch_claims_then_sends_then_records(self):
+        """Réservation commitée avant l'envoi, résultats écrits dans une seconde transaction"""
+        claim = FakeSession({"commande_downlink": [
+            claimed(12, 1, CommandType.DEMARRER_MOTEUR),
+            claimed(11, 1, CommandType.COUPER_MOTEUR),
+            claimed(13, 2, CommandType.MODE_AUTO, deveui=None),  # Boîtier retiré depuis
+        ]})
+        record = FakeSession()
+        sent = []
+
+        async def send_downlink(deveui, payload, f_port):
+            self.assertEqual(claim.commits, 1)  # Aucune transaction ouverte pendant le downlink
+            sent.append(base64.b64decode(payload).decode())
+            return True
+
+        with sessions(claim, record), mock.patch.object(command_service, "send_downlink", send_downlink):
+            handled = asyncio.run(CommandWorker(poll_interval=1, batch_size=10).dispatch_pending())
+
+        self.assertEqual(handled, 3)
+        self.assertEqual(transition(claim.statements[0][0]), ("commande_downlink", "EN_ATTENTE", "EN_COURS_ENVOI"))
+        self.assertEqual(sent, ["STOP", "START"])  # Ordre de la file, pas celui du RETURNING
+        statement, outcomes = record.statements[0]
+        self.assertIs(statement, _RECORD_STATEMENT)
+        self.assertEqual(
+            [(o["command_id"], o["statut"]) for o in outcomes],
+            [(11, "ENVOYEE"), (12, "ENVOYEE"), (13, "ECHOUEE")],
+        )
+        self.assertEqual(record.commits, 1)
+
+    def test_failed_engine_command_clears_pending_vehicle(self):
+        """STOP refusé par ChirpStack : le véhicule sort de l'attente tout de suite"""
+        claim = FakeSession({"commande_downlink": [claimed(21, 5, CommandType.COUPER_MOTEUR)]})
+        vehicle = row(5, owner=None)
+        record = FakeSession({"vehicule": [vehicle]})
+
+        async def refused(deveui, payload, f_port):
+            return False
+
+        with sessions(claim, record), mock.patch.object(command_service, "send_downlink", refused), \
+                mock.patch.object(command_service.deveui_resolver, "refresh") as resolver_refresh, \
+                mock.patch.object(command_service.vehicle_state, "refresh"):
+            asyncio.run(CommandWorker(poll_interval=1, batch_size=10).dispatch_pending())
+
+        self.assertEqual(record.statements[0][1][0]["statut"], "ECHOUEE")
+        self.assertEqual(transition(record.statements[1][0])[0], "vehicule")
+        resolver_refresh.assert_called_once_with(vehicle)
+
+    def test_dispatch_nothing_pending(self):
+        """File vide : une seule requête, aucun envoi"""
+        claim = FakeSession()
+        with sessions(claim):
+            self.assertEqual(asyncio.run(CommandWorker(poll_interval=1, batch_size=10).dispatch_pending()), 0)
+        self.assertEqual(len(claim.statements), 1)
+
+    def test_timeout_sweep_transitions(self):
+        """Balayage sans véhicule en attente : chaque statut périmé passe à son état terminal"""
+        db = FakeSession()
+        with sessions(db):
+            asyncio.run(expire_timed_out_commands())
+        self.assertEqual([transition(statement) for statement, _ in db.statements], [
+            ("commande_downlink", "EN_COURS_ENVOI", "EN_ATTENTE"),  # Réservée par un worker arrêté
+            ("vehicule", None, None),                               # moteur_en_attente remis à zéro
+            ("commande_downlink", "ENVOYEE", "EXPIREE"),           # AUTO/MANUAL jamais transmis
+            ("commande_downlink", "EN_ATTENTE", "EXPIREE"),        # Jamais envoyée
+            ("commande_downlink", "ENVOYEE", "ECHOUEE"),           # STOP/START sans confirmation
+        ])
+        self.assertEqual(db.commits, 1)
+
+    def test_timeout_sweep_alerts_pending_vehicles(self):
+        """Véhicule en attente expiré : commandes moteur en échec, une alerte, caches et propriétaire notifiés"""
+        vehicle = row(5, owner=7)
+        db = FakeSession({"vehicule": [vehicle]})
+        with sessions(db), mock.patch.object(command_service, "manager") as manager, \
+                mock.patch.object(command_service.deveui_resolver, "refresh") as resolver_refresh, \
+                mock.patch.object(command_service.vehicle_state, "refresh") as state_refresh:
+            manager.send_personal_message = mock.AsyncMock()
+            asyncio.run(expire_timed_out_commands())
+
+        engine_failed = db.statements[5][0]
+        self.assertEqual(transition(engine_failed), ("commande_downlink", "ENVOYEE", "ECHOUEE"))
+        self.assertEqual(engine_failed.compile().params["id_vehicule_1"], [5])
+        alerts = db.statements[6][1]
+        self.assertEqual([(a["id_vehicule"], a["type_alerte"]) for a in alerts], [(5, "MOTEUR_COUPE")])
+        resolver_refresh.assert_called_once_with(vehicle)
+        state_refresh.assert_called_once_with(vehicle)
+        message, user_id = manager.send_personal_message.call_args.args
+        self.assertEqual((message["type"], user_id), ("NEW_ALERT", 7))
+
+
+if __name__ == "__main__":
+    unittest.main()
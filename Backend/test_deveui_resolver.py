@@ -0,0 +1,95 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from app.services import deveui_resolver as resolver_module
+from app.services.deveui_resolver import DevEuiResolver
+
+
+def vehicle(deveui="a84041000181c061", mode_auto=False):
+    return SimpleNamespace(
+        id_vehicule=1, deveui=deveui, id_utilisateur_proprietaire=7,
+        mode_auto=mode_auto, moteur_coupe=False, moteur_en_attente=False,
+    )
+
+
+class FakeSession:
+    """Session dont chaque SELECT renvoie `rows` (la table vehicule vue par un autre worker)."""
+
+    def __init__(self, rows):
+        self.rows = rows
+        self.queries = 0
+
+    async def execute(self, *args, **kwargs):
+        self.queries += 1
+        return SimpleNamespace(all=lambda: list(self.rows))
+
+
+class TestDevEuiResolver(unittest.TestCase):
+
+    def test_known_vehicle_served_from_cache(self):
+        """Véhicule connu : pas de requête tant que son entrée n'a pas expiré, quelle que soit la casse"""
+        resolver = DevEuiResolver(ttl=60, negative_ttl=60)
+        db = FakeSession([vehicle()])
+        first = asyncio.run(resolver.resolve("A84041000181C061", db))
+        self.assertIs(asyncio.run(resolver.resolve("a84041000181c061", db)), first)
+        self.assertEqual(db.queries, 1)
+
+    def test_misses_resolved_in_one_query(self):
+        """Lot de DevEUI : une seule requête pour tous les absents du cache, les inconnus renvoient None"""
+        resolver = DevEuiResolver(ttl=60, negative_ttl=60)
+        db = FakeSession([vehicle(), vehicle("a84041000181c062")])
+        resolved = asyncio.run(resolver.resolve_many(["A84041000181C061", "a84041000181c062", "a8404100ffffffff"], db))
+        self.assertEqual(db.queries, 1)
+        self.assertEqual(resolved["a84041000181c062"].deveui, "a84041000181c062")
+        self.assertIsNone(resolved["a8404100ffffffff"])
+
+    def test_unknown_device_does_not_hit_db(self):
+        """DevEUI inconnu : mémorisé, ses trames suivantes ne déclenchent pas de requête"""
+        resolver = DevEuiResolver(ttl=60, negative_ttl=60)
+        db = FakeSession([])
+        for _ in range(3):
+            self.assertIsNone(asyncio.run(resolver.resolve("a8404100ffffffff", db)))
+        self.assertEqual(db.queries, 1)
+        self.assertEqual(resolver.stats()["negative_hits"], 2)
+
+    def test_refresh_and_invalidate(self):
+        """Modification d'un véhicule : snapshot mis à jour sur place ; suppression : entrée oubliée"""
+        resolver = DevEuiResolver(ttl=60, negative_ttl=60)
+        db = FakeSession([vehicle()])
+        snapshot = asyncio.run(resolver.resolve("a84041000181c061", db))
+        resolver.refresh(vehicle(mode_auto=True))
+        self.assertTrue(snapshot.mode_auto)
+        resolver.invalidate("A84041000181C061")
+        self.assertIsNone(resolver.peek("a84041000181c061"))
+        asyncio.run(resolver.resolve("a84041000181c061", db))
+        self.assertEqual(db.queries, 2)
+
+    def test_expired_entry_reloaded_in_place(self):
+        """Entrée expirée : rechargée depuis la base, le snapshot déjà détenu voit le changement"""
+        resolver = DevEuiResolver(ttl=60, negative_ttl=60)
+        db = FakeSession([vehicle()])
+        snapshot = asyncio.run(resolver.resolve("a84041000181c061", db))
+        db.rows = [vehicle(mode_auto=True)]  # Modifié par un autre worker
+        later = resolver_module.time.monotonic() + 61
+        with mock.patch.object(resolver_module.time, "monotonic", return_value=later):
+            self.assertIs(asyncio.run(resolver.resolve("a84041000181c061", db)), snapshot)
+        self.assertTrue(snapshot.mode_auto)
+        self.assertEqual(db.queries, 2)
+
+    def test_expired_entry_of_deleted_vehicle_dropped(self):
+        """Véhicule supprimé ailleurs : à l'expiration, le DevEUI devient inconnu"""
+        resolver = DevEuiResolver(ttl=60, negative_ttl=60)
+        db = FakeSession([vehicle()])
+        asyncio.run(resolver.resolve("a84041000181c061", db))
+        db.rows = []
+        later = resolver_module.time.monotonic() + 61
+        with mock.patch.object(resolver_module.time, "monotonic", return_value=later):
+            self.assertIsNone(asyncio.run(resolver.resolve("a84041000181c061", db)))
+        self.assertEqual(resolver.stats()["cached_vehicles"], 0)
+        self.assertEqual(resolver.stats()["cached_unknown"], 1)
+
+
+if __name__ == "__main__":
+    unittest.main()
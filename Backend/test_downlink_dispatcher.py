@@ -0,0 +1,78 @@
+import asyncio
+import unittest
+
+from app.services.downlink_dispatcher import DownlinkDispatcher, DownlinkError
+
+
+class RecordingSender:
+    """Sender ChirpStack factice : note les envois acceptés, échoue `failures[data]` fois d'abord."""
+
+    def __init__(self, failures=None, retryable=True):
+        self.failures = dict(failures or {})
+        self.retryable = retryable
+        self.sent = []
+
+    async def __call__(self, dev_eui, data, f_port):
+        await asyncio.sleep(0)
+        if self.failures.get(data):
+            self.failures[data] -= 1
+            raise DownlinkError("503", retryable=self.retryable)
+        self.sent.append((dev_eui, data))
+
+
+def dispatcher(sender, max_attempts=3):
+    return DownlinkDispatcher(sender, concurrency=4, max_attempts=max_attempts, backoff_seconds=0.01)
+
+
+class TestDownlinkDispatcher(unittest.TestCase):
+
+    def test_device_order_kept_through_retry(self):
+        """Un downlink en backoff n'est pas doublé par le suivant du même boîtier"""
+        sender = RecordingSender(failures={"CUT": 1})
+        d = dispatcher(sender)
+        results = asyncio.run(d.send_many([
+            ("A84041000181C061", "CUT", 10),
+            ("a84041000181c061", "RESTORE", 10),
+            ("a84041000181c062", "OTHER", 10),
+        ]))
+        self.assertEqual(results, [True, True, True])
+        same_device = [data for dev_eui, data in sender.sent if dev_eui.lower() == "a84041000181c061"]
+        self.assertEqual(same_device, ["CUT", "RESTORE"])
+        # L'autre boîtier n'attend pas le backoff du premier
+        self.assertEqual(sender.sent[0], ("a84041000181c062", "OTHER"))
+        self.assertEqual(d.stats()["retried"], 1)
+
+    def test_idle_devices_pruned(self):
+        """Une fois leurs downlinks terminés, les boîtiers ne restent pas dans la table"""
+        d = dispatcher(RecordingSender())
+        asyncio.run(d.send_many([(f"a8404100{i:08x}", "PING", 10) for i in range(50)]))
+        self.assertEqual(d.stats()["devices_in_flight"], 0)
+
+    def test_cancelled_send_keeps_order(self):
+        """Downlink annulé pendant son attente : le suivant attend toujours le précédent"""
+        sender = RecordingSender(failures={"FIRST": 1})
+        d = dispatcher(sender)
+
+        async def scenario():
+            first = asyncio.create_task(d.send("a84041000181c061", "FIRST"))
+            second = asyncio.create_task(d.send("a84041000181c061", "SECOND"))
+            await asyncio.sleep(0)
+            third = asyncio.create_task(d.send("a84041000181c061", "THIRD"))
+            await asyncio.sleep(0)
+            second.cancel()
+            await asyncio.gather(first, second, third, return_exceptions=True)
+
+        asyncio.run(scenario())
+        self.assertEqual([data for _, data in sender.sent], ["FIRST", "THIRD"])
+        self.assertEqual(d.stats()["devices_in_flight"], 0)
+
+    def test_non_retryable_error_fails_fast(self):
+        """Erreur 4xx : pas de nouvel essai"""
+        sender = RecordingSender(failures={"BAD": 5}, retryable=False)
+        d = dispatcher(sender)
+        self.assertFalse(asyncio.run(d.send("a84041000181c061", "BAD")))
+        self.assertEqual((d.stats()["failed"], d.stats()["retried"]), (1, 0))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+
+from app.services.fcnt_window import FcntWindow
+
+DEV_EUI = "A84041000181C061"
+
+
+class TestFcntWindow(unittest.TestCase):
+
+    def test_duplicate_rejected(self):
+        """Même trame reçue deux fois (plusieurs passerelles, retry HTTP) : la seconde est ignorée"""
+        w = FcntWindow(size=64, reset_threshold=16)
+        self.assertIsNone(w.check(DEV_EUI, 100))
+        self.assertEqual(w.check(DEV_EUI.lower(), 100), "duplicate")
+        self.assertEqual(w.stats()["duplicates"], 1)
+
+    def test_out_of_order_accepted_once(self):
+        """Trame en retard dans la fenêtre : acceptée une fois, puis doublon"""
+        w = FcntWindow(size=64, reset_threshold=16)
+        for f_cnt in (100, 102, 103):
+            self.assertIsNone(w.check(DEV_EUI, f_cnt))
+        self.assertIsNone(w.check(DEV_EUI, 101))
+        self.assertEqual(w.check(DEV_EUI, 101), "duplicate")
+        self.assertEqual(w.highest(DEV_EUI), 103)
+
+    def test_replay_and_counter_reset(self):
+        """Trame trop ancienne rejetée ; petit fCnt après redémarrage du boîtier accepté"""
+        w = FcntWindow(size=64, reset_threshold=16)
+        w.check(DEV_EUI, 1000)
+        self.assertEqual(w.check(DEV_EUI, 500), "replay")
+        self.assertIsNone(w.check(DEV_EUI, 0))
+        self.assertIsNone(w.check(DEV_EUI, 1))
+        self.assertEqual(w.highest(DEV_EUI), 1)
+        self.assertEqual(w.stats()["resets"], 1)
+
+    def test_release_lets_retry_through(self):
+        """Trame non enregistrée (erreur DB) : le retry de ChirpStack est accepté"""
+        w = FcntWindow(size=64, reset_threshold=16)
+        w.check(DEV_EUI, 7)
+        w.release(DEV_EUI, 7)
+        self.assertIsNone(w.check(DEV_EUI, 7))
+
+    def test_missing_fcnt_not_filtered(self):
+        """Sans fCnt dans le payload, aucune déduplication possible"""
+        w = FcntWindow(size=64, reset_threshold=16)
+        self.assertIsNone(w.check(DEV_EUI, None))
+        self.assertIsNone(w.check(DEV_EUI, None))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,147 @@
+import asyncio
+import random
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from app.services import geofencing_service
+from app.services.geofencing_service import (
+    CompiledZone,
+    GeofenceIndex,
+    check_points_batch,
+    is_point_in_circle,
+    is_point_in_polygon,
+)
+
+
+def make_zone(**kwargs):
+    zone = dict(id_zone=1, type="CIRCLE", latitude_centre=0.0, longitude_centre=0.0,
+                rayon_metres=1, coordinates=None)
+    zone.update(kwargs)
+    return SimpleNamespace(**zone)
+
+
+class TestGeofencingBatch(unittest.TestCase):
+
+    def setUp(self):
+        self.rng = random.Random(42)
+
+    def test_circle_matches_scalar(self):
+        """Le calcul vectorisé donne les mêmes réponses que is_point_in_circle"""
+        zone = make_zone(latitude_centre=3.8666, longitude_centre=11.5166, rayon_metres=500)
+        lats = [3.8666 + self.rng.uniform(-0.01, 0.01) for _ in range(2000)]
+        lons = [11.5166 + self.rng.uniform(-0.01, 0.01) for _ in range(2000)]
+
+        inside, distance = check_points_batch(zone, lats, lons)
+
+        expected = [is_point_in_circle(la, lo, 3.8666, 11.5166, 500) for la, lo in zip(lats, lons)]
+        self.assertEqual(inside.tolist(), expected)
+        self.assertTrue((distance >= 0).all())
+
+    def test_circle_distance_to_boundary(self):
+        """Au centre du cercle, la distance à la frontière vaut le rayon"""
+        zone = make_zone(latitude_centre=3.8666, longitude_centre=11.5166, rayon_metres=500)
+        inside, distance = check_points_batch(zone, [3.8666], [11.5166])
+        self.assertTrue(inside[0])
+        self.assertAlmostEqual(distance[0], 500.0, places=3)
+
+    def test_polygon_matches_scalar(self):
+        """Le ray casting vectorisé donne les mêmes réponses que is_point_in_polygon"""
+        coordinates = [
+            {"lat": 3.86, "lng": 11.50},
+            {"lat": 3.88, "lng": 11.51},
+            {"lat": 3.87, "lng": 11.53},
+            {"lat": 3.875, "lng": 11.52},
+            {"lat": 3.85, "lng": 11.52},
+        ]
+        zone = make_zone(type="POLYGON", coordinates=coordinates)
+        lats = [self.rng.uniform(3.84, 3.89) for _ in range(2000)]
+        lons = [self.rng.uniform(11.49, 11.54) for _ in range(2000)]
+
+        inside, distance = check_points_batch(zone, lats, lons)
+
+        expected = [is_point_in_polygon(la, lo, coordinates) for la, lo in zip(lats, lons)]
+        self.assertEqual(inside.tolist(), expected)
+        self.assertTrue((distance >= 0).all())
+
+    def test_polygon_distance_to_edge(self):
+        """Distance d'un point au bord d'un carré ~ 0.001° de latitude (≈111 m)"""
+        coordinates = [
+            {"lat": 0.0, "lng": 0.0},
+            {"lat": 0.0, "lng": 0.01},
+            {"lat": 0.01, "lng": 0.01},
+            {"lat": 0.01, "lng": 0.0},
+        ]
+        zone = make_zone(type="POLYGON", coordinates=coordinates)
+        inside, distance = check_points_batch(zone, [0.001], [0.005])
+        self.assertTrue(inside[0])
+        self.assertAlmostEqual(distance[0], 111.19, delta=0.5)
+
+    def test_degenerate_polygon_is_inside(self):
+        """Polygone invalide (< 3 points) : considéré 'dans la zone' comme en scalaire"""
+        zone = make_zone(type="POLYGON", coordinates=[{"lat": 0.0, "lng": 0.0}])
+        inside, _ = check_points_batch(zone, [10.0, -10.0], [10.0, -10.0])
+        self.assertEqual(inside.tolist(), [True, True])
+
+class ZoneSession:
+    """Session renvoyant `zone` pour la zone active du véhicule ; `during` est appelé pendant la requête."""
+
+    def __init__(self, zone, during=None):
+        self.zone = zone
+        self.during = during
+        self.queries = 0
+
+    async def execute(self, *args, **kwargs):
+        self.queries += 1
+        if self.during:
+            self.during()
+        return SimpleNamespace(scalars=lambda: SimpleNamespace(first=lambda: self.zone))
+
+
+class TestGeofenceIndex(unittest.TestCase):
+
+    def test_zone_compiled_once(self):
+        """Zone compilée au premier appel puis servie depuis le cache, absence de zone comprise"""
+        index = GeofenceIndex(ttl=60)
+        db = ZoneSession(make_zone(rayon_metres=500))
+        first = asyncio.run(index.get(1, db))
+        self.assertIsInstance(first, CompiledZone)
+        self.assertIs(asyncio.run(index.get(1, db)), first)
+        none_db = ZoneSession(None)
+        self.assertIsNone(asyncio.run(index.get(2, none_db)))
+        self.assertIsNone(asyncio.run(index.get(2, none_db)))
+        self.assertEqual((db.queries, none_db.queries), (1, 1))
+        self.assertEqual(index.stats(), {"cached_vehicles": 2, "hits": 2, "misses": 2})
+
+    def test_invalidate_reloads(self):
+        """Zone modifiée (geofences.py) : l'entrée est invalidée et rechargée"""
+        index = GeofenceIndex(ttl=60)
+        db = ZoneSession(make_zone(rayon_metres=500))
+        asyncio.run(index.get(1, db))
+        index.invalidate(1)
+        index.invalidate(None)  # Zone sans véhicule : rien à invalider
+        self.assertEqual(index.peek(1), (False, None))
+        asyncio.run(index.get(1, db))
+        self.assertEqual(db.queries, 2)
+
+    def test_invalidation_during_load_not_cached(self):
+        """Invalidation pendant le chargement : l'ancienne zone lue n'est pas mise en cache"""
+        index = GeofenceIndex(ttl=60)
+        db = ZoneSession(make_zone(rayon_metres=500), during=lambda: index.invalidate(1))
+        self.assertIsNotNone(asyncio.run(index.get(1, db)))
+        self.assertEqual(index.peek(1), (False, None))
+
+    def test_entry_expires(self):
+        """Entrée plus vieille que le TTL (modification par un autre worker) : rechargée"""
+        index = GeofenceIndex(ttl=60)
+        db = ZoneSession(make_zone(rayon_metres=500))
+        asyncio.run(index.get(1, db))
+        later = geofencing_service.time.monotonic() + 61
+        with mock.patch.object(geofencing_service.time, "monotonic", return_value=later):
+            asyncio.run(index.get(1, db))
+        self.assertEqual(db.queries, 2)
+        self.assertTrue(index.peek(1)[0])
+
+
+if __name__ == '__main__':
+    unittest.main(verbosity=2)
@@ -0,0 +1,60 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app.services.gps_quality import GpsQualityFilter
+from app.services.ingestion import flagged_position_values
+from app.services.uplink_schema import decode_frame, parse_envelope
+
+T0 = datetime(2024, 1, 1, 8, 0)
+
+
+def gps_filter():
+    return GpsQualityFilter(
+        "drop", max_implied_speed_kmh=300.0, jump_tolerance_m=100.0,
+        min_satellites=4, max_hdop=10.0, max_consecutive_rejects=3,
+    )
+
+
+class TestGpsQuality(unittest.TestCase):
+
+    def test_static_checks(self):
+        """0,0, coordonnées hors bornes, vitesse > 500 km/h, satellites et HDOP"""
+        f = gps_filter()
+        self.assertEqual(f.check(1, 0.0, 0.0, T0), "null_island")
+        self.assertEqual(f.check(1, 95.0, 11.5, T0), "out_of_range")
+        self.assertEqual(f.check(1, 3.86, 11.51, T0, speed=650.0), "reported_speed")
+        self.assertEqual(f.check(1, 3.86, 11.51, T0, satellites=2), "satellites")
+        self.assertEqual(f.check(1, 3.86, 11.51, T0, hdop=25.0), "hdop")
+        self.assertIsNone(f.check(1, 3.86, 11.51, T0, satellites=0))  # non transmis
+        self.assertEqual(f.stats()["rejected"]["null_island"], 1)
+
+    def test_teleport_rejected(self):
+        """Saut de ~50 km en 30 s rejeté, le trajet normal continue depuis le dernier bon fix"""
+        f = gps_filter()
+        self.assertIsNone(f.check(1, 3.8666, 11.5166, T0))
+        self.assertEqual(f.check(1, 4.3, 11.5166, T0 + timedelta(seconds=30)), "implied_speed")
+        self.assertIsNone(f.check(1, 3.8676, 11.5166, T0 + timedelta(seconds=60)))  # ~110 m en 60 s
+
+    def test_gps_jitter_accepted(self):
+        """Petite dérive GPS à l'arrêt : sous la tolérance de saut, jamais rejetée"""
+        f = gps_filter()
+        f.check(1, 3.8666, 11.5166, T0)
+        self.assertIsNone(f.check(1, 3.8670, 11.5166, T0))
+
+    def test_persistent_jump_becomes_reference(self):
+        """Véhicule déplacé boîtier éteint : après N rejets consécutifs la nouvelle position est adoptée"""
+        f = gps_filter()
+        f.check(1, 3.8666, 11.5166, T0)
+        results = [f.check(1, 4.05, 9.70, T0 + timedelta(seconds=30 * i)) for i in range(1, 6)]
+        self.assertEqual(results, ["implied_speed"] * 3 + [None, None])
+
+    def test_flagged_row_ignored_by_triggers(self):
+        """Fix rejeté stocké (flag) : fix_status=0 et statut neutre, ni trajet ni arrêt créé par les triggers"""
+        frame = decode_frame(parse_envelope({"devEUI": "a84041000181c061", "fPort": 1, "fCnt": 3, "object": {"speed": 650}}))
+        values = flagged_position_values(1, frame, 95.0, 11.5, T0)
+        self.assertEqual((values["fix_status"], values["statut"]), (0, "OK"))
+        self.assertEqual((values["latitude"], values["vitesse"]), (90.0, 500.0))
+
+
+if __name__ == "__main__":
+    unittest.main()
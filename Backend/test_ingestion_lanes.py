@@ -0,0 +1,180 @@
+import asyncio
+import unittest
+from unittest import mock
+from collections import Counter
+
+from app.services import ingestion
+from app.services.deveui_resolver import deveui_resolver
+from app.services.fcnt_window import fcnt_window
+from app.services.ingestion import UplinkBatcher, lane_of, process_uplink, process_uplink_batch
+from app.services.stationary import stationary
+from app.services.uplink_schema import parse_envelope
+
+
+class FailingSession:
+    """Session dont chaque requête échoue (base indisponible)."""
+
+    async def execute(self, *args, **kwargs):
+        raise ConnectionError("base indisponible")
+
+    async def commit(self):
+        raise ConnectionError("base indisponible")
+
+
+class TestIngestionLanes(unittest.TestCase):
+
+    def test_lane_is_stable(self):
+        """Un boîtier tombe toujours sur la même file, quelle que soit la casse du DevEUI"""
+        self.assertEqual(lane_of("A84041000181C061", 8), lane_of("a84041000181c061", 8))
+        # crc32 : même valeur d'un processus à l'autre (contrairement à hash())
+        self.assertEqual(lane_of("a84041000181c061", 8), lane_of("a84041000181c061", 8))
+
+    def test_lanes_are_balanced(self):
+        """Les DevEUI d'une flotte se répartissent sur toutes les files"""
+        counts = Counter(lane_of(f"a8404100{i:08x}", 4) for i in range(4000))
+        self.assertEqual(set(counts), {0, 1, 2, 3})
+        self.assertLess(max(counts.values()) - min(counts.values()), 200)
+
+    def test_inline_lock_per_device(self):
+        """Mode sync : les trames d'un boîtier se suivent, celles d'autres boîtiers de la même file passent"""
+        batcher = UplinkBatcher(batch_size=10, max_wait_ms=10, maxsize=100, lanes=1)
+        order = []
+
+        async def process(dev_eui, n, hold):
+            async with batcher.lock(dev_eui):
+                order.append((dev_eui, n))
+                await hold.wait()
+
+        async def scenario():
+            hold, free = asyncio.Event(), asyncio.Event()
+            free.set()
+            first = asyncio.create_task(process("A84041000181C061", 1, hold))
+            second = asyncio.create_task(process("a84041000181c061", 2, free))
+            other = asyncio.create_task(process("a84041000181c062", 1, free))
+            await asyncio.sleep(0.01)
+            self.assertEqual(order, [("A84041000181C061", 1), ("a84041000181c062", 1)])
+            hold.set()
+            await asyncio.gather(first, second, other)
+            self.assertEqual(order[-1], ("a84041000181c061", 2))
+            self.assertEqual(batcher.stats()["inline_devices"], 0)  # Verrous libérés une fois inactifs
+        asyncio.run(scenario())
+
+    def test_frames_flushed_in_micro_batches(self):
+        """Mode batched : les trames d'une file partent en un seul lot, dans l'ordre, et l'émetteur est prévenu"""
+        batcher = UplinkBatcher(batch_size=10, max_wait_ms=10, maxsize=100, lanes=1)
+        batches = []
+
+        async def batch(frames, db):
+            batches.append([frame.f_cnt for frame in frames])
+            return len(frames)
+
+        async def scenario():
+            batcher.start()
+            for n in (1, 2):
+                self.assertTrue(batcher.submit(parse_envelope({"devEUI": "a8404100ffff0005", "fPort": 1, "fCnt": n})))
+            done = asyncio.get_running_loop().create_future()
+            await batcher.put(parse_envelope({"devEUI": "a8404100ffff0005", "fPort": 1, "fCnt": 3}), done)
+            await asyncio.wait_for(done, 1)
+            await batcher.stop()
+
+        with mock.patch.object(ingestion, "process_uplink_batch", batch):
+            asyncio.run(scenario())
+        self.assertEqual(batches, [[1, 2, 3]])
+        stats = batcher.stats()
+        self.assertEqual((stats["batches"], stats["frames"], stats["queue_depth"]), (1, 3, 0))
+
+    def test_full_lane_rejects(self):
+        """File pleine : la trame est refusée sans attendre, le webhook décide de la suite selon sa priorité"""
+        batcher = UplinkBatcher(batch_size=10, max_wait_ms=10, maxsize=1, lanes=1)
+
+        async def scenario():
+            batcher._lanes[0].queue = asyncio.Queue(maxsize=1)
+            frame = parse_envelope({"devEUI": "a8404100ffff0006", "fPort": 1, "fCnt": 1})
+            return batcher.submit(frame), batcher.submit(frame)
+
+        self.assertEqual(asyncio.run(scenario()), (True, False))
+        self.assertEqual(batcher.stats()["rejected"], 1)
+
+    def test_failed_batch_releases_fcnt(self):
+        """Lot en échec : ses fCnt sont libérés, la même trame n'est pas prise pour un doublon"""
+        frame = parse_envelope({"devEUI": "a8404100ffff0001", "fPort": 1, "fCnt": 41})
+
+        async def known(dev_euis, db):
+            return {deveui_resolver.normalize(dev_eui): mock.Mock(id_vehicule=906) for dev_eui in dev_euis}
+
+        with mock.patch.object(deveui_resolver, "resolve_many", known):
+            with self.assertRaises(ConnectionError):
+                asyncio.run(process_uplink_batch([frame], FailingSession()))
+        self.assertIsNone(fcnt_window.check(frame.dev_eui, frame.f_cnt))
+        self.assertEqual(fcnt_window.check(frame.dev_eui, frame.f_cnt), "duplicate")
+
+    def test_failed_batch_forgets_stops(self):
+        """Lot en échec : les arrêts en mémoire du véhicule sont oubliés et relus depuis la base"""
+        frame = parse_envelope({"devEUI": "a8404100ffff0003", "fPort": 1, "fCnt": 5})
+        vehicle = mock.Mock(id_vehicule=907)
+        stationary.remember(907, {
+            "latitude": 3.8666, "longitude": 11.5166, "vitesse": 0.0, "dans_zone": True,
+            "timestamp_gps": frame.received_at, "timestamp_fin": None, "nb_repetitions": 1,
+        })
+
+        async def known(dev_euis, db):
+            return {deveui_resolver.normalize(dev_eui): vehicle for dev_eui in dev_euis}
+
+        with mock.patch.object(deveui_resolver, "resolve_many", known):
+            with self.assertRaises(ConnectionError):
+                asyncio.run(process_uplink_batch([frame], FailingSession()))
+        self.assertNotIn(907, stationary._last)
+
+    def test_unknown_device_gets_no_window(self):
+        """DevEUI inconnu : aucune fenêtre fCnt n'est créée pour lui"""
+        frame = parse_envelope({"devEUI": "a8404100ffff00ff", "fPort": 1, "fCnt": 7})
+
+        async def unknown(dev_euis, db):
+            return {deveui_resolver.normalize(dev_eui): None for dev_eui in dev_euis}
+
+        devices = fcnt_window.stats()["devices"]
+        with mock.patch.object(deveui_resolver, "resolve_many", unknown):
+            self.assertEqual(asyncio.run(process_uplink_batch([frame], mock.AsyncMock())), 0)
+        self.assertEqual(fcnt_window.stats()["devices"], devices)
+
+    def test_failed_batch_processed_one_by_one(self):
+        """Lot en échec : trames retraitées une à une, seules celles qui échouent encore sont comptées perdues"""
+        batcher = UplinkBatcher(batch_size=10, max_wait_ms=10, maxsize=100, lanes=1)
+        frames = [parse_envelope({"devEUI": "a8404100ffff0002", "fPort": 1, "fCnt": n}) for n in (1, 2, 3)]
+        processed = []
+
+        async def failing_batch(frames, db):
+            raise ConnectionError("lot")
+
+        async def one(frame, db):
+            if frame.f_cnt == 2:
+                raise ValueError("trame invalide")
+            processed.append(frame.f_cnt)
+
+        with mock.patch.object(ingestion, "process_uplink_batch", failing_batch), mock.patch.object(ingestion, "process_uplink", one):
+            asyncio.run(batcher._flush(batcher._lanes[0], [(frame, 0.0, None) for frame in frames]))
+        self.assertEqual(processed, [1, 3])
+        stats = batcher.stats()
+        self.assertEqual((stats["frames"], stats["dropped"]), (2, 1))
+
+    def test_retry_does_not_repeat_committed_steps(self):
+        """Lot en échec puis reprise trame par trame : la confirmation du relais, déjà validée, n'est pas rejouée"""
+        frame = parse_envelope({"devEUI": "a8404100ffff0004", "fPort": 1, "fCnt": 9, "object": {"relay_status": "cut"}})
+        vehicle = mock.Mock(id_vehicule=908, moteur_en_attente=True, moteur_coupe=False)
+        confirm = mock.AsyncMock(return_value="relay_cut_confirmed")
+
+        async def known(dev_euis, db):
+            return {deveui_resolver.normalize(dev_eui): vehicle for dev_eui in dev_euis}
+
+        with mock.patch.object(deveui_resolver, "resolve_many", known), \
+                mock.patch.object(deveui_resolver, "resolve", mock.AsyncMock(return_value=vehicle)), \
+                mock.patch.object(ingestion, "confirm_relay", confirm):
+            with self.assertRaises(ConnectionError):
+                asyncio.run(process_uplink_batch([frame], FailingSession()))
+            result = asyncio.run(process_uplink(frame, mock.AsyncMock()))
+        self.assertEqual(result, {"status": "ok", "message": "relay_cut_confirmed"})
+        confirm.assert_awaited_once()
+
+
+if __name__ == "__main__":
+    unittest.main()
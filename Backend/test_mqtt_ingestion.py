@@ -0,0 +1,79 @@
+import asyncio
+import json
+import unittest
+from unittest import mock
+
+from aiomqtt import Message
+
+from app.services import ingestion, mqtt_ingestion
+from app.services.ingestion import UplinkBatcher
+from app.services.mqtt_ingestion import SUBSCRIPTIONS, MqttConsumer, event_type
+
+
+class _PahoAcks:
+    """Enregistre les PUBACK envoyés par le consommateur."""
+
+    def __init__(self):
+        self.acked = []
+
+    def ack(self, mid, qos):
+        self.acked.append((mid, qos))
+
+
+class _Client:
+    def __init__(self):
+        self._client = _PahoAcks()
+
+
+class TestMqttIngestion(unittest.TestCase):
+
+    def test_topics(self):
+        """Abonnement aux événements rx/ack/txack de toutes les applications"""
+        self.assertIn("application/+/device/+/rx", SUBSCRIPTIONS)
+        self.assertEqual(event_type("application/1/device/a84041000181c061/txack"), "txack")
+        self.assertEqual(event_type("application/1/device/a84041000181c061/rx"), "rx")
+
+    def test_malformed_message_is_acked(self):
+        """Un message illisible est compté en échec mais acquitté (pas de redistribution infinie)"""
+        consumer = MqttConsumer("localhost", 1883, "test", max_inflight=1, max_queued=10, reconnect_interval=1)
+        client = _Client()
+        message = Message("application/1/device/x/rx", b"{not json", qos=1, retain=False, mid=42, properties=None)
+
+        async def run():
+            consumer._slots = asyncio.Semaphore(1)
+            await consumer._slots.acquire()
+            await consumer._handle(client, message)
+            return consumer._slots.locked()
+
+        self.assertFalse(asyncio.run(run()))
+        self.assertEqual(client._client.acked, [(42, 1)])
+        self.assertEqual(consumer.failed, 1)
+
+    def test_batched_uplink_acked_after_flush(self):
+        """Mode batched : la trame est acquittée une fois son lot écrit, pas à sa mise en file"""
+        consumer = MqttConsumer("localhost", 1883, "test", max_inflight=1, max_queued=10, reconnect_interval=1)
+        batcher = UplinkBatcher(batch_size=10, max_wait_ms=10, maxsize=100, lanes=1)
+        client = _Client()
+        payload = {"devEUI": "a84041000181c061", "fPort": 1, "fCnt": 5}
+        message = Message("application/1/device/a84041000181c061/rx", json.dumps(payload).encode(), qos=1, retain=False, mid=7, properties=None)
+        acked_at_flush = []
+
+        async def flush(frames, db):
+            acked_at_flush.append(list(client._client.acked))
+            return len(frames)
+
+        async def run():
+            consumer._slots = asyncio.Semaphore(1)
+            await consumer._slots.acquire()
+            batcher.start()
+            await consumer._handle(client, message)
+            await batcher.stop()
+
+        with mock.patch.object(mqtt_ingestion, "uplink_batcher", batcher), mock.patch.object(ingestion, "process_uplink_batch", flush):
+            asyncio.run(run())
+        self.assertEqual(acked_at_flush, [[]])
+        self.assertEqual(client._client.acked, [(7, 1)])
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,267 @@
+import asyncio
+import json
+import unittest
+from datetime import datetime
+
+from app.services.notification_service import CLOSE_TRY_AGAIN_LATER, ConnectionManager
+from app.services.pubsub import LocalPubSub, PostgresPubSub
+from app.services.vehicle_state import vehicle_state
+
+
+class FakeSocket:
+    """Socket de test : chaque envoi attend que `ready` soit levé (client lent) ; STREAM gardé à part."""
+
+    def __init__(self, ready=True):
+        self.sent = []
+        self.stream = None
+        self.closed_with = None
+        self.ready = asyncio.Event()
+        if ready:
+            self.ready.set()
+
+    async def accept(self):
+        pass
+
+    async def send_text(self, text):
+        await self.ready.wait()
+        if text.startswith('{"type":"STREAM"') or text.startswith('{"type":"RESYNC_REQUIRED"'):
+            self.stream = json.loads(text)
+        else:
+            self.sent.append(text)
+
+    async def close(self, code=1000):
+        self.closed_with = code
+
+
+def vehicle_update(moteur_coupe):
+    return {"type": "VEHICLE_UPDATE", "data": {"vehicle_id": 3, "moteur_coupe": moteur_coupe, "moteur_en_attente": False}}
+
+
+def alert(n):
+    return {"type": "NEW_ALERT", "data": {"id": n, "vehicle_id": 3, "message": "Sortie de zone"}}
+
+
+class TestConnectionManager(unittest.TestCase):
+
+    def test_slow_client_does_not_block_producer(self):
+        """Un téléphone lent ne retarde ni l'émetteur ni les autres sockets ; un seul encodage JSON"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            slow, fast = FakeSocket(ready=False), FakeSocket()
+            await manager.connect(slow, 1)
+            await manager.connect(fast, 1)
+            await asyncio.wait_for(manager.send_personal_message(alert(1), 1), 0.1)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(fast.sent), 1)
+            self.assertEqual(slow.sent, [])
+            slow.ready.set()
+            await asyncio.sleep(0.01)
+            self.assertIs(slow.sent[0], fast.sent[0])
+        asyncio.run(scenario())
+
+    def test_vehicle_updates_coalesced(self):
+        """Client en retard : seul le dernier état du véhicule reste en file"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            socket = FakeSocket(ready=False)
+            await manager.connect(socket, 1)
+            await manager.send_personal_message(alert(1), 1)
+            for moteur_coupe in (True, False, True):
+                await manager.send_personal_message(vehicle_update(moteur_coupe), 1)
+            socket.ready.set()
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(socket.sent), 2)
+            self.assertIn('"moteur_coupe":true', socket.sent[1])
+            self.assertEqual(manager.stats()["coalesced"], 2)
+        asyncio.run(scenario())
+
+    def test_overflow_closes_socket(self):
+        """File pleine d'alertes : le socket est fermé (1013) plutôt que de perdre une alerte"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=2, send_timeout=5, bus=LocalPubSub())
+            socket = FakeSocket(ready=False)
+            await manager.connect(socket, 1)
+            await asyncio.sleep(0)
+            for n in range(4):
+                await manager.send_personal_message(alert(n), 1)
+            await asyncio.sleep(0.01)
+            self.assertEqual(socket.closed_with, CLOSE_TRY_AGAIN_LATER)
+            self.assertEqual(manager.stats()["connections"], 0)
+            self.assertEqual(manager.stats()["overflows"], 1)
+        asyncio.run(scenario())
+
+    def test_event_from_other_worker_delivered_locally(self):
+        """Événement reçu par NOTIFY : livré aux sockets de ce worker sans ré-encodage"""
+        async def scenario():
+            bus = PostgresPubSub(dsn="postgresql://", channel="safetrack_ws", max_batch=10,
+                                 queue_size=10, reconnect_interval=1, keepalive=30)
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=bus)
+            socket = FakeSocket()
+            await manager.connect(socket, 1)
+            other = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            captured = []
+            other.bus.subscribe(captured.append)
+            await other.send_personal_message(alert(1), 1)
+            bus._on_notify(None, 4242, "safetrack_ws", captured[0])
+            await manager.send_personal_message(alert(2), 2)  # Autre utilisateur, hors connexion : rien
+            await asyncio.sleep(0.01)
+            message = json.loads(socket.sent[0])
+            self.assertEqual(message.pop("seq"), socket.stream["data"]["seq"] + 1)
+            self.assertEqual(message, alert(1))
+        asyncio.run(scenario())
+
+    def test_disconnected_bus_delivers_locally(self):
+        """Base injoignable : les sockets de ce worker reçoivent quand même leurs messages"""
+        async def scenario():
+            bus = PostgresPubSub(dsn="postgresql://", channel="safetrack_ws", max_batch=10,
+                                 queue_size=10, reconnect_interval=1, keepalive=30)
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=bus)
+            socket = FakeSocket()
+            await manager.connect(socket, 1)
+            await manager.send_personal_message(vehicle_update(True), 1)
+            await asyncio.sleep(0.01)
+            self.assertEqual(len(socket.sent), 1)
+            self.assertEqual(bus.stats()["local_only"], 1)
+        asyncio.run(scenario())
+
+    def test_subscribe_own_vehicles_only(self):
+        """Abonnement aux positions : refusé pour le véhicule d'un autre utilisateur, sauf ADMIN"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            socket, admin_socket = FakeSocket(), FakeSocket()
+            connection = await manager.connect(socket, 7)
+            admin = await manager.connect(admin_socket, 1, is_admin=True)
+            manager.publish_owner(424201, 7)
+            manager.publish_owner(424202, 8)
+            manager.handle_client_message(connection, '{"type": "SUBSCRIBE", "vehicles": [424201, 424202], "max_rate": 10}')
+            manager.handle_client_message(admin, '{"type": "SUBSCRIBE", "vehicles": [424202]}')
+            manager.handle_client_message(connection, '{"type": "PING"}')
+            await asyncio.sleep(0.01)
+            self.assertEqual(json.loads(socket.sent[0])["data"], {
+                "vehicles": [424201], "denied": [424202], "fleet": False, "bbox": None, "max_rate": 4.0,
+            })
+            self.assertEqual(json.loads(admin_socket.sent[0])["data"]["vehicles"], [424202])
+            self.assertEqual(json.loads(socket.sent[1])["type"], "ERROR")
+            # Boîtier libéré par un autre worker : l'ancien propriétaire ne peut plus s'y abonner
+            manager.handle_client_message(connection, '{"type": "UNSUBSCRIBE", "vehicles": [424201]}')
+            manager.publish_owner(424201, None)
+            manager.handle_client_message(connection, '{"type": "SUBSCRIBE", "vehicles": [424201]}')
+            await asyncio.sleep(0.01)
+            self.assertEqual(json.loads(socket.sent[-1])["data"]["denied"], [424201])
+        asyncio.run(scenario())
+
+    def test_positions_rate_limited(self):
+        """Fix plus fréquents que max_rate : seul le dernier part, aux seuls abonnés du véhicule"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub(), position_tick=0.01)
+            follower, other = FakeSocket(), FakeSocket()
+            connection = await manager.connect(follower, 1, is_admin=True)
+            await manager.connect(other, 1, is_admin=True)
+            manager.handle_client_message(connection, '{"type": "SUBSCRIBE", "vehicles": [3], "max_rate": 1}')
+            await manager.start()
+            for n in range(5):
+                manager.publish_position(3, {"vehicle_id": 3, "latitude": 3.86 + n / 100, "longitude": 11.51})
+                await asyncio.sleep(0.03)
+            await manager.stop()
+            positions = [json.loads(text) for text in follower.sent[1:]]
+            self.assertEqual([p["type"] for p in positions], ["POSITION_UPDATE"])  # Une seule par seconde
+            self.assertEqual(other.sent, [])
+            manager._flush_positions(connection.next_flush)
+            await asyncio.sleep(0.01)
+            self.assertEqual(json.loads(follower.sent[-1])["data"]["latitude"], 3.90)
+        asyncio.run(scenario())
+
+    def test_fleet_and_viewport_routing(self):
+        """Flotte et vue carte : un fix ne part qu'aux sockets dont la vue le contient, véhicules autorisés seulement"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            manager.publish_owner(424203, 7)
+            admin_map, yaounde_map, owner_fleet, other_fleet = FakeSocket(), FakeSocket(), FakeSocket(), FakeSocket()
+            for socket, user_id, message in (
+                (admin_map, 1, '{"type": "SUBSCRIBE", "bbox": [9.6, 3.9, 9.9, 4.2]}'),
+                (yaounde_map, 1, '{"type": "SUBSCRIBE", "bbox": [11.4, 3.8, 11.6, 3.9]}'),
+                (owner_fleet, 7, '{"type": "SUBSCRIBE", "fleet": true}'),
+                (other_fleet, 8, '{"type": "SUBSCRIBE", "fleet": true, "bbox": [9.6, 3.9, 9.9, 4.2]}'),
+            ):
+                connection = await manager.connect(socket, user_id, is_admin=user_id == 1)
+                manager.handle_client_message(connection, message)
+            manager.publish_position(424203, {"vehicle_id": 424203, "latitude": 4.0511, "longitude": 9.7679})
+            manager._publish_positions()
+            manager._flush_positions(0)
+            await manager.send_personal_message({"type": "VEHICLE_UPDATE", "data": {"vehicle_id": 424203, "moteur_coupe": True}}, 7)
+            await asyncio.sleep(0.01)
+            received = lambda socket: [json.loads(text)["type"] for text in socket.sent[1:]]
+            self.assertEqual(received(admin_map), ["POSITION_UPDATE", "VEHICLE_UPDATE"])
+            self.assertEqual(received(yaounde_map), [])
+            self.assertEqual(received(owner_fleet), ["POSITION_UPDATE", "VEHICLE_UPDATE"])
+            self.assertEqual(received(other_fleet), [])  # Dans sa vue, mais pas son véhicule
+            self.assertEqual(manager.stats()["viewports"]["boxes"], 3)
+        vehicle_state.update(424203, datetime.utcnow(), 4.0511, 9.7679, None)  # VEHICLE_UPDATE : dernière position connue
+        try:
+            asyncio.run(scenario())
+        finally:
+            asyncio.run(vehicle_state.remove(424203))
+
+    def test_seq_in_order_despite_coalescing(self):
+        """Mise à jour fusionnée : la plus récente passe en fin de file, les seq restent croissants"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            socket = FakeSocket(ready=False)
+            await manager.connect(socket, 1)
+            await manager.send_personal_message(vehicle_update(True), 1)
+            await manager.send_personal_message(alert(1), 1)
+            await manager.send_personal_message(vehicle_update(False), 1)
+            socket.ready.set()
+            await asyncio.sleep(0.01)
+            messages = [json.loads(text) for text in socket.sent]
+            self.assertEqual([m["type"] for m in messages], ["NEW_ALERT", "VEHICLE_UPDATE"])
+            self.assertLess(messages[0]["seq"], messages[1]["seq"])
+            self.assertEqual(manager.stats()["queued"], 0)
+        asyncio.run(scenario())
+
+    def test_resume_replays_missed_messages(self):
+        """Reconnexion avec last_seq : seuls les messages manqués, sans resynchronisation"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub())
+            first = FakeSocket()
+            await manager.connect(first, 1)
+            await manager.send_personal_message(alert(1), 1)
+            await asyncio.sleep(0.01)
+            manager.disconnect(first, 1)
+            last_seq, epoch = json.loads(first.sent[-1])["seq"], first.stream["data"]["epoch"]
+            await manager.send_personal_message(alert(2), 1)
+            await manager.send_personal_message(alert(3), 1)
+
+            second = FakeSocket()
+            await manager.connect(second, 1, last_seq=last_seq, epoch=epoch)
+            await asyncio.sleep(0.01)
+            self.assertEqual(second.stream["type"], "STREAM")
+            self.assertEqual([json.loads(text)["data"]["id"] for text in second.sent], [2, 3])
+            self.assertEqual(manager.stats()["replayed"], 2)
+        asyncio.run(scenario())
+
+    def test_resync_when_gap_evicted(self):
+        """Messages manqués sortis du tampon, ou autre worker (epoch) : RESYNC_REQUIRED"""
+        async def scenario():
+            manager = ConnectionManager(queue_size=10, send_timeout=5, bus=LocalPubSub(), replay_size=2)
+            first = FakeSocket()
+            await manager.connect(first, 1)
+            await asyncio.sleep(0.01)
+            manager.disconnect(first, 1)
+            status = first.stream["data"]
+            for n in range(3):
+                await manager.send_personal_message(alert(n), 1)
+
+            evicted, other_worker = FakeSocket(), FakeSocket()
+            await manager.connect(evicted, 1, last_seq=status["seq"], epoch=status["epoch"])
+            await manager.connect(other_worker, 1, last_seq=status["seq"] + 3, epoch="autre")
+            await asyncio.sleep(0.01)
+            for socket in (evicted, other_worker):
+                self.assertEqual(socket.stream, {"type": "RESYNC_REQUIRED", "data": {"epoch": status["epoch"], "seq": status["seq"] + 3}})
+                self.assertEqual(socket.sent, [])
+            self.assertEqual(manager.stats()["resyncs"], 2)
+        asyncio.run(scenario())
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+from datetime import datetime, timedelta
+
+from fastapi import HTTPException, Response
+
+from app.api.pagination import NEXT_CURSOR_HEADER, decode_cursor, encode_cursor, set_next_cursor
+
+T0 = datetime(2024, 1, 1, 8, 0, 0, 123456)
+
+
+class TestPagination(unittest.TestCase):
+
+    def test_cursor_round_trip(self):
+        """Un curseur redonne exactement la clé de tri encodée (microsecondes comprises)"""
+        cursor = encode_cursor(T0, 42)
+        self.assertEqual(decode_cursor(cursor, datetime, int), (T0, 42))
+        self.assertNotIn("=", cursor)  # Utilisable tel quel en paramètre d'URL
+
+    def test_malformed_cursor_rejected(self):
+        """Curseur illisible, mal typé ou de mauvaise longueur : 400"""
+        for cursor in ("pas-un-curseur", encode_cursor(T0), encode_cursor("hier", 42)):
+            with self.assertRaises(HTTPException) as ctx:
+                decode_cursor(cursor, datetime, int)
+            self.assertEqual(ctx.exception.status_code, 400)
+
+    def test_pages_follow_sort_order(self):
+        """Pages successives : ni doublon ni trou, même avec des timestamps égaux"""
+        # (timestamp_gps, id_position), triés comme read_positions : plus récent d'abord
+        rows = sorted(
+            [(T0 + timedelta(seconds=i // 3), i) for i in range(20)],
+            reverse=True,
+        )
+        seen, cursor = [], None
+        while True:
+            page = [row for row in rows if cursor is None or row < decode_cursor(cursor, datetime, int)][:6]
+            seen.extend(page)
+            response = Response()
+            set_next_cursor(response, page, 6, lambda row: row)
+            cursor = response.headers.get(NEXT_CURSOR_HEADER)
+            if cursor is None:
+                break
+        self.assertEqual(seen, rows)
+
+    def test_no_cursor_on_last_page(self):
+        """Page incomplète : pas d'en-tête X-Next-Cursor"""
+        response = Response()
+        set_next_cursor(response, [(T0, 1)], 6, lambda row: row)
+        self.assertNotIn(NEXT_CURSOR_HEADER, response.headers)
+
+
+if __name__ == "__main__":
+    unittest.main()
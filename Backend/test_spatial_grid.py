@@ -0,0 +1,46 @@
+import unittest
+
+from app.services.spatial_grid import SpatialGrid, parse_bbox
+
+YAOUNDE = (3.8666, 11.5166)
+DOUALA = (4.0511, 9.7679)
+
+
+class TestSpatialGrid(unittest.TestCase):
+
+    def test_query_only_containing_boxes(self):
+        """Un fix ne correspond qu'aux vues qui le contiennent, même dans la même cellule"""
+        grid = SpatialGrid(cell_degrees=0.5)
+        grid.insert("centre", (11.4, 3.8, 11.6, 3.9))
+        grid.insert("voisin", (11.55, 3.75, 11.7, 3.85))
+        grid.insert("littoral", (9.6, 3.9, 9.9, 4.2))
+        self.assertEqual(grid.query(*YAOUNDE), ["centre"])
+        self.assertEqual(grid.query(*DOUALA), ["littoral"])
+
+    def test_move_and_remove(self):
+        """Déplacement de la carte : la vue quitte ses anciennes cellules"""
+        grid = SpatialGrid(cell_degrees=0.5)
+        grid.insert("carte", (11.4, 3.8, 11.6, 3.9))
+        grid.insert("carte", (9.6, 3.9, 9.9, 4.2))
+        self.assertEqual(grid.query(*YAOUNDE), [])
+        self.assertEqual(grid.query(*DOUALA), ["carte"])
+        grid.remove("carte")
+        self.assertEqual(grid.stats(), {"boxes": 0, "cells": 0, "large": 0})
+
+    def test_large_box_kept_apart(self):
+        """Vue de tout le pays : testée à part, sans remplir la grille"""
+        grid = SpatialGrid(cell_degrees=0.5, max_cells=16)
+        grid.insert("pays", parse_bbox([8.4, 1.6, 16.2, 13.1]))
+        self.assertEqual(grid.stats()["cells"], 0)
+        self.assertEqual(grid.query(*DOUALA), ["pays"])
+
+    def test_parse_bbox(self):
+        """bbox mal formée ou inversée : refusée"""
+        self.assertEqual(parse_bbox(["9.6", 3.9, 9.9, 4.2]), (9.6, 3.9, 9.9, 4.2))
+        for value in ([9.9, 3.9, 9.6, 4.2], [9.6, 3.9, 9.9], "9.6,3.9,9.9,4.2", [0, -91, 1, 0]):
+            with self.assertRaises(ValueError):
+                parse_bbox(value)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,62 @@
+import unittest
+from datetime import datetime, timedelta
+
+from app.services.stationary import StationaryCompressor
+
+T0 = datetime(2024, 1, 1, 22, 0)
+
+
+def row(lat, lon, speed=0.0, ts=T0, dans_zone=True):
+    return {
+        "latitude": lat, "longitude": lon, "vitesse": speed, "dans_zone": dans_zone,
+        "timestamp_gps": ts, "timestamp_fin": None, "nb_repetitions": 1,
+    }
+
+
+def compressor():
+    return StationaryCompressor(True, radius_m=15.0, max_speed_kmh=5.0, max_run_seconds=86400, max_gap_seconds=1800)
+
+
+class TestStationaryCompression(unittest.TestCase):
+
+    def test_parked_fixes_extend_the_row(self):
+        """Véhicule garé la nuit : les fix suivants prolongent la même ligne"""
+        c = compressor()
+        stored = c.remember(1, row(3.8666, 11.5166), id_position=10)
+        for i in range(1, 5):
+            ts = T0 + timedelta(minutes=5 * i)
+            run = c.match(1, 3.86661, 11.51661, 0.0, True, ts)  # ~1.5 m de dérive GPS
+            self.assertIs(run, stored)
+            run.extend(ts)
+        self.assertEqual(stored.nb_repetitions, 5)
+        self.assertEqual(stored.timestamp_fin, T0 + timedelta(minutes=20))
+
+    def test_new_row_when_moving_or_far(self):
+        """Un fix en mouvement, éloigné ou après un changement de zone ouvre une nouvelle ligne"""
+        c = compressor()
+        c.remember(1, row(3.8666, 11.5166), id_position=10)
+        ts = T0 + timedelta(minutes=5)
+        self.assertIsNone(c.match(1, 3.8666, 11.5166, 30.0, True, ts))
+        self.assertIsNone(c.match(1, 3.8670, 11.5166, 0.0, True, ts))  # ~45 m
+        self.assertIsNone(c.match(1, 3.8666, 11.5166, 0.0, False, ts))
+        self.assertIsNone(c.match(2, 3.8666, 11.5166, 0.0, True, ts))
+
+    def test_gap_closes_the_run(self):
+        """Boîtier silencieux plus longtemps que le seuil : l'arrêt n'est pas prolongé"""
+        c = compressor()
+        c.remember(1, row(3.8666, 11.5166), id_position=10)
+        self.assertIsNone(c.match(1, 3.8666, 11.5166, 0.0, True, T0 + timedelta(hours=1)))
+
+    def test_pending_row_of_the_batch(self):
+        """Arrêt commencé dans le même micro-lot : la ligne à insérer est prolongée"""
+        c = compressor()
+        pending = row(3.8666, 11.5166)
+        run = c.remember(1, pending)
+        ts = T0 + timedelta(minutes=1)
+        c.match(1, 3.8666, 11.5166, 0.0, True, ts).extend(ts)
+        self.assertIs(run.row, pending)
+        self.assertEqual((pending["timestamp_fin"], pending["nb_repetitions"]), (ts, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
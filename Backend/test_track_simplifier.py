@@ -0,0 +1,86 @@
+import random
+import unittest
+from datetime import datetime, timedelta
+
+from app.services.track_simplifier import TrackSimplifier
+
+
+def make_track(n, seed=42):
+    """Trajet aléatoire autour de Yaoundé, un point toutes les 30 s"""
+    rng = random.Random(seed)
+    t0 = datetime(2024, 1, 1)
+    lat, lon = 3.8666, 11.5166
+    timestamps, lats, lons = [], [], []
+    for i in range(n):
+        lat += rng.uniform(-0.0003, 0.0003)
+        lon += rng.uniform(-0.0003, 0.0003)
+        timestamps.append(t0 + timedelta(seconds=30 * i))
+        lats.append(lat)
+        lons.append(lon)
+    return timestamps, lats, lons
+
+
+def feed(simplifier, track, chunk):
+    timestamps, lats, lons = track
+    for i in range(0, len(timestamps), chunk):
+        simplifier.add(timestamps[i:i + chunk], lats[i:i + chunk], lons[i:i + chunk])
+
+
+class TestTrackSimplifier(unittest.TestCase):
+
+    def test_straight_line_keeps_endpoints(self):
+        """Une ligne droite se réduit à ses deux extrémités"""
+        t0 = datetime(2024, 1, 1)
+        timestamps = [t0 + timedelta(seconds=i) for i in range(500)]
+        lats = [3.8 + i * 1e-5 for i in range(500)]
+        lons = [11.5 + i * 1e-5 for i in range(500)]
+        simplifier = TrackSimplifier(tolerance_m=1.0)
+        feed(simplifier, (timestamps, lats, lons), 128)
+        points = simplifier.finish(max_points=1000)
+        self.assertEqual([p[0] for p in points], [timestamps[0], timestamps[-1]])
+        self.assertEqual(simplifier.total, 500)
+
+    def test_zero_tolerance_keeps_everything(self):
+        """Tolérance nulle : aucun point n'est supprimé, même découpé en morceaux"""
+        track = make_track(1000)
+        simplifier = TrackSimplifier(tolerance_m=0.0)
+        feed(simplifier, track, 97)
+        points = simplifier.finish(max_points=5000)
+        self.assertEqual([p[0] for p in points], track[0])
+
+    def test_max_points_respected_and_ordered(self):
+        """Le budget de points est respecté, extrémités conservées, ordre chronologique"""
+        track = make_track(5000)
+        simplifier = TrackSimplifier(tolerance_m=2.0)
+        feed(simplifier, track, 1000)
+        points = simplifier.finish(max_points=200)
+        self.assertEqual(len(points), 200)
+        self.assertEqual(points[0][0], track[0][0])
+        self.assertEqual(points[-1][0], track[0][-1])
+        times = [p[0] for p in points]
+        self.assertEqual(times, sorted(times))
+
+    def test_stops_are_kept(self):
+        """Un arrêt compressé (timestamp_fin) survit à la simplification et au budget de points"""
+        t0 = datetime(2024, 1, 1)
+        timestamps = [t0 + timedelta(seconds=i) for i in range(500)]
+        lats = [3.8 + i * 1e-5 for i in range(500)]
+        lons = [11.5 + i * 1e-5 for i in range(500)]
+        ends = [None] * 500
+        ends[250] = t0 + timedelta(hours=8)
+        simplifier = TrackSimplifier(tolerance_m=1.0)
+        for i in range(0, 500, 128):
+            simplifier.add(timestamps[i:i + 128], lats[i:i + 128], lons[i:i + 128], ends[i:i + 128])
+        points = simplifier.finish(max_points=2)
+        self.assertEqual([p[0] for p in points], [timestamps[0], timestamps[250], timestamps[-1]])
+        self.assertEqual(points[1][3], ends[250])
+
+    def test_empty(self):
+        """Aucune position sur la période"""
+        simplifier = TrackSimplifier(tolerance_m=5.0)
+        self.assertEqual(simplifier.finish(max_points=100), [])
+        self.assertEqual(simplifier.total, 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+import base64
+import json
+import struct
+import unittest
+from datetime import datetime
+
+from app.services.uplink_schema import parse_envelope, parse_uplink
+
+DEV_EUI = "a84041000181c061"
+
+
+def b64(data):
+    return base64.b64encode(data).decode()
+
+
+class TestUplinkSchema(unittest.TestCase):
+
+    def test_v4_binary_frame(self):
+        """ChirpStack v4 sans codec : la trame FPort 1 est décodée par le backend"""
+        frame = parse_uplink({
+            "deviceInfo": {"devEui": DEV_EUI}, "fCnt": 7, "fPort": 1,
+            "data": b64(struct.pack(">ffH", 3.8666, 11.5166, 305)),
+        })
+        self.assertEqual(frame.dev_eui, DEV_EUI)
+        self.assertEqual(frame.f_cnt, 7)
+        self.assertAlmostEqual(frame.latitude, 3.8666, places=5)
+        self.assertEqual(frame.speed, 30.5)
+
+    def test_v3_object_json_any_case(self):
+        """ChirpStack v3 : devEUI au premier niveau, objectJSON en texte, casse quelconque"""
+        frame = parse_uplink({
+            "devEUI": DEV_EUI, "fCnt": 3, "fPort": 2,
+            "objectJSON": json.dumps({"Latitude": 3.8, "LONGITUDE": 11.5, "speed": 12}),
+        })
+        self.assertEqual(frame.dev_eui, DEV_EUI)
+        self.assertEqual((frame.latitude, frame.longitude, frame.speed), (3.8, 11.5, 12.0))
+        self.assertEqual(frame.satellites, 0)
+
+    def test_unusual_envelope_casing(self):
+        """Clés d'enveloppe inhabituelles : DevEUI encodé en Base64, FCNT en majuscules"""
+        frame = parse_envelope({"DevEui": b64(bytes.fromhex(DEV_EUI)).rstrip("="), "FCNT": 9})
+        self.assertEqual(frame.dev_eui, DEV_EUI)
+        self.assertEqual(frame.f_cnt, 9)
+
+    def test_receipt_time(self):
+        """Heure de réception prise à la lecture de l'enveloppe, pas au traitement du lot"""
+        before = datetime.utcnow()
+        first = parse_envelope({"devEUI": DEV_EUI, "fCnt": 1})
+        second = parse_envelope({"devEUI": DEV_EUI, "fCnt": 2})
+        self.assertLessEqual(before, first.received_at)
+        self.assertLessEqual(first.received_at, second.received_at)
+
+    def test_relay_acknowledgements(self):
+        """Accusé relais : FPort 10, ou longueur de trame quand le FPort est absent"""
+        self.assertEqual(parse_uplink({"devEUI": DEV_EUI, "fPort": 10, "data": b64(b"\x00")}).relay_status, "cut")
+        self.assertEqual(parse_uplink({"devEUI": DEV_EUI, "data": b64(b"\x00\x00")}).relay_status, "active")
+        self.assertEqual(parse_uplink({"devEUI": DEV_EUI, "object": {"relay_cut": True}}).relay_status, "cut")
+
+    def test_missing_dev_eui(self):
+        """Sans DevEUI, le webhook répond 400"""
+        self.assertIsNone(parse_envelope({"fCnt": 1}).dev_eui)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,172 @@
+import asyncio
+import unittest
+from datetime import datetime
+
+from sqlalchemy.dialects import postgresql
+
+from app.api.v1.endpoints.vehicles import with_last_state
+from app.models.vehicle import Vehicle
+from app.services.vehicle_state import _FLUSH_STATEMENT, VehicleStateStore, vehicle_state
+
+
+def row(vehicle_id, owner):
+    now = datetime.utcnow()
+    return Vehicle(
+        id_vehicule=vehicle_id, deveui=f"a8404100{vehicle_id:08x}", statut="ACTIF",
+        moteur_coupe=False, moteur_en_attente=False, mode_auto=False,
+        id_utilisateur_proprietaire=owner, created_at=now, updated_at=now,
+    )
+
+
+class TestVehicleState(unittest.TestCase):
+
+    def test_updates_coalesce_per_vehicle(self):
+        """Plusieurs fix d'un véhicule entre deux flush : une seule ligne, la plus récente"""
+        store = VehicleStateStore()
+        store.update(1, datetime(2024, 1, 1, 8, 0), 3.86, 11.51, 10)
+        store.update(1, datetime(2024, 1, 1, 8, 1), 3.87, 11.52, None)
+        store.update(2, datetime(2024, 1, 1, 8, 1), 4.05, 9.70, 3)
+        self.assertEqual(store.stats()["dirty"], 2)
+        self.assertEqual(store.get(1).values(), {
+            "vehicle_id": 1,
+            "fix_time": datetime(2024, 1, 1, 8, 1),
+            "derniere_communication": datetime(2024, 1, 1, 8, 1),
+            "derniere_position_lat": 3.87,
+            "derniere_position_lon": 11.52,
+            "dernier_fcnt": 10,  # Trame sans fCnt : le dernier connu est conservé
+        })
+
+    def test_flush_never_moves_row_back(self):
+        """Flush : la ligne n'est réécrite que par un fix plus récent que celui déjà stocké"""
+        sql = str(_FLUSH_STATEMENT.compile(dialect=postgresql.dialect()))
+        self.assertIn("vehicule.derniere_communication IS NULL OR vehicule.derniere_communication < %(fix_time)s", sql)
+
+    def test_clear_drops_pending_write(self):
+        """Libération du boîtier : l'ancienne position n'est pas réécrite au flush suivant"""
+        store = VehicleStateStore()
+        store.update(1, datetime(2024, 1, 1, 8, 0), 3.86, 11.51, 10)
+        asyncio.run(store.clear(1))
+        self.assertIsNone(store.get(1).derniere_position_lat)
+        self.assertEqual(store.stats()["dirty"], 0)
+        asyncio.run(store.flush())  # Rien à écrire : aucune connexion ouverte
+        self.assertEqual(store.stats()["flushes"], 0)
+
+    def test_response_served_from_store(self):
+        """La liste des véhicules renvoie la position du store, plus récente que la ligne"""
+        now = datetime.utcnow()
+        vehicle = Vehicle(
+            id_vehicule=424242, deveui="A84041000181C061", statut="ACTIF",
+            moteur_coupe=False, moteur_en_attente=False, mode_auto=False,
+            created_at=now, updated_at=now, derniere_position_lat=1.0, derniere_position_lon=1.0,
+        )
+        self.assertEqual(with_last_state(vehicle).derniere_position_lat, 1.0)
+        vehicle_state.update(424242, now, 3.86, 11.51, None)
+        try:
+            out = with_last_state(vehicle)
+            self.assertEqual((out.derniere_position_lat, out.derniere_position_lon), (3.86, 11.51))
+            self.assertEqual(out.derniere_communication, now)
+        finally:
+            asyncio.run(vehicle_state.remove(424242))
+
+    def test_response_keeps_newer_row(self):
+        """Ligne plus récente que le store (fix écrit par un autre worker) : la ligne l'emporte"""
+        now = datetime.utcnow()
+        vehicle = Vehicle(
+            id_vehicule=424243, deveui="A84041000181C062", statut="ACTIF",
+            moteur_coupe=False, moteur_en_attente=False, mode_auto=False, created_at=now, updated_at=now,
+            derniere_communication=now, derniere_position_lat=1.0, derniere_position_lon=1.0,
+        )
+        vehicle_state.update(424243, datetime(2024, 1, 1, 8, 0), 3.86, 11.51, None)
+        try:
+            out = with_last_state(vehicle)
+            self.assertEqual((out.derniere_position_lat, out.derniere_communication), (1.0, now))
+        finally:
+            asyncio.run(vehicle_state.remove(424243))
+
+    def test_live_delta_only_changed_vehicles(self):
+        """since_version : seuls les véhicules modifiés depuis, filtrés par propriétaire"""
+        store = VehicleStateStore()
+        store.refresh(row(1, owner=7))
+        store.refresh(row(2, owner=8))
+        version = store.version
+        self.assertIsNone(store.changes(version - 10**9))  # Antérieure au démarrage : snapshot complet
+        self.assertEqual(store.changes(version), ([], []))
+
+        store.update(2, datetime(2024, 1, 1, 8, 0), 3.86, 11.51, None)
+        vehicles, removed = store.changes(version)
+        self.assertEqual([v["id_vehicule"] for v in vehicles], [2])
+        self.assertEqual(vehicles[0]["derniere_position_lat"], 3.86)
+        self.assertEqual(store.changes(version, owner=7), ([], []))
+        self.assertEqual(len(store.snapshot(owner=8)), 1)
+
+    def test_live_tombstones(self):
+        """Véhicule supprimé ou libéré : retiré chez les clients qui le voyaient"""
+        store = VehicleStateStore()
+        store.refresh(row(1, owner=7))
+        store.refresh(row(2, owner=7))
+        version = store.version
+        store.refresh(row(1, owner=None))  # Libération
+        asyncio.run(store.remove(2))
+        self.assertEqual(store.changes(version, owner=7), ([], [2, 1]))
+        vehicles, removed = store.changes(version)  # ADMIN : le boîtier libéré reste visible
+        self.assertEqual(([v["id_vehicule"] for v in vehicles], removed), ([1], [2]))
+
+    def test_dropped_tombstones_force_snapshot(self):
+        """Au-delà des tombstones conservées, une version trop ancienne reçoit la flotte complète"""
+        store = VehicleStateStore(max_tombstones=2)
+        version = store.version
+        for vehicle_id in (1, 2, 3):
+            store.refresh(row(vehicle_id, owner=7))
+            asyncio.run(store.remove(vehicle_id))
+        self.assertIsNone(store.changes(version))
+        self.assertEqual(store.changes(store.version), ([], []))
+
+    def test_version_token_bound_to_worker(self):
+        """Jeton de version : servi en delta par le worker qui l'a émis, snapshot complet ailleurs"""
+        store, other = VehicleStateStore(), VehicleStateStore()
+        token = store.token(store.version)
+        self.assertEqual(store.parse_token(token), store.version)
+        self.assertIsNone(other.parse_token(token))
+        self.assertIsNone(store.parse_token(str(store.version)))  # Ancien format (entier seul)
+        self.assertIsNone(store.parse_token(f"{store.epoch}.abc"))
+
+    def test_owner_version_follows_own_vehicles(self):
+        """ETag : la version d'un propriétaire ne bouge qu'avec ses propres véhicules"""
+        store = VehicleStateStore()
+        store.refresh(row(1, owner=7))
+        store.refresh(row(2, owner=8))
+        mine = store.owner_version(7)
+        store.update(2, datetime(2024, 1, 1, 8, 0), 3.86, 11.51, None)
+        self.assertEqual(store.owner_version(7), mine)
+        self.assertEqual(store.owner_version(), store.version)  # ADMIN : toute la flotte
+        store.refresh(row(1, owner=None))  # Libération : le propriétaire le perd de vue
+        self.assertGreater(store.owner_version(7), mine)
+        mine = store.owner_version(8)
+        asyncio.run(store.remove(2))
+        self.assertGreater(store.owner_version(8), mine)
+
+    def test_reconcile_picks_up_changes_made_elsewhere(self):
+        """Réconciliation : position écrite par un autre worker et véhicule supprimé hors du backend"""
+        store = VehicleStateStore()
+        store.refresh(row(1, owner=7))
+        store.refresh(row(2, owner=8))
+        same = row(3, owner=7)
+        store.refresh(same)
+        moved = row(1, owner=7)
+        moved.derniere_communication, moved.derniere_position_lat, moved.derniere_position_lon = datetime(2024, 1, 1, 8, 0), 3.86, 11.51
+
+        async def fleet():
+            return [moved, same]
+        store._read_fleet = fleet
+        version, unchanged = store.version, store.get(3).version
+        asyncio.run(store.reconcile())
+        vehicles, removed = store.changes(version)
+        self.assertEqual(([v["id_vehicule"] for v in vehicles], removed), ([1], [2]))
+        self.assertEqual(vehicles[0]["derniere_position_lat"], 3.86)
+        self.assertEqual(store.get(3).version, unchanged)
+        self.assertGreater(store.owner_version(7), version)  # ETag du propriétaire invalidé
+        self.assertEqual(store.stats()["dirty"], 0)  # Déjà en base : rien à réécrire
+
+
+if __name__ == "__main__":
+    unittest.main()
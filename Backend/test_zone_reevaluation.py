@@ -0,0 +1,144 @@
+import asyncio
+import unittest
+from types import SimpleNamespace
+from unittest import mock
+
+from sqlalchemy.dialects import postgresql
+
+from app.models.reevaluation import ZoneReevaluation
+from app.models.zone import Zone
+from app.services import zone_reevaluation as reevaluation_module
+from app.services.zone_reevaluation import ZoneReevaluationRunner
+
+
+class _Stream:
+    def __init__(self, chunks):
+        self.chunks = chunks
+
+    async def partitions(self, size):
+        for chunk in self.chunks:
+            yield chunk
+
+
+class FakeSession:
+    """Session du job : positions lues par `stream`, objets par `get`, requêtes enregistrées."""
+
+    def __init__(self, objects=None, chunks=(), rowcount=1, count=0, claimed=()):
+        self.objects = objects or {}
+        self.chunks = list(chunks)
+        self.rowcount = rowcount
+        self.count = count
+        self.claimed = list(claimed)
+        self.statements = []
+        self.commits = 0
+        self.rollbacks = 0
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    async def get(self, model, key):
+        return self.objects[model]
+
+    async def scalar(self, statement):
+        return self.count
+
+    async def stream(self, statement):
+        return _Stream(self.chunks)
+
+    async def execute(self, statement, params=None):
+        self.statements.append(statement)
+        return SimpleNamespace(rowcount=self.rowcount, all=lambda: list(self.claimed))
+
+    async def commit(self):
+        self.commits += 1
+
+    async def rollback(self):
+        self.rollbacks += 1
+
+
+def sessions(*fakes):
+    return mock.patch.object(reevaluation_module, "SessionLocal", side_effect=list(fakes))
+
+
+def params(statement) -> dict:
+    return statement.compile(dialect=postgresql.dialect()).params
+
+
+def job(**kwargs):
+    values = dict(
+        id_reevaluation=9, id_zone=1, id_vehicule=4, dernier_id_position=0, id_position_max=100,
+        positions_total=None, positions_traitees=0,
+    )
+    values.update(kwargs)
+    return SimpleNamespace(**values)
+
+
+ZONE = SimpleNamespace(id_zone=1, type="CIRCLE", latitude_centre=3.8666, longitude_centre=11.5166,
+                       rayon_metres=500, coordinates=None)
+CHUNKS = [
+    [(10, 3.8666, 11.5166), (11, 3.9, 11.5166)],
+    [(12, 3.8667, 11.5166)],
+]
+
+
+class TestZoneReevaluation(unittest.TestCase):
+
+    def runner(self):
+        return ZoneReevaluationRunner(chunk_size=2, lease_seconds=300)
+
+    def test_job_checkpoints_each_chunk(self):
+        """Un point de reprise par lot (dernier id, total traité), puis TERMINEE ; le total est compté par le job"""
+        runner = self.runner()
+        pending = job()
+        write = FakeSession({ZoneReevaluation: pending, Zone: ZONE}, count=3)
+        with sessions(FakeSession(chunks=CHUNKS), write):
+            asyncio.run(runner._process(9))
+
+        self.assertEqual(pending.positions_total, 3)
+        checkpoints = [params(s) for s in write.statements if s.table.name == "reevaluation_zone"]
+        self.assertEqual(
+            [(c.get("dernier_id_position"), c.get("positions_traitees")) for c in checkpoints[:2]],
+            [(11, 2), (12, 3)],
+        )
+        self.assertEqual((checkpoints[2]["statut"], checkpoints[2]["proprietaire"]), ("TERMINEE", None))
+        # Seul le propriétaire d'un job encore EN_COURS écrit son point de reprise
+        self.assertEqual((checkpoints[0]["statut_1"], checkpoints[0]["proprietaire_1"]), ("EN_COURS", runner.worker))
+        positions = [s for s in write.statements if s.table.name == "position_gps"]
+        self.assertEqual(len(positions), 2)
+
+    def test_job_resumes_from_checkpoint(self):
+        """Reprise : le total déjà compté et les positions traitées sont conservés"""
+        runner = self.runner()
+        write = FakeSession({ZoneReevaluation: job(dernier_id_position=11, positions_total=3, positions_traitees=2), Zone: ZONE})
+        with sessions(FakeSession(chunks=CHUNKS[1:]), write):
+            asyncio.run(runner._process(9))
+        checkpoint = params(write.statements[1])
+        self.assertEqual((checkpoint["dernier_id_position"], checkpoint["positions_traitees"]), (12, 3))
+
+    def test_job_stops_when_cancelled_elsewhere(self):
+        """Job annulé ou repris par un autre worker : le lot en cours est annulé et le job s'arrête"""
+        runner = self.runner()
+        write = FakeSession({ZoneReevaluation: job(positions_total=3), Zone: ZONE}, rowcount=0)
+        with sessions(FakeSession(chunks=CHUNKS), write):
+            asyncio.run(runner._process(9))
+        self.assertEqual((write.rollbacks, write.commits), (1, 0))
+        self.assertEqual(len(write.statements), 2)  # Premier lot puis point de reprise refusé
+
+    def test_resume_claims_free_jobs(self):
+        """Démarrage : seuls les jobs réclamés par cet UPDATE … RETURNING sont relancés"""
+        runner = self.runner()
+        db = FakeSession(claimed=[(9, 1), (10, 2)])
+        with sessions(db), mock.patch.object(runner, "_launch") as launch:
+            asyncio.run(runner.resume_pending())
+        claim = params(db.statements[0])
+        self.assertEqual((claim["statut_1"], claim["proprietaire"]), ("EN_COURS", runner.worker))
+        self.assertIn("proprietaire IS NULL", str(db.statements[0].compile(dialect=postgresql.dialect())))
+        self.assertEqual(launch.call_args_list, [mock.call(9, 1), mock.call(10, 2)])
+        self.assertEqual(db.commits, 1)
+
+
+if __name__ == "__main__":
+    unittest.main()